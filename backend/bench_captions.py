@@ -0,0 +1,40 @@
+# bench_captions.py
+"""
+Compare BLIP captioning throughput across batch sizes on this host (CPU).
+
+    python bench_captions.py data/memories/*/images/*.png --batch-sizes 1,4,8,16
+"""
+import argparse
+import glob
+import time
+
+from model_registry import registry
+from providers import blip_caption_images_local
+
+
+def run():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("images", nargs="*", help="image files (default: all memory images)")
+    ap.add_argument("--batch-sizes", default="1,2,4,8,16")
+    ap.add_argument("--repeat", type=int, default=1, help="repeat the image list to get a bigger sample")
+    args = ap.parse_args()
+
+    images = args.images or sorted(glob.glob("data/memories/*/images/*") + glob.glob("data/memories/*/frames/*.jpg"))
+    images = images * max(1, args.repeat)
+    if not images:
+        print("no images found")
+        return
+
+    # load once so the first batch size does not pay model load time
+    registry.get("blip")
+    print(f"{len(images)} images")
+    print(f"{'batch':>6} {'seconds':>9} {'img/s':>8}")
+    for bs in [int(x) for x in args.batch_sizes.split(",") if x.strip()]:
+        t0 = time.perf_counter()
+        blip_caption_images_local(images, batch_size=bs)
+        dt = time.perf_counter() - t0
+        print(f"{bs:>6} {dt:>9.2f} {len(images) / dt:>8.2f}")
+
+
+if __name__ == "__main__":
+    run()
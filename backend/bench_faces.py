@@ -0,0 +1,67 @@
+# bench_faces.py
+"""
+Face detection throughput vs. number of pool workers (cache and
+near-duplicate grouping bypassed).
+
+    python bench_faces.py data/memories/*/images/* --repeat 20 --workers 1,2,4,8
+"""
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+import face_engine
+import near_dupes
+from blobstore import DerivedCache
+
+
+def run():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("images", nargs="*")
+    ap.add_argument("--repeat", type=int, default=10, help="copies of each image, each with a distinct content hash so the cache "
+                         "can't serve them (near-duplicate grouping is off for the run)")
+    ap.add_argument("--workers", default=f"1,2,4,{os.cpu_count()}")
+    args = ap.parse_args()
+
+    src = args.images or sorted(glob.glob("data/memories/*/images/*"))
+    if not src:
+        print("no images found")
+        return
+
+    tmp = tempfile.mkdtemp(prefix="faces_bench_")
+    # copies are pixel-identical, so grouping would detect only the first of
+    # each; keep the library's hash table out of it too
+    near_dupes.PHASH_THRESHOLD = 0
+    near_dupes.hash_index = near_dupes.HashIndex(os.path.join(tmp, "near_dupes.sqlite3"))
+    # every copy gets a distinct byte so content hashes differ
+    images = []
+    for r in range(args.repeat):
+        for i, p in enumerate(src):
+            dst = os.path.join(tmp, f"{r:03d}_{i:03d}{os.path.splitext(p)[1]}")
+            shutil.copy(p, dst)
+            with open(dst, "ab") as f:
+                f.write(bytes([r % 256]))
+            images.append(dst)
+    print(f"{len(images)} images")
+    print(f"{'workers':>8} {'seconds':>9} {'img/s':>8} {'speedup':>8}")
+
+    base = None
+    for w in [int(x) for x in args.workers.split(",") if x.strip()]:
+        # fresh cache dir per run so nothing is reused
+        face_engine.derived = DerivedCache(tempfile.mkdtemp(dir=tmp))
+        out = tempfile.mkdtemp(dir=tmp)
+        if w > 1:
+            # pay pool/model start-up outside the timed region
+            face_engine._get_pool(w).submit(int).result()
+        t0 = time.perf_counter()
+        face_engine.detect_faces_batch(images, out, workers=w)
+        dt = time.perf_counter() - t0
+        base = base or dt
+        print(f"{w:>8} {dt:>9.2f} {len(images) / dt:>8.2f} {base / dt:>7.2f}x")
+    face_engine.shutdown()
+
+
+if __name__ == "__main__":
+    run()
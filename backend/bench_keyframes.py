@@ -0,0 +1,84 @@
+# bench_keyframes.py
+# Time keyframe extraction on long videos: per-frame seeking (the old way)
+# vs. the single-pass uniform and scene modes in media_utils.
+#   python bench_keyframes.py path/to/video.mp4 ...
+#   python bench_keyframes.py --synth-seconds 600      (generates a test clip)
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from media_utils import extract_keyframes
+
+
+def _seek_baseline(video_path: str, out_dir: str, max_frames: int = 5):
+    """The previous implementation: CAP_PROP_POS_FRAMES seek before every read."""
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 0
+    if total == 0:
+        return []
+    step = max(1, total // max_frames)
+    frames, idx, saved = [], 0, 0
+    while cap.isOpened() and saved < max_frames:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        ok, frame = cap.read()
+        if not ok:
+            break
+        out_path = os.path.join(out_dir, f"frame_{saved+1:02d}.jpg")
+        cv2.imwrite(out_path, frame)
+        frames.append(out_path)
+        saved += 1
+        idx += step
+    cap.release()
+    return frames
+
+
+def _synth_video(seconds: int, path: str, fps: int = 30, size=(1280, 720)):
+    """A clip with a hard scene cut every 20s so scene mode has something to find."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    rng = np.random.default_rng(0)
+    base = None
+    for i in range(seconds * fps):
+        if i % (20 * fps) == 0:
+            base = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        frame = np.roll(base, i % size[0], axis=1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def run():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("videos", nargs="*")
+    ap.add_argument("--synth-seconds", type=int, default=0)
+    ap.add_argument("--max-frames", type=int, default=5)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="kf_bench_")
+    videos = list(args.videos)
+    if args.synth_seconds or not videos:
+        secs = args.synth_seconds or 300
+        print(f"generating {secs}s synthetic video ...")
+        videos.append(_synth_video(secs, os.path.join(tmp, "synth.mp4")))
+
+    methods = {
+        "seek (old)": lambda v, d: _seek_baseline(v, d, args.max_frames),
+        "uniform": lambda v, d: extract_keyframes(v, d, args.max_frames, mode="uniform"),
+        "scene": lambda v, d: extract_keyframes(v, d, args.max_frames, mode="scene"),
+    }
+    for v in videos:
+        print(f"\n{v}")
+        for name, fn in methods.items():
+            out = tempfile.mkdtemp(dir=tmp)
+            t0 = time.perf_counter()
+            frames = fn(v, out)
+            dt = time.perf_counter() - t0
+            size = sum(os.path.getsize(f) for f in frames)
+            print(f"  {name:<11} {dt:7.2f}s  {len(frames)} frames  {size / 1e3:8.0f} KB")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,212 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from cache import TTLCache
+
+DATA_ROOT = Path(__file__).parent / "data"
+BLOB_ROOT = DATA_ROOT / "blobs"
+DERIVED_ROOT = DATA_ROOT / "derived"
+
+_HASH_CHUNK = 1024 * 1024
+# file hashes remembered per process (LRU)
+HASH_MEMO_SIZE = int(os.getenv("HASH_MEMO_SIZE", "100000"))
+
+
+def sha256_file(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# (path, size, mtime_ns) -> sha256, so repeated lookups of files that were not
+# hashed on upload (frames, legacy memories) are free after the first time
+_hash_memo = TTLCache(maxsize=HASH_MEMO_SIZE)
+
+
+def file_hash(path) -> str:
+    """Content hash of a memory file, using metadata.json file_info when present."""
+    path = Path(path)
+    st = path.stat()
+    key = (str(path.resolve()), st.st_size, st.st_mtime_ns)
+    h = _hash_memo.get(key)
+    if h is None:
+        h = _hash_from_metadata(path, st.st_size) or sha256_file(path)
+        _hash_memo.put(key, h)
+    return h
+
+
+def _hash_from_metadata(path: Path, size: int) -> Optional[str]:
+    # metadata.json sits in the memory folder; files live there or one level down
+    for folder in (path.parent, path.parent.parent):
+        meta = folder / "metadata.json"
+        if not meta.exists():
+            continue
+        try:
+            info = json.loads(meta.read_text(encoding="utf-8")).get("file_info") or {}
+        except Exception:
+            return None
+        rel = path.relative_to(folder).as_posix()
+        entry = info.get(rel)
+        if entry and entry.get("size") == size:
+            return entry.get("sha256")
+        return None
+    return None
+
+
+def version_key(version: str) -> str:
+    """Short stable key for a model/prompt version string."""
+    return hashlib.sha1(version.encode("utf-8")).hexdigest()[:12]
+
+
+def _link_or_copy(src: Path, dest: Path):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.link")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        # filesystems without hard links (or cross-device): fall back to a copy
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dest)
+    # rename is a no-op when dest already is a link to the same file
+    tmp.unlink(missing_ok=True)
+
+
+class BlobStore:
+    """
+    Content-addressed storage: data/blobs/ab/abcdef...  Memory folders keep
+    their usual file names but as hard links to the blob, so identical
+    uploads share one copy on disk and /files keeps serving them unchanged.
+    """
+
+    def __init__(self, root: Path = BLOB_ROOT):
+        self.root = Path(root)
+
+    def path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def has(self, sha256: str) -> bool:
+        return self.path(sha256).exists()
+
+    def adopt(self, file_path, sha256: str) -> bool:
+        """
+        Make `file_path` reference the blob for `sha256`. Returns True when the
+        content was already stored (i.e. a duplicate upload).
+        """
+        file_path = Path(file_path)
+        blob = self.path(sha256)
+        if blob.exists():
+            if not _same_file(blob, file_path):
+                _link_or_copy(blob, file_path)
+            return True
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(file_path, blob)
+        except FileExistsError:
+            _link_or_copy(blob, file_path)
+            return True
+        except OSError:
+            shutil.copy2(file_path, blob)
+        return False
+
+    def link_into(self, sha256: str, dest) -> Path:
+        dest = Path(dest)
+        _link_or_copy(self.path(sha256), dest)
+        return dest
+
+
+def _same_file(a: Path, b: Path) -> bool:
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+class DerivedCache:
+    """
+    Results derived from a blob (captions, faces, transcripts, keyframes),
+    keyed by blob hash and a model/prompt version string:
+
+        data/derived/<kind>/<version_key>/<ab>/<sha256>.json   (JSON value)
+        data/derived/<kind>/<version_key>/<ab>/<sha256>/       (artefact files)
+    """
+
+    def __init__(self, root: Path = DERIVED_ROOT):
+        self.root = Path(root)
+        self.hits = 0
+        self.misses = 0
+        self._counts_lock = threading.Lock()
+
+    def _base(self, kind: str, sha256: str, version: str) -> Path:
+        return self.root / kind / version_key(version) / sha256[:2] / sha256
+
+    def get(self, kind: str, sha256: str, version: str) -> Optional[Any]:
+        f = self._base(kind, sha256, version).with_suffix(".json")
+        try:
+            value = json.loads(f.read_text(encoding="utf-8"))["value"]
+        except Exception:  # missing or unreadable
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return value
+
+    def _count(self, hit: bool):
+        with self._counts_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, kind: str, sha256: str, version: str, value: Any):
+        f = self._base(kind, sha256, version).with_suffix(".json")
+        f.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f.with_name(f".{f.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"version": version, "value": value}), encoding="utf-8")
+        os.replace(tmp, f)
+
+    def artefact_dir(self, kind: str, sha256: str, version: str) -> Path:
+        d = self._base(kind, sha256, version)
+        d.mkdir(parents=True, exist_ok=True)
+        return d
+
+    def stats(self) -> Dict[str, int]:
+        with self._counts_lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+blobs = BlobStore()
+derived = DerivedCache()
+
+
+def link_file(src, dest) -> Path:
+    """Hard-link (or copy) a cached artefact into a memory folder."""
+    dest = Path(dest)
+    _link_or_copy(Path(src), dest)
+    return dest
+
+
+def adopt_existing(media_root: Path) -> Dict[str, int]:
+    """One-off migration: move already uploaded memory files into the blob store."""
+    media_exts = {".jpg", ".jpeg", ".png", ".webp", ".mp4", ".mov", ".mkv", ".mp3", ".m4a", ".wav"}
+    stats = {"files": 0, "duplicates": 0}
+    for mem in sorted(Path(media_root).iterdir()):
+        if not mem.is_dir():
+            continue
+        candidates = [*mem.iterdir(), *((mem / "images").iterdir() if (mem / "images").is_dir() else [])]
+        for p in candidates:
+            if p.is_file() and p.suffix.lower() in media_exts:
+                stats["files"] += 1
+                if blobs.adopt(p, file_hash(p)):
+                    stats["duplicates"] += 1
+    return stats
+
+
+if __name__ == "__main__":
+    print(adopt_existing(DATA_ROOT / "memories"))
@@ -0,0 +1,267 @@
+import json
+import base64
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from people_index import normalize, people_from_faces
+from thumbnails import DEFAULT_THUMB_SIZE, cover_source, load_memory_thumbnails
+from tts import narration_files
+
+CATALOG_DB = Path(__file__).parent / "data" / "catalog.sqlite3"
+MEDIA_ROOT = Path(__file__).parent / "data" / "memories"
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+VIDEO_EXTS = {".mp4", ".mov", ".mkv"}
+AUDIO_EXTS = {".mp3", ".m4a", ".wav"}
+SORT_KEYS = ("created_at", "updated_at")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    id           TEXT PRIMARY KEY,
+    created_at   TEXT NOT NULL,
+    updated_at   TEXT NOT NULL,
+    status       TEXT,
+    thumbnail    TEXT,
+    people       TEXT NOT NULL DEFAULT '[]',   -- display names
+    people_norm  TEXT NOT NULL DEFAULT '[]',   -- normalised, for filtering
+    images       TEXT NOT NULL DEFAULT '[]',   -- /files URLs
+    videos       TEXT NOT NULL DEFAULT '[]',
+    audio        TEXT NOT NULL DEFAULT '[]',
+    story        TEXT NOT NULL DEFAULT '',
+    audio_url    TEXT,
+    extra        TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS memories_created ON memories(created_at, id);
+CREATE INDEX IF NOT EXISTS memories_updated ON memories(updated_at, id);
+CREATE INDEX IF NOT EXISTS memories_status ON memories(status, created_at);
+CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('version', '0');
+"""
+
+_JSON_COLS = ("people", "images", "videos", "audio", "extra")
+
+
+def _url(path: Path, media_root: Path) -> str:
+    return f"/files/{path.relative_to(media_root).as_posix()}"
+
+
+def _created_at(folder: Path, meta: Dict) -> str:
+    if meta.get("created_at"):
+        return meta["created_at"]
+    # memory_YYYYMMDD_HHMMSS_<uuid>
+    try:
+        return datetime.strptime("_".join(folder.name.split("_")[1:3]), "%Y%m%d_%H%M%S").isoformat()
+    except ValueError:
+        return datetime.fromtimestamp(folder.stat().st_mtime).isoformat()
+
+
+def scan_memory(folder: Path, media_root: Path = MEDIA_ROOT) -> Dict[str, Any]:
+    """Read one memory folder into a catalog row (the only place that walks it)."""
+    meta = {}
+    meta_path = folder / "metadata.json"
+    if meta_path.exists():
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"[catalog] unreadable {meta_path}:", e)
+
+    images_dir = folder / "images"
+    images = sorted(p for p in images_dir.iterdir() if p.suffix.lower() in IMAGE_EXTS) if images_dir.exists() else []
+    top = sorted(p for p in folder.iterdir() if p.is_file())
+    videos = [p for p in top if p.suffix.lower() in VIDEO_EXTS]
+    audio = [p for p in top if p.suffix.lower() in AUDIO_EXTS]
+
+    story_file = folder / "story.txt"
+    story = story_file.read_text(encoding="utf-8") if story_file.exists() else ""
+    # narration: the configured TTS_FORMAT (m4a by default), then whatever else was rendered
+    candidates = narration_files(folder / "tts")
+    audio_file = next((f for f in candidates if f.exists()), candidates[0])
+    people = people_from_faces(folder)
+
+    # generated thumbnails when ready, otherwise the lazy endpoint makes them
+    thumbs = load_memory_thumbnails(folder)
+    cover = thumbs.get("cover") if thumbs else None
+    if cover:
+        # a cover written under other THUMB_SIZES may lack the size; take its largest
+        size = str(DEFAULT_THUMB_SIZE) if str(DEFAULT_THUMB_SIZE) in cover else max(cover, key=int)
+        thumbnail = cover[size]["jpg"]
+    elif cover_source(folder) is not None:
+        thumbnail = f"/thumb/{folder.name}?size={DEFAULT_THUMB_SIZE}"
+    else:
+        thumbnail = None
+
+    return {
+        "id": folder.name,
+        "created_at": _created_at(folder, meta),
+        "updated_at": datetime.now().isoformat(),
+        "status": meta.get("status"),
+        "thumbnail": thumbnail,
+        "people": people,
+        "people_norm": json.dumps([normalize(p) for p in people]),
+        "images": [_url(p, media_root) for p in images],
+        "videos": [_url(p, media_root) for p in videos],
+        "audio": [_url(p, media_root) for p in audio],
+        "story": story,
+        "audio_url": _url(audio_file, media_root) if audio_file.exists() else None,
+        "extra": {"has_transcript": (folder / "transcript.txt").exists(),
+                  "captions_count": meta.get("captions_count"),
+                  "thumbnails": cover},
+    }
+
+
+def _encode_cursor(value: str, mid: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, mid]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    pad = "=" * (-len(cursor) % 4)
+    try:
+        value, mid = json.loads(base64.urlsafe_b64decode(cursor + pad))
+    except (ValueError, TypeError):  # bad base64/JSON/shape (binascii.Error is a ValueError)
+        raise ValueError("invalid cursor")
+    if not isinstance(mid, str):
+        raise ValueError("invalid cursor")
+    return value, mid
+
+
+class Catalog:
+    """
+    Embedded SQLite (WAL) catalog of memories. Rows are refreshed from the
+    folder whenever upload/process/story/narrate/tag write to it, so listing
+    and detail reads never touch the filesystem.
+    """
+
+    def __init__(self, db_path: Path = CATALOG_DB, media_root: Path = MEDIA_ROOT):
+        self.db_path = Path(db_path)
+        self.media_root = Path(media_root)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def version(self) -> int:
+        row = self._conn().execute("SELECT value FROM catalog_meta WHERE key='version'").fetchone()
+        return int(row[0])
+
+    def _bump(self, c: sqlite3.Connection):
+        c.execute("UPDATE catalog_meta SET value = CAST(value AS INTEGER) + 1 WHERE key='version'")
+
+    def upsert(self, row: Dict[str, Any]):
+        vals = {k: (json.dumps(v) if k in _JSON_COLS else v) for k, v in row.items()}
+        cols = ", ".join(vals)
+        marks = ", ".join("?" * len(vals))
+        updates = ", ".join(f"{k}=excluded.{k}" for k in vals if k != "id")
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute(f"INSERT INTO memories ({cols}) VALUES ({marks}) "
+                      f"ON CONFLICT(id) DO UPDATE SET {updates}", tuple(vals.values()))
+            self._bump(c)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def refresh(self, memory_id: str):
+        """Re-read one memory folder into the catalog (or drop it if gone)."""
+        folder = self.media_root / memory_id
+        if not folder.is_dir():
+            self.delete(memory_id)
+            return None
+        row = scan_memory(folder, self.media_root)
+        self.upsert(row)
+        return row
+
+    def delete(self, memory_id: str):
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute("DELETE FROM memories WHERE id=?", (memory_id,))
+            self._bump(c)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict[str, Any]:
+        d = dict(row)
+        for k in _JSON_COLS:
+            d[k] = json.loads(d[k]) if d.get(k) else ([] if k != "extra" else {})
+        d.pop("people_norm", None)
+        d["thumbnails"] = d["extra"].get("thumbnails")
+        return d
+
+    def get(self, memory_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM memories WHERE id=?", (memory_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def list(self, limit: Optional[int] = 50, cursor: Optional[str] = None, sort: str = "created_at",
+             order: str = "desc", status: Optional[str] = None,
+             person: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Keyset-paginated listing (limit=None: everything). Returns (rows, next_cursor)."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+        desc = order.lower() != "asc"
+        where, params = [], []
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if person and normalize(person):
+            where.append("EXISTS (SELECT 1 FROM json_each(memories.people_norm) WHERE value = ?)")
+            params.append(normalize(person))
+        if cursor:
+            value, mid = _decode_cursor(cursor)
+            where.append(f"({sort}, id) {'<' if desc else '>'} (?, ?)")
+            params.extend([value, mid])
+        sql = (f"SELECT id, created_at, updated_at, status, thumbnail, people, images, videos, audio, extra "
+               f"FROM memories {'WHERE ' + ' AND '.join(where) if where else ''} "
+               f"ORDER BY {sort} {'DESC' if desc else 'ASC'}, id {'DESC' if desc else 'ASC'} LIMIT ?")
+        rows = self._conn().execute(sql, (*params, -1 if limit is None else limit + 1)).fetchall()
+        items = []
+        for r in (rows if limit is None else rows[:limit]):
+            d = dict(r)
+            for k in ("people", "images", "videos", "audio", "extra"):
+                d[k] = json.loads(d[k])
+            d["thumbnails"] = d["extra"].get("thumbnails")  # size -> {webp, jpg} URLs
+            items.append(d)
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            last = items[-1]
+            next_cursor = _encode_cursor(last[sort], last["id"])
+        return items, next_cursor
+
+    def rebuild(self) -> int:
+        """Recover the catalog from the folders on disk."""
+        seen = set()
+        for folder in sorted(self.media_root.iterdir()):
+            if folder.is_dir():
+                self.upsert(scan_memory(folder, self.media_root))
+                seen.add(folder.name)
+        for (mid,) in self._conn().execute("SELECT id FROM memories").fetchall():
+            if mid not in seen:
+                self.delete(mid)
+        return len(seen)
+
+
+catalog = Catalog()
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["rebuild"]:
+        print(f"catalog rebuilt: {catalog.rebuild()} memories")
+    else:
+        print("usage: python catalog.py rebuild")
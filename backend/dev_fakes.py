@@ -0,0 +1,210 @@
+# dev_fakes.py
+"""
+Local stand-ins for the external APIs, for development and load tests.
+
+    uvicorn dev_fakes:app --port 8765
+    GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=fake uvicorn main:app
+    OLLAMA_BASE_URL=http://127.0.0.1:8765 LLM_PROVIDER=ollama uvicorn main:app
+
+Covers Gemini embeddings (batchEmbedContents) and text generation
+(generateContent / streamGenerateContent?alt=sse, a canned story streamed
+word by word every FAKE_TOKEN_MS), captions/transcripts for inline or
+uploaded media, the resumable File API upload, and the Ollama API (/api/generate,
+streamed as NDJSON or not, /api/embed, /api/tags). FAKE_LATENCY_MS adds per-request latency,
+and FAKE_FAIL_RATE makes that fraction of requests answer 429 with a
+Retry-After header, so retries and rate limiting can be exercised.
+"""
+import os
+import json
+import uuid
+import base64
+import random
+import asyncio
+import hashlib
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FAKE_LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "20"))
+FAKE_FAIL_RATE = float(os.getenv("FAKE_FAIL_RATE", "0"))
+FAKE_EMBED_DIM = int(os.getenv("FAKE_EMBED_DIM", "768"))
+FAKE_TOKEN_MS = float(os.getenv("FAKE_TOKEN_MS", "30"))
+
+app = FastAPI()
+counters = {"requests": 0, "throttled": 0, "embedded": 0, "generated": 0, "media": 0, "uploaded": 0}
+files = {}  # fake File API: id -> {"data", "mime"}
+
+
+def fake_vector(text: str, dim: int = FAKE_EMBED_DIM):
+    """Deterministic unit vector per text, so repeated runs index identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (v / np.linalg.norm(v)).round(6).tolist()
+
+
+async def _throttle():
+    counters["requests"] += 1
+    if FAKE_LATENCY_MS:
+        await asyncio.sleep(FAKE_LATENCY_MS / 1000 * random.uniform(0.5, 1.5))
+    if FAKE_FAIL_RATE and random.random() < FAKE_FAIL_RATE:
+        counters["throttled"] += 1
+        return JSONResponse({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}},
+                            status_code=429, headers={"Retry-After": "0.2"})
+    return None
+
+
+@app.post("/v1beta/models/{model}:batchEmbedContents")
+async def batch_embed(model: str, request: Request):
+    throttled = await _throttle()
+    if throttled:
+        return throttled
+    body = await request.json()
+    texts = [" ".join(p.get("text", "") for p in r["content"]["parts"]) for r in body.get("requests", [])]
+    counters["embedded"] += len(texts)
+    return {"embeddings": [{"values": fake_vector(t)} for t in texts]}
+
+
+def fake_story(prompt: str) -> str:
+    """A short deterministic 'story' that echoes the prompt's people line."""
+    people = next((l.split(":", 1)[1].strip() for l in prompt.splitlines() if l.startswith("People")), "someone")
+    h = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:6]
+    return (f"It was a gentle day with {people}. "
+            f"Everyone laughed and the light was soft. "
+            f"You were safe, and you were loved. ({h})")
+
+
+def _prompt_text(body) -> str:
+    return "\n".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+
+
+def _media_reply(body):
+    """A caption/transcript for the first media part, or None for text-only prompts."""
+    for c in body.get("contents", []):
+        for p in c.get("parts", []):
+            if "inline_data" in p:
+                mime, data = p["inline_data"]["mime_type"], base64.b64decode(p["inline_data"]["data"])
+            elif "file_data" in p:
+                f = files[p["file_data"]["file_uri"].rsplit("/", 1)[-1]]
+                mime, data = f["mime"], f["data"]
+            else:
+                continue
+            counters["media"] += 1
+            h = hashlib.sha256(data).hexdigest()[:6]
+            if mime.startswith("image/"):
+                return f"A warm {mime.split('/')[1]} moment shared together ({h})."
+            return f"Hello, it's so good to see you again ({h})."
+    return None
+
+
+def _words(text: str):
+    parts = text.split(" ")
+    return [w + (" " if i < len(parts) - 1 else "") for i, w in enumerate(parts)]
+
+
+def _candidate(text: str):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+
+@app.post("/v1beta/models/{model}:generateContent")
+async def generate(model: str, request: Request):
+    throttled = await _throttle()
+    if throttled:
+        return throttled
+    counters["generated"] += 1
+    body = await request.json()
+    return _candidate(_media_reply(body) or fake_story(_prompt_text(body)))
+
+
+@app.post("/v1beta/models/{model}:streamGenerateContent")
+async def stream_generate(model: str, request: Request):
+    throttled = await _throttle()
+    if throttled:
+        return throttled
+    counters["generated"] += 1
+    text = fake_story(_prompt_text(await request.json()))
+
+    async def events():
+        for w in _words(text):
+            await asyncio.sleep(FAKE_TOKEN_MS / 1000)
+            yield f"data: {json.dumps(_candidate(w))}\r\n\r\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/upload/v1beta/files")
+async def upload_start(request: Request):
+    throttled = await _throttle()
+    if throttled:
+        return throttled
+    fid = uuid.uuid4().hex[:12]
+    files[fid] = {"mime": request.headers.get("x-goog-upload-header-content-type", "application/octet-stream"),
+                  "data": b""}
+    url = str(request.base_url).rstrip("/") + f"/upload/v1beta/files/{fid}:session"
+    return JSONResponse({}, headers={"x-goog-upload-url": url, "x-goog-upload-status": "active"})
+
+
+@app.post("/upload/v1beta/files/{fid}:session")
+async def upload_finalize(fid: str, request: Request):
+    files[fid]["data"] = await request.body()
+    counters["uploaded"] += 1
+    return {"file": _file_resource(fid, "PROCESSING")}
+
+
+def _file_resource(fid: str, state: str):
+    base = "http://fake/v1beta/files"
+    return {"name": f"files/{fid}", "uri": f"{base}/{fid}", "mimeType": files[fid]["mime"],
+            "sizeBytes": str(len(files[fid]["data"])), "state": state}
+
+
+@app.get("/v1beta/files/{fid}")
+def get_file(fid: str):
+    return _file_resource(fid, "ACTIVE")
+
+
+# ----- Ollama -----
+@app.post("/api/generate")
+async def ollama_generate(request: Request):
+    throttled = await _throttle()
+    if throttled:
+        return JSONResponse({"error": "server busy"}, status_code=503)
+    body = await request.json()
+    model = body.get("model", "")
+    if not body.get("prompt"):  # load-only request
+        return {"model": model, "response": "", "done": True, "done_reason": "load"}
+    counters["generated"] += 1
+    if body.get("images"):
+        text = f"A warm moment captured in a photo ({hashlib.sha256(body['images'][0].encode()).hexdigest()[:6]})."
+    else:
+        text = fake_story(body["prompt"])
+    if not body.get("stream", True):
+        return {"model": model, "response": text, "done": True}
+
+    async def lines():
+        for w in _words(text):
+            await asyncio.sleep(FAKE_TOKEN_MS / 1000)
+            yield json.dumps({"model": model, "response": w, "done": False}) + "\n"
+        yield json.dumps({"model": model, "response": "", "done": True}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/api/embed")
+async def ollama_embed(request: Request):
+    throttled = await _throttle()
+    if throttled:
+        return JSONResponse({"error": "server busy"}, status_code=503)
+    body = await request.json()
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    counters["embedded"] += len(texts)
+    return {"model": body.get("model"), "embeddings": [fake_vector(t) for t in texts]}
+
+
+@app.get("/api/tags")
+def ollama_tags():
+    return {"models": [{"name": "llava"}, {"name": "gpt-oss-20b"}, {"name": "nomic-embed-text"}]}
+
+
+@app.get("/_stats")
+def stats():
+    return counters
@@ -0,0 +1,190 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from http_utils import (
+    RETRY_STATUS, LatencyStats, RetryableError, TokenBucket, call_with_retry, retry_after_seconds,
+)
+from model_registry import registry
+from ollama_client import get_ollama_client, ollama_base_url
+
+# overridden by GEMINI_BASE_URL, e.g. http://127.0.0.1:8765 for dev_fakes.py
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+GEMINI_EMBED_MODEL = os.getenv("GEMINI_EMBED_MODEL", "text-embedding-004")
+LOCAL_EMBED_MODEL = "all-MiniLM-L6-v2"
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))      # batchEmbedContents max
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))      # batches in flight
+EMBED_RPS = float(os.getenv("EMBED_RPS", "5"))                    # requests/second, 0 = unlimited
+EMBED_RETRIES = int(os.getenv("EMBED_RETRIES", "5"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "30"))           # per HTTP request
+EMBED_DEADLINE = float(os.getenv("EMBED_DEADLINE", "300"))        # per embed() call, retries included
+
+
+def _load_minilm():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(LOCAL_EMBED_MODEL)
+
+
+registry.register("minilm", _load_minilm)
+
+
+class EmbeddingClient:
+    """Splits texts into batches and embeds them with bounded concurrency."""
+
+    version = ""
+    batch_size = EMBED_BATCH_SIZE
+    concurrency = 1
+
+    def __init__(self):
+        self.latency = LatencyStats()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def _embed_batch(self, texts: List[str], deadline: float) -> List[List[float]]:
+        raise NotImplementedError
+
+    def _timed_batch(self, texts: List[str], deadline: float) -> List[List[float]]:
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            out = self._embed_batch(texts, deadline)
+            ok = True
+            return out
+        finally:
+            self.latency.record(time.perf_counter() - t0, ok=ok, items=len(texts))
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        deadline = time.monotonic() + EMBED_DEADLINE
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.concurrency <= 1:
+            results = [self._timed_batch(b, deadline) for b in batches]
+        else:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed")
+            results = list(self._pool.map(lambda b: self._timed_batch(b, deadline), batches))
+        return [v for batch in results for v in batch]
+
+    def stats(self) -> Dict:
+        return {"version": self.version, **self.latency.stats()}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+class LocalEmbeddingClient(EmbeddingClient):
+    version = f"local:{LOCAL_EMBED_MODEL}"
+    batch_size = 256
+
+    def _embed_batch(self, texts, deadline):
+        with registry.use("minilm") as model:
+            return model.encode(texts, normalize_embeddings=True).tolist()
+
+
+class OllamaEmbeddingClient(EmbeddingClient):
+    """/api/embed on the shared Ollama client (which caps concurrency itself)."""
+
+    batch_size = 64
+
+    def __init__(self, model: str = OLLAMA_EMBED_MODEL):
+        super().__init__()
+        self.model = model
+        self.version = f"ollama:{model}"
+        self.concurrency = EMBED_CONCURRENCY
+
+    def _embed_batch(self, texts, deadline):
+        return get_ollama_client().embed(self.model, texts)
+
+
+class GeminiEmbeddingClient(EmbeddingClient):
+    """batchEmbedContents over one pooled HTTP client, rate-limited and retried."""
+
+    def __init__(self, api_key: str, base_url: str = GEMINI_BASE_URL, model: str = GEMINI_EMBED_MODEL):
+        import httpx
+        super().__init__()
+        self.model = model
+        self.version = f"gemini:{model}"
+        self.batch_size = min(EMBED_BATCH_SIZE, 100)
+        self.concurrency = EMBED_CONCURRENCY
+        self.bucket = TokenBucket(EMBED_RPS, capacity=max(1, EMBED_CONCURRENCY))
+        self._httpx = httpx
+        self.http = httpx.Client(
+            base_url=base_url.rstrip("/"),
+            headers={"x-goog-api-key": api_key},
+            timeout=EMBED_TIMEOUT,
+            limits=httpx.Limits(max_connections=EMBED_CONCURRENCY, max_keepalive_connections=EMBED_CONCURRENCY),
+        )
+
+    def _request(self, texts: List[str], deadline: float) -> List[List[float]]:
+        self.bucket.acquire(deadline=deadline)
+        body = {"requests": [{"model": f"models/{self.model}", "content": {"parts": [{"text": t}]}}
+                             for t in texts]}
+        timeout = max(1.0, min(EMBED_TIMEOUT, deadline - time.monotonic()))
+        try:
+            r = self.http.post(f"/v1beta/models/{self.model}:batchEmbedContents", json=body, timeout=timeout)
+        except self._httpx.TransportError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}")
+        if r.status_code in RETRY_STATUS:
+            raise RetryableError(f"HTTP {r.status_code}", retry_after=retry_after_seconds(r.headers))
+        r.raise_for_status()
+        embs = [e["values"] for e in r.json()["embeddings"]]
+        if len(embs) != len(texts):
+            raise ValueError(f"expected {len(texts)} embeddings, got {len(embs)}")
+        return embs
+
+    def _embed_batch(self, texts, deadline):
+        return call_with_retry(lambda: self._request(texts, deadline), retries=EMBED_RETRIES, deadline=deadline)
+
+    def close(self):
+        super().close()
+        self.http.close()
+
+
+_clients: Dict[tuple, EmbeddingClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_embedding_client() -> EmbeddingClient:
+    """
+    One client per process and provider config (env is read lazily, after
+    load_dotenv). EMBED_PROVIDER picks gemini/ollama/local explicitly;
+    otherwise LLM_PROVIDER=gemini with a key uses Gemini, anything else MiniLM.
+    """
+    provider = (os.getenv("EMBED_PROVIDER") or os.getenv("LLM_PROVIDER", "gemini")).lower()
+    api_key = os.getenv("GEMINI_API_KEY")
+    if provider == "gemini" and api_key:
+        key = ("gemini", api_key, os.getenv("GEMINI_BASE_URL", GEMINI_BASE_URL))
+    elif provider == "ollama" and os.getenv("EMBED_PROVIDER"):
+        key = ("ollama", ollama_base_url(), OLLAMA_EMBED_MODEL)
+    else:
+        key = ("local",)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                if key[0] == "gemini":
+                    client = GeminiEmbeddingClient(api_key, key[2])
+                elif key[0] == "ollama":
+                    client = OllamaEmbeddingClient()
+                else:
+                    client = LocalEmbeddingClient()
+                _clients[key] = client
+    return client
+
+
+def embedding_stats() -> Dict:
+    return {c.version: c.stats() for c in list(_clients.values())}
+
+
+def close_clients():
+    with _clients_lock:
+        for c in _clients.values():
+            c.close()
+        _clients.clear()
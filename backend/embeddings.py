@@ -1,72 +1,168 @@
 import os
-import json
+import hashlib
+import sqlite3
+import threading
 from pathlib import Path
-from typing import List, Dict
+from typing import TYPE_CHECKING, List, Dict
 
 import chromadb
 from chromadb.config import Settings
 
-PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+if TYPE_CHECKING:
+    import numpy as np
+
+import memory_state
+from cache import TTLCache
+from embedding_client import get_embedding_client
+from lexical_index import lexical_index, normalize_bm25, query_terms
+from passages import iter_passages, passage_hash, read_head
+from people_index import PEOPLE_MODES, people_index, people_from_faces
+
+# person-filtered searches score exactly when the candidate set is this small
+EXACT_SEARCH_MAX = int(os.getenv("EXACT_SEARCH_MAX", "5000"))
+# reciprocal rank fusion constant; larger flattens the contribution of top ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+# hybrid queries this short are answered lexically when k memories contain every term
+LEXICAL_FAST_MAX_TERMS = int(os.getenv("LEXICAL_FAST_MAX_TERMS", "3"))
+SEARCH_MODES = ("hybrid", "vector", "lexical")
+# passages embedded/upserted per round trip while streaming a memory's text
+PASSAGE_BATCH = int(os.getenv("PASSAGE_BATCH", "64"))
+# ANN over passages fetches this many per wanted memory (hits cluster per memory)
+PASSAGE_FANOUT = int(os.getenv("PASSAGE_FANOUT", "8"))
+# person-filtered passage searches score exactly when the candidates have at most this many passages
+EXACT_PASSAGE_MAX = int(os.getenv("EXACT_PASSAGE_MAX", "20000"))
+# transcript/story text given to the lexical index per memory; the full text
+# stays searchable through its passages
+LEXICAL_TEXT_MAX_CHARS = int(os.getenv("LEXICAL_TEXT_MAX_CHARS", str(1024 * 1024)))
+
 CHROMA_PATH = str((Path(__file__).parent / "data" / "chroma").resolve())
 COLLECTION_NAME = os.getenv("EMB_COLLECTION", "memories")
+# bumped on every index write so cached search results go stale; a SQLite
+# counter, so concurrent bumps from API, job workers and reindex never collide
+INDEX_VERSION_DB = Path(__file__).parent / "data" / "index_version.sqlite3"
+# names the collection searches and upserts go to; reindex.py swaps it after a rebuild
+ACTIVE_FILE = Path(CHROMA_PATH) / "active_collection"
+
+query_cache = TTLCache(maxsize=int(os.getenv("QUERY_CACHE_SIZE", "2048")),
+                       ttl=float(os.getenv("QUERY_CACHE_TTL", "86400")))
+result_cache = TTLCache(maxsize=int(os.getenv("RESULT_CACHE_SIZE", "1024")),
+                        ttl=float(os.getenv("RESULT_CACHE_TTL", "600")))
 
 
 # ----- EMBEDDINGS -----
-def _embed_texts_gemini(texts: List[str]) -> List[List[float]]:
-    import google.generativeai as genai
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    model = "text-embedding-004"
-    return [genai.embed_content(model=model, content=t)["embedding"] for t in texts]
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    return get_embedding_client().embed(texts)
 
 
-def _embed_texts_local(texts: List[str]) -> List[List[float]]:
-    from sentence_transformers import SentenceTransformer
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    return model.encode(texts, normalize_embeddings=True).tolist()
+def embedding_version() -> str:
+    """Identifies the embedding space; vectors from different versions don't mix."""
+    return get_embedding_client().version
 
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
-    if PROVIDER == "gemini" and os.getenv("GEMINI_API_KEY"):
-        return _embed_texts_gemini(texts)
-    return _embed_texts_local(texts)
+def _normalize_query(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def embed_query(text: str) -> List[float]:
+    """embed_texts for a single search query, memoised by (provider/model, normalised text)."""
+    key = (embedding_version(), _normalize_query(text))
+    emb = query_cache.get(key)
+    if emb is None:
+        emb = embed_texts([text])[0]
+        query_cache.put(key, emb)
+    return emb
+
+
+_version_local = threading.local()
+
+
+def _version_conn() -> sqlite3.Connection:
+    conn = getattr(_version_local, "conn", None)
+    if conn is None:
+        INDEX_VERSION_DB.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(INDEX_VERSION_DB), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS counter (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        _version_local.conn = conn
+    return conn
+
+
+def index_version() -> int:
+    row = _version_conn().execute("SELECT value FROM counter WHERE name = 'index'").fetchone()
+    return row[0] if row else 0
+
+
+def bump_index_version():
+    # a single UPSERT: the read-increment-write happens inside SQLite's write lock
+    _version_conn().execute("INSERT INTO counter (name, value) VALUES ('index', 1) "
+                            "ON CONFLICT(name) DO UPDATE SET value = value + 1")
+    result_cache.clear()
 
 
 # ----- CHROMA DB -----
 client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(allow_reset=True))
 
-collection = client.get_or_create_collection(
-    COLLECTION_NAME,
-    metadata={"hnsw:space": "cosine"}
-)
+_active = {"mtime": None, "name": None, "collection": None, "passages": None}
+_active_lock = threading.Lock()
+
+
+def open_collection(name: str):
+    return client.get_or_create_collection(name, metadata={"hnsw:space": "cosine"})
+
+
+def active_collection_name() -> str:
+    try:
+        name = ACTIVE_FILE.read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        name = ""
+    return name or COLLECTION_NAME
+
+
+def get_collection():
+    """The active memories collection, re-opened when the pointer file changes."""
+    try:
+        mtime = ACTIVE_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if _active["collection"] is None or mtime != _active["mtime"]:
+        with _active_lock:
+            name = active_collection_name()
+            if _active["collection"] is None or name != _active["name"]:
+                _active["collection"] = open_collection(name)
+                _active["passages"] = open_collection(passages_collection_name(name))
+                _active["name"] = name
+            _active["mtime"] = mtime
+    return _active["collection"]
+
+
+def passages_collection_name(name: str) -> str:
+    return f"{name}_passages"
+
+
+def get_passages_collection():
+    """Passage vectors (many per memory) paired with the active memories collection."""
+    get_collection()
+    return _active["passages"]
+
+
+def set_active_collection(name: str):
+    """Atomically point every process at `name`."""
+    ACTIVE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = ACTIVE_FILE.with_name(f".{ACTIVE_FILE.name}.{os.getpid()}")
+    tmp.write_text(name, encoding="utf-8")
+    os.replace(tmp, ACTIVE_FILE)
+    bump_index_version()
 
 
 def build_memory_doc(mem_folder: Path) -> Dict:
-    captions = []
-    f = mem_folder / "captions.json"
-    if f.exists():
-        try:
-            captions = json.loads(f.read_text())
-        except:
-            pass
-
-    transcript = ""
-    f = mem_folder / "transcript.txt"
-    if f.exists():
-        transcript = f.read_text()
-
-    people = []
-    f = mem_folder / "faces.json"
-    if f.exists():
-        try:
-            faces = json.loads(f.read_text())
-            people = [x["label"] for x in faces if x.get("label")]
-        except:
-            pass
-
-    story = ""
-    f = mem_folder / "story.txt"
-    if f.exists():
-        story = f.read_text()
+    captions = memory_state.read(mem_folder, "captions.json", default=[])
+
+    # read up to a cap, never whole: transcripts of long recordings can be huge
+    transcript = read_head(mem_folder / "transcript.txt", LEXICAL_TEXT_MAX_CHARS)
+
+    people = people_from_faces(mem_folder)
+
+    story = read_head(mem_folder / "story.txt", LEXICAL_TEXT_MAX_CHARS)
 
     desc = []
 
@@ -85,7 +181,28 @@ def build_memory_doc(mem_folder: Path) -> Dict:
     return {
         "text": "\n".join(desc),
         "people": people,
-        "has_story": bool(story)
+        "has_story": bool(story),
+        # untruncated, for the lexical index
+        "fields": {
+            "people": " ".join(people),
+            "captions": "\n".join(str(c) for c in captions),
+            "transcript": transcript,
+            "story": story,
+        },
+    }
+
+
+def doc_hash(doc: Dict) -> str:
+    """Changes when the document text or the embedding space does."""
+    return hashlib.sha256(f"{embedding_version()}\n{doc['text']}".encode("utf-8")).hexdigest()
+
+
+def doc_metadata(memory_id: str, doc: Dict) -> Dict:
+    return {
+        "memory_id": memory_id,
+        "people": ", ".join(doc["people"]) if doc["people"] else "",
+        "has_story": doc["has_story"],
+        "doc_hash": doc_hash(doc),
     }
 
 
@@ -97,32 +214,293 @@ def index_memory(memory_id: str, media_root: Path):
     doc = build_memory_doc(mem_folder)
     emb = embed_texts([doc["text"]])[0]
 
-    collection.upsert(
+    get_collection().upsert(
         ids=[memory_id],
         embeddings=[emb],
         documents=[doc["text"]],
-        metadatas=[{
-            "people": ", ".join(doc["people"]) if doc["people"] else "",
-            "has_story": doc["has_story"]
-        }]
+        metadatas=[doc_metadata(memory_id, doc)]
     )
+    people_index.set_people(memory_id, doc["people"])
+    lexical_index.set_document(memory_id, doc["fields"])
+    index_passages(memory_id, mem_folder)
+    bump_index_version()
     return True
 
-def search_memories(query: str, k: int = 5, person: str | None = None):
-    emb = embed_texts([query])[0]
 
-    if person and person.strip():
-        res = collection.query(
-            query_embeddings=[emb],
-            n_results=k,
-            where={"people": {"$in": [person]}}
+def passage_id(memory_id: str, p: Dict) -> str:
+    """Keyed by content and source position, so inserting a caption doesn't shift every later id."""
+    return f"{memory_id}:{passage_hash(p)[:20]}"
+
+
+def _passage_meta(memory_id: str, p: Dict) -> Dict:
+    meta = {"memory_id": memory_id, "source": p["source"], "seq": p["seq"],
+            "hash": passage_hash(p, embedding_version())}
+    for key in ("start", "end", "file"):
+        if p.get(key) is not None:
+            meta[key] = p[key]
+    return meta
+
+
+def index_passages(memory_id: str, mem_folder: Path, collection=None, force: bool = False) -> Dict:
+    """
+    Stream a memory's passages into the passages collection PASSAGE_BATCH at
+    a time; unchanged passages keep their vectors, vanished ones are deleted.
+    """
+    collection = collection or get_passages_collection()
+    version = embedding_version()
+    existing = collection.get(where={"memory_id": memory_id}, include=["metadatas"])
+    stored = {pid: (m or {}).get("hash") for pid, m in zip(existing["ids"], existing["metadatas"])}
+    seen, embedded = set(), 0
+
+    def flush(batch):
+        nonlocal embedded
+        todo = [(pid, p) for pid, p in batch if force or stored.get(pid) != passage_hash(p, version)]
+        if not todo:
+            return
+        embs = embed_texts([p["text"] for _, p in todo])
+        collection.upsert(
+            ids=[pid for pid, _ in todo],
+            embeddings=embs,
+            documents=[p["text"] for _, p in todo],
+            metadatas=[_passage_meta(memory_id, p) for _, p in todo],
         )
+        embedded += len(todo)
+
+    batch = []
+    for p in iter_passages(mem_folder):
+        pid = passage_id(memory_id, p)
+        if pid in seen:
+            continue  # identical passage (e.g. a repeated caption) is stored once
+        seen.add(pid)
+        batch.append((pid, p))
+        if len(batch) >= PASSAGE_BATCH:
+            flush(batch)
+            batch = []
+    flush(batch)
+
+    stale = [pid for pid in stored if pid not in seen]
+    if stale:
+        collection.delete(ids=stale)
+    return {"passages": len(seen), "embedded": embedded, "deleted": len(stale)}
+
+
+def refresh_lexical(memory_id: str, media_root: Path):
+    """Re-read a memory into the lexical index only (no embedding call)."""
+    mem_folder = media_root / memory_id
+    if not mem_folder.exists():
+        lexical_index.remove_memory(memory_id)
+    else:
+        lexical_index.set_document(memory_id, build_memory_doc(mem_folder)["fields"])
+    bump_index_version()
+
+def _cosine_scores(query_emb: List[float], embs) -> "np.ndarray":
+    import numpy as np
+    q = np.asarray(query_emb, dtype=np.float32)
+    X = np.asarray(embs, dtype=np.float32)
+    q /= np.linalg.norm(q) + 1e-9
+    X /= np.linalg.norm(X, axis=1, keepdims=True) + 1e-9
+    return X @ q
+
+
+def _search_exact(emb: List[float], candidates: List[str], k: int) -> List[Dict]:
+    """Brute-force cosine over just the candidate memories."""
+    collection = get_collection()
+    ids, embs = [], []
+    for i in range(0, len(candidates), 500):
+        got = collection.get(ids=candidates[i:i + 500], include=["embeddings"])
+        ids.extend(got["ids"])
+        embs.extend(got["embeddings"])
+    if not ids:
+        return []
+    scores = _cosine_scores(emb, embs)
+    order = scores.argsort()[::-1][:k]
+    return [{"memory_id": ids[i], "score": float(scores[i])} for i in order]
+
+
+def _search_ann(emb: List[float], k: int, allowed: set | None = None) -> List[Dict]:
+    """
+    ANN query; with `allowed`, over-fetch and keep only allowed memories,
+    widening the fetch until k are found or the collection is exhausted.
+    """
+    collection = get_collection()
+    total = collection.count()
+    if total == 0:
+        return []
+    n = min(total, k if allowed is None else k * 4)
+    while True:
+        res = collection.query(query_embeddings=[emb], n_results=n)
+        items = []
+        for i, mid in enumerate(res["ids"][0]):
+            if allowed is not None and mid not in allowed:
+                continue
+            score = 1 - res["distances"][0][i]
+            items.append({"memory_id": mid, "score": float(score)})
+        if len(items) >= k or n >= total:
+            return items[:k]
+        n = min(total, n * 4)
+
+
+def search_memories(query: str, k: int = 5, person: str | None = None,
+                    people: List[str] | None = None, people_mode: str = "or",
+                    mode: str = "hybrid"):
+    """
+    mode "vector": embedding search; "lexical": BM25 over the full text;
+    "hybrid": both, fused by reciprocal rank (short keyword queries that
+    k memories match outright skip the embedding call).
+
+    A person filter first resolves candidate memories from the people index
+    (people_mode "or" = any of them, "and" = all of them), then scores only
+    those: exactly for small sets, ANN + filtering for large ones.
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"mode must be one of {', '.join(SEARCH_MODES)}")
+    if people_mode not in PEOPLE_MODES:
+        raise ValueError(f"people_mode must be one of {', '.join(PEOPLE_MODES)}")
+    names = [p for p in (people or []) if p and p.strip()]
+    if person and person.strip():
+        names.append(person)
+
+    key = (index_version(), embedding_version(), _normalize_query(query),
+           tuple(sorted({n.strip().casefold() for n in names})), people_mode, k, mode)
+    hits = result_cache.get(key)
+    if hits is None:
+        hits = _search_uncached(query, k, names, people_mode, mode)
+        result_cache.put(key, hits)
+    return [dict(h) for h in hits]
+
+
+def _passage_hit(memory_id: str, score: float, doc: str, meta: Dict) -> Dict:
+    passage = {"text": doc, "source": meta.get("source")}
+    for key in ("start", "end", "file"):
+        if key in meta:
+            passage[key] = meta[key]
+    return {"memory_id": memory_id, "score": score, "passage": passage}
+
+
+def _group_passages(ids, scores, docs, metas, k: int, allowed=None) -> List[Dict]:
+    """Max-sim per memory: each memory scores as its best passage."""
+    best: Dict[str, Dict] = {}
+    for score, doc, meta in zip(scores, docs, metas):
+        mid = meta["memory_id"]
+        if allowed is not None and mid not in allowed:
+            continue
+        if mid not in best or score > best[mid]["score"]:
+            best[mid] = _passage_hit(mid, float(score), doc, meta)
+    return sorted(best.values(), key=lambda h: -h["score"])[:k]
+
+
+def _search_passages(emb: List[float], k: int, candidates=None) -> List[Dict]:
+    collection = get_passages_collection()
+    total = collection.count()
+    if total == 0:
+        return []
+    if candidates is not None and len(candidates) <= EXACT_SEARCH_MAX:
+        # the cost is per passage, not per memory: count them (ids only) first
+        pids: List[str] = []
+        cand = sorted(candidates)
+        for i in range(0, len(cand), 500):
+            pids += collection.get(where={"memory_id": {"$in": cand[i:i + 500]}}, include=[])["ids"]
+            if len(pids) > EXACT_PASSAGE_MAX:
+                break
+        if len(pids) <= EXACT_PASSAGE_MAX:
+            if not pids:
+                return []
+            ids, embs, docs, metas = [], [], [], []
+            for i in range(0, len(pids), 500):
+                got = collection.get(ids=pids[i:i + 500], include=["embeddings", "documents", "metadatas"])
+                ids += got["ids"]
+                embs += list(got["embeddings"])
+                docs += got["documents"]
+                metas += got["metadatas"]
+            return _group_passages(ids, _cosine_scores(emb, embs), docs, metas, k)
+
+    n = min(total, k * PASSAGE_FANOUT)
+    while True:
+        res = collection.query(query_embeddings=[emb], n_results=n, include=["documents", "metadatas", "distances"])
+        scores = [1 - d for d in res["distances"][0]]
+        hits = _group_passages(res["ids"][0], scores, res["documents"][0], res["metadatas"][0], k, candidates)
+        if len(hits) >= k or n >= total:
+            return hits
+        n = min(total, n * 4)
+
+
+def _search_vector(query: str, k: int, candidates) -> List[Dict]:
+    """Memory-level and passage-level vectors; a memory scores as the better of the two."""
+    emb = embed_query(query)
+    if candidates is None:
+        hits = _search_ann(emb, k)
+    elif len(candidates) <= EXACT_SEARCH_MAX:
+        hits = _search_exact(emb, sorted(candidates), k)
     else:
-        res = collection.query(query_embeddings=[emb], n_results=k)
+        hits = _search_ann(emb, k, allowed=candidates)
+    merged = {h["memory_id"]: h for h in hits}
+    for p in _search_passages(emb, k, candidates):
+        h = merged.get(p["memory_id"])
+        if h is None or p["score"] > h["score"]:
+            merged[p["memory_id"]] = p
+        else:
+            h["passage"] = p["passage"]
+    return sorted(merged.values(), key=lambda h: -h["score"])[:k]
+
+
+# Every path returns "score" on one 0..1 scale (higher is better); the raw
+# ranker values stay alongside as vector_score (cosine), lexical_score
+# (flipped bm25) and rrf_score (fused).
+_NORMALIZE = {"vector": lambda s: min(1.0, max(0.0, s)), "lexical": normalize_bm25}
 
-    items = []
-    for i, mid in enumerate(res["ids"][0]):
-        score = 1 - res["distances"][0][i]
-        items.append({"memory_id": mid, "score": float(score)})
 
-    return items
+def _single(name: str, hits: List[Dict]) -> List[Dict]:
+    return [{**h, "score": _NORMALIZE[name](h["score"]), f"{name}_score": h["score"], "matched": [name]}
+            for h in hits]
+
+
+def _fuse(rankings: Dict[str, List[Dict]], k: int) -> List[Dict]:
+    """
+    Reciprocal rank fusion; keeps each ranker's score and the lexical
+    snippet. "score" is the RRF sum over its maximum (first in every ranker).
+    """
+    fused: Dict[str, Dict] = {}
+    for name, hits in rankings.items():
+        for rank, h in enumerate(hits):
+            item = fused.setdefault(h["memory_id"], {"memory_id": h["memory_id"], "rrf_score": 0.0, "matched": []})
+            item["rrf_score"] += 1.0 / (RRF_K + rank + 1)
+            item[f"{name}_score"] = h["score"]
+            item["matched"].append(name)
+            if h.get("snippet"):
+                item["snippet"] = h["snippet"]
+            if h.get("passage"):
+                item["passage"] = h["passage"]
+    best = len(rankings) / (RRF_K + 1)
+    for item in fused.values():
+        item["score"] = item["rrf_score"] / best
+    return sorted(fused.values(), key=lambda x: -x["score"])[:k]
+
+
+def _search_uncached(query: str, k: int, names: List[str], people_mode: str, mode: str):
+    candidates = None
+    if names:
+        candidates = people_index.memories_for(names, mode=people_mode)
+        if not candidates:
+            return []
+
+    if mode == "vector":
+        return _single("vector", _search_vector(query, k, candidates))
+    if mode == "lexical":
+        return _single("lexical", lexical_index.search(query, k, allowed=candidates))
+
+    if len(query_terms(query)) <= LEXICAL_FAST_MAX_TERMS:
+        exact = lexical_index.search(query, k, allowed=candidates, match_all=True)
+        if len(exact) >= k:
+            return _single("lexical", exact)
+    depth = max(k * 3, 20)
+    lexical = lexical_index.search(query, depth, allowed=candidates)
+    return _fuse({"vector": _search_vector(query, depth, candidates), "lexical": lexical}, k)
+
+
+def cache_stats() -> Dict:
+    return {
+        "index_version": index_version(),
+        "collection": active_collection_name(),
+        "query_embeddings": query_cache.stats(),
+        "search_results": result_cache.stats(),
+    }
@@ -0,0 +1,126 @@
+import os
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from blobstore import derived, file_hash
+
+FACE_WORKERS = int(os.getenv("FACE_WORKERS", "0") or 0) or (os.cpu_count() or 1)
+# below this many uncached images the pool start-up costs more than it saves
+FACE_POOL_MIN_IMAGES = int(os.getenv("FACE_POOL_MIN_IMAGES", "4"))
+
+# ----- worker process side -----
+_detector = None
+
+
+def _init_worker():
+    global _detector
+    import cv2
+    # one image per core: keep OpenCV from spawning its own thread pool
+    cv2.setNumThreads(1)
+    from face_utils import _load_face_detector
+    _detector = _load_face_detector()
+
+
+def _detect_one(img_path: str, art_dir: str, min_conf: float, detector=None) -> Optional[List[Dict[str, Any]]]:
+    """Detections for one image; None (logged) when it can't be read or detected."""
+    from face_utils import detect_faces_on_image
+    try:
+        return detect_faces_on_image(img_path, art_dir, min_conf=min_conf, crop_prefix="", detector=detector)
+    except Exception as e:
+        print(f"[faces] {os.path.basename(img_path)}: {e}")
+        return None
+
+
+def _detect_task(args: Tuple[str, str, float]) -> Optional[List[Dict[str, Any]]]:
+    # crops are written by the worker, so writes happen in parallel too
+    return _detect_one(*args, detector=_detector)
+
+
+# ----- parent side -----
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is not None and _pool_size != workers:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            # spawn: forking a threaded server process is unsafe
+            ctx = mp.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker)
+            _pool_size = workers
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def detect_faces_batch(image_paths: List[str], out_dir: str, min_conf: float = 0.5,
+                       progress: Optional[Callable] = None, workers: Optional[int] = None,
+                       report: Optional[Dict] = None) -> List[Dict[str, Any]]:
+    """
+    Detect faces on many images. Cached results (by content hash) are reused,
+    near-duplicate images share one detection (see near_dupes.plan), and the
+    rest are spread over a process pool whose workers each keep one
+    persistent MediaPipe detector. Results come back in input order; an
+    image that fails contributes no faces.
+    """
+    from face_utils import face_cache_version, link_cached_faces
+    from near_dupes import plan
+
+    progress = progress or (lambda *a, **k: None)
+    workers = workers or FACE_WORKERS
+    version = face_cache_version(min_conf)
+    hashes = [file_hash(p) for p in image_paths]
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    todo: Dict[str, str] = {}  # hash -> first path with that content
+    for p, h in zip(image_paths, hashes):
+        if h in results or h in todo:
+            continue
+        cached = derived.get("faces", h, version)
+        if cached is None:
+            todo[h] = p
+        else:
+            results[h] = cached
+
+    sources, found = plan(todo, lambda h: derived.get("faces", h, version), report)
+    results.update(found)
+    todo = {h: p for h, p in todo.items() if sources[h] == h}
+
+    total = len(image_paths)
+    progress("detect", total=total, done=total - len(todo))
+    if todo:
+        tasks = [(p, str(derived.artefact_dir("faces", h, version)), min_conf) for h, p in todo.items()]
+        if len(tasks) < FACE_POOL_MIN_IMAGES or workers <= 1:
+            outputs = (_detect_one(p, a, c) for p, a, c in tasks)
+        else:
+            pool = _get_pool(workers)
+            chunk = max(1, len(tasks) // (workers * 4))
+            outputs = pool.map(_detect_task, tasks, chunksize=chunk)
+        for i, (h, faces) in enumerate(zip(todo.keys(), outputs), start=1):
+            if faces is None:
+                # one bad image loses only its own faces, and isn't cached so it is retried
+                faces = []
+            else:
+                derived.put("faces", h, version, faces)
+            results[h] = faces
+            progress("detect", done=total - len(todo) + i)
+
+    all_faces: List[Dict[str, Any]] = []
+    for p, h in zip(image_paths, hashes):
+        # a near-duplicate gets its representative's detections and crops
+        src = sources.get(h, h)
+        art = derived.artefact_dir("faces", src, version)
+        all_faces.extend(link_cached_faces(p, results[src], art, out_dir))
+    return all_faces
@@ -0,0 +1,242 @@
+import os
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from blobstore import derived, file_hash
+from embeddings import client
+from model_registry import registry
+
+FACE_COLLECTION = os.getenv("FACE_COLLECTION", "faces")
+FACE_REC_PACK = os.getenv("FACE_REC_PACK", "buffalo_l")
+FACE_REC_FILE = os.getenv("FACE_REC_FILE", "w600k_r50.onnx")
+# cosine similarity of ArcFace embeddings
+FACE_SUGGEST_THRESHOLD = float(os.getenv("FACE_SUGGEST_THRESHOLD", "0.45"))
+FACE_AUTO_LABEL_THRESHOLD = float(os.getenv("FACE_AUTO_LABEL_THRESHOLD", "0.60"))
+FACE_CLUSTER_THRESHOLD = float(os.getenv("FACE_CLUSTER_THRESHOLD", "0.50"))
+FACE_KNN = int(os.getenv("FACE_KNN", "7"))
+
+FACE_EMB_VERSION = f"insightface:{FACE_REC_PACK}:{FACE_REC_FILE}:mp-align4"
+
+# ArcFace's 112x112 reference landmarks (insightface arcface_dst) with the two
+# mouth corners averaged, since MediaPipe gives a single mouth centre
+_ARCFACE_DST = np.array([[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [56.1396, 92.2848]],
+                        dtype=np.float32)
+
+face_collection = client.get_or_create_collection(
+    FACE_COLLECTION,
+    metadata={"hnsw:space": "cosine"}
+)
+
+
+def _load_arcface():
+    import insightface
+    from insightface.utils import storage
+    pack_dir = storage.ensure_available("models", FACE_REC_PACK, root="~/.insightface")
+    model = insightface.model_zoo.get_model(os.path.join(pack_dir, FACE_REC_FILE),
+                                            providers=["CPUExecutionProvider"])
+    model.prepare(ctx_id=-1)
+    return model
+
+
+registry.register("arcface", _load_arcface)
+
+
+def face_id(memory_id: str, crop_file: str) -> str:
+    return f"{memory_id}:{crop_file}"
+
+
+def align_face(img, keypoints):
+    """Similarity-warp a crop so its eyes, nose and mouth land on ArcFace's template (112x112)."""
+    import cv2
+    M, _ = cv2.estimateAffinePartial2D(np.asarray(keypoints, dtype=np.float32), _ARCFACE_DST, method=cv2.LMEDS)
+    if M is None:
+        return None
+    return cv2.warpAffine(img, M, (112, 112), borderValue=0.0)
+
+
+def _embed_crops(crop_paths: List[Path], keypoints: List[Optional[List]]) -> List[Optional[List[float]]]:
+    """
+    L2-normalised ArcFace embeddings of aligned crops, cached by crop content
+    hash. Faces without keypoints (or whose alignment fails) are skipped:
+    unaligned crops embed too far off to compare against the index.
+    """
+    import cv2
+    out: List[Optional[List[float]]] = [None] * len(crop_paths)
+    todo, imgs = [], []
+    for i, (p, kps) in enumerate(zip(crop_paths, keypoints)):
+        if not kps:
+            continue
+        h = file_hash(p)
+        cached = derived.get("face_embedding", h, FACE_EMB_VERSION)
+        if cached is not None:
+            out[i] = cached
+            continue
+        img = cv2.imread(str(p))
+        img = align_face(img, kps) if img is not None else None
+        if img is None:
+            continue
+        todo.append((i, h))
+        imgs.append(img)
+    if imgs:
+        with registry.use("arcface") as model:
+            feats = np.asarray(model.get_feat(imgs), dtype=np.float32)
+        feats /= np.linalg.norm(feats, axis=1, keepdims=True) + 1e-9
+        for (i, h), v in zip(todo, feats):
+            out[i] = v.tolist()
+            derived.put("face_embedding", h, FACE_EMB_VERSION, out[i])
+    return out
+
+
+def _vote(ids: List[str], metas: List[Dict], dists: List[float], exclude_memory: str):
+    """Similarity-weighted vote over human-tagged neighbours."""
+    scores: Dict[str, float] = {}
+    best: Dict[str, float] = {}
+    for fid, m, d in zip(ids, metas, dists):
+        if m.get("memory_id") == exclude_memory:
+            continue
+        sim = 1.0 - d
+        if sim < FACE_SUGGEST_THRESHOLD:
+            continue
+        label = m.get("label")
+        scores[label] = scores.get(label, 0.0) + sim
+        best[label] = max(best.get(label, 0.0), sim)
+    if not scores:
+        return None, 0.0
+    label = max(scores, key=scores.get)
+    return label, best[label]
+
+
+def index_faces(memory_id: str, faces_dir: Path, faces: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Embed each crop, store it in the global face index and attach a label
+    suggestion from the nearest human-tagged faces in other memories.
+    Faces without a human label get the suggestion applied when it clears
+    FACE_AUTO_LABEL_THRESHOLD (label_source="auto").
+    """
+    if not faces:
+        return faces
+    embs = _embed_crops([Path(faces_dir) / f["crop_file"] for f in faces], [f.get("keypoints") for f in faces])
+    idx = [i for i, e in enumerate(embs) if e is not None]
+    if not idx:
+        return faces
+
+    # only neighbours embedded the same way are comparable
+    human = {"$and": [{"label_source": "human"}, {"emb_version": FACE_EMB_VERSION}]}
+    tagged = face_collection.count() and face_collection.get(where=human, limit=1)["ids"]
+    if tagged:
+        res = face_collection.query(
+            query_embeddings=[embs[i] for i in idx],
+            n_results=FACE_KNN,
+            where=human,
+        )
+        for row, i in enumerate(idx):
+            label, sim = _vote(res["ids"][row], res["metadatas"][row], res["distances"][row], memory_id)
+            f = faces[i]
+            f.pop("suggested_label", None)
+            if label is None:
+                continue
+            f["suggested_label"] = label
+            f["suggestion_score"] = round(sim, 4)
+            if f.get("label_source") != "human" and sim >= FACE_AUTO_LABEL_THRESHOLD:
+                f["label"] = label
+                f["label_source"] = "auto"
+
+    face_collection.upsert(
+        ids=[face_id(memory_id, faces[i]["crop_file"]) for i in idx],
+        embeddings=[embs[i] for i in idx],
+        metadatas=[_meta(memory_id, faces[i]) for i in idx],
+    )
+    return faces
+
+
+def _meta(memory_id: str, face: Dict[str, Any]) -> Dict[str, Any]:
+    label = face.get("label") or ""
+    return {
+        "memory_id": memory_id,
+        "crop_file": face["crop_file"],
+        "source_image": face.get("source_image", ""),
+        "label": label,
+        "label_source": face.get("label_source") or ("human" if label else ""),
+        "emb_version": FACE_EMB_VERSION,
+    }
+
+
+def set_labels(memory_id: str, labels: Dict[str, str]):
+    """Record human tags (crop_file -> label) in the index; '' clears a tag."""
+    ids = [face_id(memory_id, cf) for cf in labels]
+    existing = face_collection.get(ids=ids, include=["metadatas"])
+    if not existing["ids"]:
+        return
+    metas = []
+    for fid, m in zip(existing["ids"], existing["metadatas"]):
+        label = labels[m["crop_file"]] or ""
+        metas.append({**m, "label": label, "label_source": "human" if label else ""})
+    face_collection.update(ids=existing["ids"], metadatas=metas)
+
+
+def remove_memory_faces(memory_id: str, keep: List[str]):
+    """Drop index entries for crops that a re-detection no longer produced."""
+    kept = {face_id(memory_id, cf) for cf in keep}
+    stale = [i for i in face_collection.get(where={"memory_id": memory_id}, include=[])["ids"] if i not in kept]
+    if stale:
+        face_collection.delete(ids=stale)
+
+
+def cluster_untagged(threshold: float = FACE_CLUSTER_THRESHOLD, min_size: int = 2) -> List[Dict[str, Any]]:
+    """
+    Group faces nobody has tagged (auto-labelled ones included) by
+    connected components of the cosine-similarity >= threshold graph.
+    """
+    res = face_collection.get(where={"$and": [{"label_source": {"$ne": "human"}}, {"emb_version": FACE_EMB_VERSION}]},
+                              include=["embeddings", "metadatas"])
+    ids = res["ids"]
+    if not ids:
+        return []
+    X = np.asarray(res["embeddings"], dtype=np.float32)
+    X /= np.linalg.norm(X, axis=1, keepdims=True) + 1e-9
+
+    parent = list(range(len(ids)))
+
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    # row blocks keep the similarity matrix at block x N floats
+    block = 512
+    for start in range(0, len(ids), block):
+        sims = X[start:start + block] @ X.T
+        rows, cols = np.nonzero(sims >= threshold)
+        for r, c in zip(rows + start, cols):
+            if c > r:
+                ra, rb = find(r), find(c)
+                if ra != rb:
+                    parent[rb] = ra
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(ids)):
+        groups.setdefault(find(i), []).append(i)
+
+    clusters = []
+    for members in groups.values():
+        if len(members) < min_size:
+            continue
+        member_ids = sorted(ids[i] for i in members)
+        cid = hashlib.sha1("\n".join(member_ids).encode("utf-8")).hexdigest()[:12]
+        clusters.append({
+            "cluster_id": cid,
+            "size": len(members),
+            "faces": [{
+                "face_id": ids[i],
+                "memory_id": res["metadatas"][i]["memory_id"],
+                "crop_file": res["metadatas"][i]["crop_file"],
+                "suggested_label": res["metadatas"][i].get("label") or None,
+                "url": f"/files/{res['metadatas'][i]['memory_id']}/faces/{res['metadatas'][i]['crop_file']}",
+            } for i in members],
+        })
+    clusters.sort(key=lambda c: -c["size"])
+    return clusters
@@ -1,50 +1,64 @@
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import cv2
 import mediapipe as mp
-from PIL import Image
+
+from model_registry import registry
+from blobstore import derived, file_hash, link_file
+from preprocess import PREPROCESS_VERSION
 
 mp_face = mp.solutions.face_detection
 
-def detect_faces_on_image(img_path: str, out_dir: str, min_conf: float = 0.5) -> List[Dict[str, Any]]:
+# One detector is built at the lowest confidence we ever retry with; the
+# stricter first pass is a score filter over the same detections.
+RELAXED_CONF = 0.35
+
+def _load_face_detector():
+    # model_selection=1 tends to work better for medium-to-far faces.
+    return mp_face.FaceDetection(model_selection=1, min_detection_confidence=RELAXED_CONF)
+
+# MediaPipe graphs are stateful; calls are serialised by the registry
+registry.register("face_detection", _load_face_detector, thread_safe=False,
+                  unloader=lambda fd: fd.close())
+
+# detections are made on the preprocessed "faces" variant, so its settings are part of the key
+FACE_VERSION = f"mediapipe-fd:3:relaxed0.35:pad0.08:kp4:{PREPROCESS_VERSION}"
+MAX_DETECT_WIDTH = 1600
+
+def load_for_detection(img_path: str):
     """
-    Detect multiple faces on a single image, save cropped faces to out_dir,
-    and return metadata (bbox, score, crop filename).
+    The preprocessed "faces" variant (EXIF-rotated, at most MAX_DETECT_WIDTH
+    wide) as BGR; crops are cut from this same array.
     """
-    out = []
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
-
-    # Read image (OpenCV BGR) and convert to RGB for MediaPipe
-    image_bgr = cv2.imread(img_path)
+    from preprocess import variant
+    image_bgr = cv2.imread(variant(img_path, "faces"))
     if image_bgr is None:
-        return out
+        return None
     h, w = image_bgr.shape[:2]
-    image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-
     # tip: resize large images to max 1600px width for better detection speed
-    max_w = 1600
-    if w > max_w:
-        scale = max_w / w
-        image_rgb = cv2.resize(image_rgb, (int(w*scale), int(h*scale)))
-        h, w = image_rgb.shape[:2]
+    if w > MAX_DETECT_WIDTH:
+        scale = MAX_DETECT_WIDTH / w
+        image_bgr = cv2.resize(image_bgr, (int(w*scale), int(h*scale)), interpolation=cv2.INTER_AREA)
+    return image_bgr
 
-    detections = []
-    # model_selection=1 tends to work better for medium-to-far faces.
-    with mp_face.FaceDetection(model_selection=1, min_detection_confidence=min_conf) as fd:
-        result = fd.process(image_rgb)
-        detections = result.detections or []
+def find_faces(fd, image_bgr, min_conf: float = 0.5) -> List[Dict[str, Any]]:
+    """
+    Run one detector pass and return padded pixel bboxes with scores and
+    keypoints (right eye, left eye, nose tip, mouth centre; image pixels).
+    If too few faces clear min_conf, fall back to everything above RELAXED_CONF
+    (the detector's own threshold) instead of running a second pass.
+    """
+    h, w = image_bgr.shape[:2]
+    result = fd.process(cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB))
+    relaxed = result.detections or []
+    detections = [d for d in relaxed if d.score and d.score[0] >= min_conf]
 
     # If too few faces, relax confidence
-    if len(detections) <= 1 and min_conf > 0.35:
-        with mp_face.FaceDetection(model_selection=1, min_detection_confidence=0.35) as fd:
-            result = fd.process(image_rgb)
-            detections = result.detections or []
-
-    # Save crops
-    pil_img = Image.fromarray(cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR))
-    idx = 0
+    if len(detections) <= 1 and min_conf > RELAXED_CONF:
+        detections = relaxed
+
+    faces = []
     for det in detections:
-        idx += 1
         rel = det.location_data.relative_bounding_box
         # relative coords -> absolute pixels
         x = max(0, int(rel.xmin * w))
@@ -58,18 +72,82 @@ def detect_faces_on_image(img_path: str, out_dir: str, min_conf: float = 0.5) ->
         y0 = max(0, y - pad)
         x1 = min(w, x + ww + pad)
         y1 = min(h, y + hh + pad)
+        kps = det.location_data.relative_keypoints
+        faces.append({
+            "bbox": {"x": x0, "y": y0, "w": int(x1 - x0), "h": int(y1 - y0)},
+            "score": float(det.score[0] if det.score else 0.0),
+            "keypoints": [[kp.x * w, kp.y * h] for kp in list(kps)[:4]] if len(kps) >= 4 else None,
+        })
+    return faces
 
-        crop = pil_img.crop((x0, y0, x1, y1))
-        face_file = f"face_{Path(img_path).stem}_{idx:02d}.jpg"
-        out_path = Path(out_dir) / face_file
-        crop.save(out_path)
-
+def save_crops(image_bgr, faces: List[Dict[str, Any]], out_dir: str, crop_prefix: str,
+               source_name: str) -> List[Dict[str, Any]]:
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    out = []
+    for idx, face in enumerate(faces, start=1):
+        b = face["bbox"]
+        crop = image_bgr[b["y"]:b["y"] + b["h"], b["x"]:b["x"] + b["w"]]
+        face_file = f"{crop_prefix}{idx:02d}.jpg"
+        cv2.imwrite(str(Path(out_dir) / face_file), crop, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        kps = face.get("keypoints")
         out.append({
-            "source_image": str(Path(img_path).name),
+            "source_image": source_name,
             "crop_file": face_file,
-            "bbox": {"x": x0, "y": y0, "w": int(x1 - x0), "h": int(y1 - y0)},
-            "score": float(det.score[0] if det.score else 0.0),
+            "bbox": b,
+            "score": face["score"],
+            # relative to the crop, for aligning it before embedding
+            "keypoints": [[round(x - b["x"], 1), round(y - b["y"], 1)] for x, y in kps] if kps else None,
             "label": None  # to be filled by family (frontend)
         })
+    return out
+
+def detect_faces_on_image(img_path: str, out_dir: str, min_conf: float = 0.5,
+                          crop_prefix: Optional[str] = None, detector=None) -> List[Dict[str, Any]]:
+    """
+    Detect multiple faces on a single image, save cropped faces to out_dir,
+    and return metadata (bbox, score, crop filename).
+    `detector` lets a caller that owns one (e.g. a pool worker) skip the registry.
+    """
+    if crop_prefix is None:
+        crop_prefix = f"face_{Path(img_path).stem}_"
+    image_bgr = load_for_detection(img_path)
+    if image_bgr is None:
+        return []
+    if detector is not None:
+        faces = find_faces(detector, image_bgr, min_conf)
+    else:
+        with registry.use("face_detection") as fd:
+            faces = find_faces(fd, image_bgr, min_conf)
+    return save_crops(image_bgr, faces, out_dir, crop_prefix, Path(img_path).name)
+
+
+def face_cache_version(min_conf: float) -> str:
+    return f"{FACE_VERSION}:{min_conf}"
+
 
+def link_cached_faces(img_path: str, cached: List[Dict[str, Any]], art: Path, out_dir: str) -> List[Dict[str, Any]]:
+    """Link cached crops (neutral names in the cache dir) into a memory's faces/ dir."""
+    stem = Path(img_path).stem
+    out = []
+    for face in cached:
+        crop_file = f"face_{stem}_{face['crop_file']}"
+        link_file(art / face["crop_file"], Path(out_dir) / crop_file)
+        out.append({**face, "source_image": Path(img_path).name, "crop_file": crop_file, "label": None})
     return out
+
+
+def detect_faces_cached(img_path: str, out_dir: str, min_conf: float = 0.5) -> List[Dict[str, Any]]:
+    """
+    Same as detect_faces_on_image, but detections and crops are cached by the
+    image's content hash, so a byte-identical photo in another memory reuses
+    them instead of running MediaPipe again.
+    """
+    h = file_hash(img_path)
+    version = face_cache_version(min_conf)
+    cached = derived.get("faces", h, version)
+    art = derived.artefact_dir("faces", h, version)
+    if cached is None:
+        # crops go to the cache dir under neutral names, then get linked in
+        cached = detect_faces_on_image(img_path, str(art), min_conf=min_conf, crop_prefix="")
+        derived.put("faces", h, version, cached)
+    return link_cached_faces(img_path, cached, art, out_dir)
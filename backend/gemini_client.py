@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import mimetypes
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+from http_utils import (
+    RETRY_STATUS, LatencyStats, RetryableError, TokenBucket, call_with_retry, retry_after_seconds,
+)
+
+# overridden by GEMINI_BASE_URL, e.g. http://127.0.0.1:8765 for dev_fakes.py
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "4"))    # requests in flight
+GEMINI_RPS = float(os.getenv("GEMINI_RPS", "2"))                  # requests/second, 0 = unlimited
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "5"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "120"))        # per HTTP request
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "600"))      # per call, retries included
+# inline requests are capped at 20 MB (base64 included); bigger media goes via the File API
+GEMINI_INLINE_MAX_BYTES = int(os.getenv("GEMINI_INLINE_MAX_MB", "14")) * 1024 * 1024
+GEMINI_FILE_POLL_SECONDS = float(os.getenv("GEMINI_FILE_POLL_SECONDS", "2"))
+
+_MAGIC = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def sniff_mime(data: bytes, path: Optional[str] = None, default: str = "application/octet-stream") -> str:
+    """Mime type from the content's magic bytes, else the file suffix."""
+    for magic, mime in _MAGIC:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    if path:
+        guessed = mimetypes.guess_type(path)[0]
+        if guessed:
+            return guessed
+    return default
+
+
+class GeminiClient:
+    """
+    generateContent over one pooled HTTP client. Calls run GEMINI_CONCURRENCY
+    at a time under a GEMINI_RPS token bucket, retry 429/5xx with backoff,
+    and identical requests already in flight share one call.
+    """
+
+    def __init__(self, api_key: str, base_url: str = GEMINI_BASE_URL, model: str = GEMINI_MODEL):
+        import httpx
+        self._httpx = httpx
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.bucket = TokenBucket(GEMINI_RPS, capacity=max(1, GEMINI_CONCURRENCY))
+        self.http = httpx.Client(
+            base_url=self.base_url,
+            headers={"x-goog-api-key": api_key},
+            timeout=GEMINI_TIMEOUT,
+            limits=httpx.Limits(max_connections=GEMINI_CONCURRENCY, max_keepalive_connections=GEMINI_CONCURRENCY),
+        )
+        self._pool = ThreadPoolExecutor(max_workers=GEMINI_CONCURRENCY, thread_name_prefix="gemini")
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self.latency = LatencyStats()
+        self.coalesced = 0
+        self.uploaded = 0
+
+    # ----- HTTP -----
+    def _send(self, method: str, url: str, deadline: float, **kwargs):
+        self.bucket.acquire(deadline=deadline)
+        timeout = max(1.0, min(GEMINI_TIMEOUT, deadline - time.monotonic()))
+        try:
+            r = self.http.request(method, url, timeout=timeout, **kwargs)
+        except self._httpx.TransportError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}")
+        if r.status_code in RETRY_STATUS:
+            raise RetryableError(f"HTTP {r.status_code}", retry_after=retry_after_seconds(r.headers))
+        if r.status_code >= 400:
+            raise RuntimeError(f"Gemini {url} HTTP {r.status_code}: {r.text[:200]}")
+        return r
+
+    def _call(self, method: str, url: str, deadline: float, **kwargs):
+        return call_with_retry(lambda: self._send(method, url, deadline, **kwargs),
+                               retries=GEMINI_RETRIES, deadline=deadline)
+
+    # ----- File API -----
+    def upload(self, data: Union[bytes, str, Path], mime: str, deadline: Optional[float] = None) -> Dict:
+        """
+        Resumable upload of one file (bytes, or a path streamed from disk);
+        returns its File resource once ACTIVE.
+        """
+        deadline = deadline or time.monotonic() + GEMINI_DEADLINE
+        size = len(data) if isinstance(data, bytes) else os.path.getsize(data)
+        start = self._call("POST", "/upload/v1beta/files", deadline, json={"file": {}}, headers={
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(size),
+            "X-Goog-Upload-Header-Content-Type": mime,
+        })
+        upload_url = start.headers["x-goog-upload-url"]
+        headers = {"X-Goog-Upload-Offset": "0", "X-Goog-Upload-Command": "upload, finalize"}
+
+        def send_body():
+            if isinstance(data, bytes):
+                return self._send("POST", upload_url, deadline, content=data, headers=headers)
+            with open(data, "rb") as body:  # reopened per attempt; httpx reads it in chunks
+                return self._send("POST", upload_url, deadline, content=body, headers=headers)
+
+        f = call_with_retry(send_body, retries=GEMINI_RETRIES, deadline=deadline).json()["file"]
+        # video/audio is processed server-side before it can be referenced
+        while f.get("state") == "PROCESSING":
+            if time.monotonic() + GEMINI_FILE_POLL_SECONDS > deadline:
+                raise TimeoutError(f"Gemini file {f.get('name')} still processing at deadline")
+            time.sleep(GEMINI_FILE_POLL_SECONDS)
+            f = self._call("GET", f"/v1beta/{f['name']}", deadline).json()
+        if f.get("state") == "FAILED":
+            raise RuntimeError(f"Gemini could not process file {f.get('name')}")
+        self.uploaded += 1
+        return f
+
+    def _media_part(self, data: Union[bytes, str, Path], mime: str, deadline: float) -> Dict:
+        """Inline part for small media, File API reference otherwise. A path is only read here."""
+        if not isinstance(data, bytes):
+            if os.path.getsize(data) > GEMINI_INLINE_MAX_BYTES:
+                if not mime:
+                    with open(data, "rb") as f:
+                        mime = sniff_mime(f.read(16), str(data))
+                f = self.upload(data, mime, deadline)
+                return {"file_data": {"mime_type": f.get("mimeType", mime), "file_uri": f["uri"]}}
+            with open(data, "rb") as f:
+                raw = f.read()
+            mime = mime or sniff_mime(raw, str(data))
+            data = raw
+        if len(data) <= GEMINI_INLINE_MAX_BYTES:
+            return {"inline_data": {"mime_type": mime, "data": base64.b64encode(data).decode("ascii")}}
+        f = self.upload(data, mime, deadline)
+        return {"file_data": {"mime_type": f.get("mimeType", mime), "file_uri": f["uri"]}}
+
+    # ----- generation -----
+    def _generate(self, prompt: str, data: Union[bytes, str, Path, None], mime: str) -> str:
+        deadline = time.monotonic() + GEMINI_DEADLINE
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            parts = [{"text": prompt}]
+            if data is not None:
+                parts.append(self._media_part(data, mime, deadline))
+            body = {"contents": [{"role": "user", "parts": parts}]}
+            resp = self._call("POST", f"/v1beta/models/{self.model}:generateContent", deadline, json=body).json()
+            cands = resp.get("candidates") or []
+            text = "".join(p.get("text", "") for p in (cands[0].get("content", {}).get("parts", []) if cands else []))
+            ok = True
+            return text.strip()
+        finally:
+            self.latency.record(time.perf_counter() - t0, ok=ok, items=1)
+
+    def submit(self, prompt: str, data: Union[bytes, str, Path, None] = None, mime: str = "") -> Future:
+        """
+        Queue one generateContent call; an identical call already in flight
+        is shared. `data` may be a path, read by the worker when the call
+        runs; without `mime` its type is sniffed from the content.
+        """
+        if data is None:
+            digest = ""
+        elif isinstance(data, bytes):
+            digest = hashlib.sha256(data).hexdigest()
+        else:
+            st = os.stat(data)
+            digest = f"{os.path.abspath(data)}:{st.st_size}:{st.st_mtime_ns}"
+        key = hashlib.sha256(f"{self.model}\n{prompt}\n{mime}\n{digest}".encode("utf-8")).hexdigest()
+        with self._inflight_lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                return fut
+            fut = self._pool.submit(self._generate, prompt, data, mime)
+            self._inflight[key] = fut
+        fut.add_done_callback(lambda _: self._forget(key))
+        return fut
+
+    def _forget(self, key: str):
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+
+    def generate(self, prompt: str, data: Union[bytes, str, Path, None] = None, mime: str = "") -> str:
+        return self.submit(prompt, data, mime).result()
+
+    def stream_generate(self, prompt: str, model: Optional[str] = None) -> Iterator[str]:
+        """
+        streamGenerateContent (SSE), yielding text as it arrives. Opening the
+        stream is rate limited and retried like any call; a failure after
+        text was yielded is raised, since the caller has already used it.
+        """
+        model = model or self.model
+        deadline = time.monotonic() + GEMINI_DEADLINE
+        body = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+        def open_stream():
+            self.bucket.acquire(deadline=deadline)
+            req = self.http.build_request("POST", f"/v1beta/models/{model}:streamGenerateContent",
+                                          params={"alt": "sse"}, json=body)
+            try:
+                r = self.http.send(req, stream=True)
+            except self._httpx.TransportError as e:
+                raise RetryableError(f"{type(e).__name__}: {e}")
+            if r.status_code >= 400:
+                r.read()
+                r.close()
+                if r.status_code in RETRY_STATUS:
+                    raise RetryableError(f"HTTP {r.status_code}", retry_after=retry_after_seconds(r.headers))
+                raise RuntimeError(f"Gemini streamGenerateContent HTTP {r.status_code}: {r.text[:200]}")
+            return r
+
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            r = call_with_retry(open_stream, retries=GEMINI_RETRIES, deadline=deadline)
+            try:
+                for line in r.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    for cand in json.loads(line[5:]).get("candidates", [])[:1]:
+                        for part in cand.get("content", {}).get("parts", []):
+                            if part.get("text"):
+                                yield part["text"]
+            except self._httpx.TransportError as e:
+                raise RuntimeError(f"Gemini stream interrupted: {type(e).__name__}: {e}")
+            finally:
+                r.close()
+            ok = True
+        finally:
+            self.latency.record(time.perf_counter() - t0, ok=ok, items=1)
+
+    def caption_images(self, prompt: str, paths: List[str]) -> List[str]:
+        """
+        Caption all images concurrently; results are in input order. Each
+        image is read by the task that sends it, so only the calls in flight
+        hold image bytes.
+        """
+        futures = [self.submit(prompt, p) for p in paths]
+        return [fut.result() for fut in futures]
+
+    def stats(self) -> Dict:
+        return {"model": self.model, "coalesced": self.coalesced, "uploaded": self.uploaded,
+                **self.latency.stats()}
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.http.close()
+
+
+_clients: Dict[tuple, GeminiClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_gemini_client() -> GeminiClient:
+    """One client per process and key/base URL (env read lazily, after load_dotenv)."""
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise RuntimeError("GEMINI_API_KEY is not set")
+    key = (api_key, os.getenv("GEMINI_BASE_URL", GEMINI_BASE_URL), GEMINI_MODEL)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = GeminiClient(api_key, key[1], key[2])
+        return _clients[key]
+
+
+def gemini_stats() -> Dict:
+    return {c.base_url: c.stats() for c in list(_clients.values())}
+
+
+def close_clients():
+    with _clients_lock:
+        for c in _clients.values():
+            c.close()
+        _clients.clear()
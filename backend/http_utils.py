@@ -0,0 +1,111 @@
+import time
+import random
+import threading
+from typing import Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """A failure worth retrying; `retry_after` is the server's hint in seconds."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0, deadline: Optional[float] = None):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise DeadlineExceeded("rate limit wait exceeds deadline")
+            time.sleep(wait)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    value = headers.get("retry-after") if headers else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def call_with_retry(fn: Callable[[], T], retries: int = 5, base: float = 0.5, cap: float = 20.0,
+                    deadline: Optional[float] = None) -> T:
+    """
+    Call fn(), retrying RetryableError with full-jitter exponential backoff
+    (or the server's Retry-After) until `retries` or the monotonic `deadline`.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except RetryableError as e:
+            attempt += 1
+            if attempt > retries:
+                raise
+            delay = e.retry_after if e.retry_after is not None else random.uniform(0, min(cap, base * 2 ** attempt))
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise DeadlineExceeded(f"giving up after {attempt} attempts: {e}") from e
+            print(f"[http] retry {attempt}/{retries} in {delay:.2f}s: {e}")
+            time.sleep(delay)
+
+
+class LatencyStats:
+    """Per-call latency and outcome counters, with percentiles over a recent window."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: List[float] = []
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.items = 0
+
+    def record(self, seconds: float, ok: bool = True, items: int = 0):
+        with self._lock:
+            self.calls += 1
+            self.items += items
+            if not ok:
+                self.errors += 1
+            self._samples.append(seconds)
+            if len(self._samples) > self.window:
+                del self._samples[: len(self._samples) - self.window]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            s = sorted(self._samples)
+        pct = lambda q: round(s[min(len(s) - 1, int(q * len(s)))] * 1000, 1) if s else None
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "items": self.items,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(s[-1] * 1000, 1) if s else None,
+        }
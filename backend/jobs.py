@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import traceback
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+JOBS_DB = Path(__file__).parent / "data" / "jobs.sqlite3"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# a running job's owner refreshes its heartbeat this often; a job whose
+# heartbeat is older than JOB_STALE_SECONDS lost its process and is re-queued
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+# a job abandoned this many times (e.g. it keeps killing the process) is failed instead
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# queued -> running -> done | failed
+ACTIVE = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    memory_id   TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    stage       TEXT,
+    args        TEXT NOT NULL DEFAULT '{}',
+    progress    TEXT NOT NULL DEFAULT '{}',
+    result      TEXT,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    owner       TEXT,
+    heartbeat   REAL,
+    created_at  TEXT NOT NULL,
+    updated_at  TEXT NOT NULL
+);
+-- at most one queued/running job per (kind, memory)
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_once
+    ON jobs(kind, memory_id) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_memory ON jobs(memory_id, created_at);
+"""
+# columns added after the first release: name -> declaration
+_ADDED_COLUMNS = {"owner": "TEXT", "heartbeat": "REAL"}
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+class JobConflict(RuntimeError):
+    """An active job for the memory was started with arguments the new request can't join."""
+
+
+def merge_args(current: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Arguments of a queued job widened by another request for the same job:
+    lists are unioned (e.g. force stages), flags OR-ed, anything else must
+    match. None when they can't be merged.
+    """
+    out = dict(current)
+    for k, v in new.items():
+        old = out.get(k)
+        if k not in out or old == v:
+            out[k] = v
+        elif isinstance(old, list) and isinstance(v, list):
+            out[k] = old + [x for x in v if x not in old]
+        elif isinstance(old, bool) and isinstance(v, bool):
+            out[k] = old or v
+        else:
+            return None
+    return out
+
+
+class Progress:
+    """Handed to job handlers so they can report per-stage progress."""
+
+    def __init__(self, queue: "JobQueue", job_id: str):
+        self._queue = queue
+        self._job_id = job_id
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def __call__(self, stage: str, state: str = "running", done: Optional[int] = None,
+                 total: Optional[int] = None):
+        info = self.stages.setdefault(stage, {})
+        info["state"] = state
+        if done is not None:
+            info["done"] = done
+        if total is not None:
+            info["total"] = total
+        self._queue._update(self._job_id, stage=stage, progress=json.dumps(self.stages))
+
+
+class JobQueue:
+    """
+    Persistent (SQLite) job queue with a bounded pool of worker threads.
+    Running jobs record their owner (this queue instance) and a heartbeat;
+    jobs whose owner stopped heartbeating are re-queued, by whichever
+    process notices first, or failed after JOB_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, db_path: Path = JOBS_DB, workers: int = JOB_WORKERS):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.workers = max(1, workers)
+        self.handlers: Dict[str, Callable[..., Any]] = {}
+        self._wake = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._stop = threading.Event()
+        self._local = threading.local()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        c = self._conn()
+        c.executescript(_SCHEMA)
+        have = {r["name"] for r in c.execute("PRAGMA table_info(jobs)")}
+        for name, decl in _ADDED_COLUMNS.items():
+            if name not in have:
+                c.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def register(self, kind: str, handler: Callable[..., Any]):
+        """handler(memory_id, progress, **args) -> JSON-serialisable result"""
+        self.handlers[kind] = handler
+
+    # ----- client side -----
+    def enqueue(self, kind: str, memory_id: str, **args) -> Dict[str, Any]:
+        """
+        Queue a job, or return the already queued/running one for this
+        memory. A queued job takes on the new request's arguments (see
+        merge_args); a running one only answers requests it already covers,
+        otherwise JobConflict.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = _now()
+        c = self._conn()
+        # serialised with _claim, so a queued row can't start while it is merged into
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute(
+                "SELECT * FROM jobs WHERE kind=? AND memory_id=? AND status IN ('queued','running')",
+                (kind, memory_id),
+            ).fetchone()
+            if row is None:
+                c.execute(
+                    "INSERT INTO jobs (id, kind, memory_id, status, args, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                    (job_id, kind, memory_id, json.dumps(args), now, now),
+                )
+            else:
+                current = json.loads(row["args"] or "{}")
+                merged = merge_args(current, args)
+                if merged != current:
+                    if merged is None or row["status"] != "queued":
+                        raise JobConflict(f"{kind} for {memory_id} is already {row['status']} "
+                                          f"with {current}, not {args}")
+                    c.execute("UPDATE jobs SET args=?, updated_at=? WHERE id=?",
+                              (json.dumps(merged), now, row["id"]))
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        if row is not None:
+            return {**self.get(row["id"]), "deduplicated": True}
+        with self._wake:
+            self._wake.notify()
+        return {**self.get(job_id), "deduplicated": False}
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def for_memory(self, memory_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT * FROM jobs WHERE memory_id=? ORDER BY created_at DESC LIMIT ?",
+            (memory_id, limit),
+        ).fetchall()
+        return [self._row(r) for r in rows]
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict[str, Any]:
+        d = dict(row)
+        d["args"] = json.loads(d.get("args") or "{}")
+        d["progress"] = json.loads(d.get("progress") or "{}")
+        d["result"] = json.loads(d["result"]) if d.get("result") else None
+        return d
+
+    # ----- worker side -----
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = _now()
+        cols = ", ".join(f"{k}=?" for k in fields)
+        self._conn().execute(f"UPDATE jobs SET {cols} WHERE id=?", (*fields.values(), job_id))
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute(
+                "SELECT * FROM jobs WHERE status='queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                c.execute(
+                    "UPDATE jobs SET status='running', attempts=attempts+1, owner=?, heartbeat=?, updated_at=? "
+                    "WHERE id=?",
+                    (self.owner, time.time(), _now(), row["id"]),
+                )
+            c.execute("COMMIT")
+            return row
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def _run(self, row: sqlite3.Row):
+        job_id, kind, memory_id = row["id"], row["kind"], row["memory_id"]
+        handler = self.handlers.get(kind)
+        if handler is None:
+            self._update(job_id, status="failed", error=f"no handler for {kind}")
+            return
+        print(f"[jobs] {kind} {memory_id} ({job_id}) started")
+        try:
+            args = json.loads(row["args"] or "{}")
+            result = handler(memory_id, Progress(self, job_id), **args)
+            self._update(job_id, status="done", stage=None,
+                         result=json.dumps(result, default=str))
+            print(f"[jobs] {kind} {memory_id} done")
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status="failed", error=str(getattr(e, "detail", e)))
+
+    def _worker(self):
+        while not self._stopping:
+            try:
+                row = self._claim()
+            except sqlite3.OperationalError as e:
+                print("[jobs] claim failed:", e)
+                row = None
+            if row is None:
+                with self._wake:
+                    self._wake.wait(timeout=2.0)
+                continue
+            self._run(row)
+
+    def _heartbeat(self):
+        self._conn().execute("UPDATE jobs SET heartbeat=? WHERE status='running' AND owner=?",
+                             (time.time(), self.owner))
+
+    def requeue_stale(self) -> int:
+        """
+        Re-queue running jobs whose owner stopped heartbeating (its process
+        died), or fail them once they were abandoned JOB_MAX_ATTEMPTS times.
+        Jobs of live owners, in this process or another, are left alone.
+        """
+        c = self._conn()
+        cutoff = time.time() - JOB_STALE_SECONDS
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            rows = c.execute(
+                "SELECT id, kind, memory_id, attempts FROM jobs WHERE status='running' "
+                "AND owner IS NOT ? AND (heartbeat IS NULL OR heartbeat < ?)",
+                (self.owner, cutoff),
+            ).fetchall()
+            for r in rows:
+                if r["attempts"] >= JOB_MAX_ATTEMPTS:
+                    c.execute("UPDATE jobs SET status='failed', owner=NULL, error=?, updated_at=? WHERE id=?",
+                              (f"abandoned by its worker {r['attempts']} times", _now(), r["id"]))
+                else:
+                    c.execute("UPDATE jobs SET status='queued', owner=NULL, updated_at=? WHERE id=?",
+                              (_now(), r["id"]))
+                print(f"[jobs] {r['kind']} {r['memory_id']} ({r['id']}) was abandoned (attempt {r['attempts']})")
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        if rows:
+            with self._wake:
+                self._wake.notify_all()
+        return len(rows)
+
+    def _monitor(self):
+        while not self._stopping:
+            try:
+                self._heartbeat()
+                self.requeue_stale()
+            except sqlite3.OperationalError as e:
+                print("[jobs] heartbeat failed:", e)
+            self._stop.wait(JOB_HEARTBEAT_SECONDS)
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping = False
+        self._stop.clear()
+        self.requeue_stale()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._monitor, name="job-heartbeat", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self):
+        self._stopping = True
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        self._threads = []
+
+
+queue = JobQueue()
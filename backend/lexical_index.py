@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+LEXICAL_DB = Path(__file__).parent / "data" / "lexical.sqlite3"
+
+# bm25 column weights: people, captions, transcript, story
+LEXICAL_WEIGHTS = tuple(float(x) for x in os.getenv("LEXICAL_WEIGHTS", "3,1,1,1.5").split(","))
+# bm25 at which the normalized 0..1 score reaches 0.5 (score = bm25 / (bm25 + this))
+LEXICAL_SCORE_HALF = float(os.getenv("LEXICAL_SCORE_HALF", "5"))
+
+_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(
+    memory_id UNINDEXED,
+    people,
+    captions,
+    transcript,
+    story,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+-- memory_id -> FTS rowid, so replacing a document is a rowid delete, not a full scan
+CREATE TABLE IF NOT EXISTS memory_rowid (
+    memory_id TEXT PRIMARY KEY,
+    fts_rowid INTEGER NOT NULL
+);
+"""
+
+FIELDS = ("people", "captions", "transcript", "story")
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_PHRASE = re.compile(r'"([^"]+)"')
+
+
+def query_terms(query: str) -> List[str]:
+    return _TOKEN.findall(query or "")
+
+
+def normalize_bm25(score: float) -> float:
+    """Flipped bm25 (higher is better, unbounded) -> 0..1."""
+    return score / (score + LEXICAL_SCORE_HALF) if score > 0 else 0.0
+
+
+def to_match(query: str, op: str = "AND") -> Optional[str]:
+    """
+    User text -> FTS5 MATCH expression. "Quoted parts" stay phrases, other
+    words become quoted terms (so FTS syntax in the query can't break it).
+    """
+    phrases = [" ".join(query_terms(p)) for p in _PHRASE.findall(query or "")]
+    rest = _PHRASE.sub(" ", query or "")
+    parts = [f'"{p}"' for p in phrases if p] + [f'"{t}"' for t in query_terms(rest)]
+    if not parts:
+        return None
+    return f" {op} ".join(parts)
+
+
+class LexicalIndex:
+    """
+    SQLite FTS5 (BM25) index over the full captions, transcript, story and
+    face labels of each memory; the embedded doc only sees truncated text.
+    """
+
+    def __init__(self, db_path: Path = LEXICAL_DB):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        c = self._conn()
+        c.executescript(_SCHEMA)
+        if c.execute("SELECT NOT EXISTS (SELECT 1 FROM memory_rowid)").fetchone()[0]:
+            # index built before the mapping existed: one scan, then never again
+            c.execute("INSERT OR REPLACE INTO memory_rowid (memory_id, fts_rowid) "
+                      "SELECT memory_id, rowid FROM memory_fts")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def set_document(self, memory_id: str, fields: Dict[str, str]):
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            self._delete(c, memory_id)
+            cur = c.execute(
+                "INSERT INTO memory_fts (memory_id, people, captions, transcript, story) VALUES (?, ?, ?, ?, ?)",
+                (memory_id, *(fields.get(f) or "" for f in FIELDS)),
+            )
+            c.execute("INSERT INTO memory_rowid (memory_id, fts_rowid) VALUES (?, ?)", (memory_id, cur.lastrowid))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _delete(c: sqlite3.Connection, memory_id: str):
+        row = c.execute("SELECT fts_rowid FROM memory_rowid WHERE memory_id=?", (memory_id,)).fetchone()
+        if row is not None:
+            c.execute("DELETE FROM memory_fts WHERE rowid=?", (row[0],))
+            c.execute("DELETE FROM memory_rowid WHERE memory_id=?", (memory_id,))
+
+    def remove_memory(self, memory_id: str):
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            self._delete(c, memory_id)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def _query(self, match: str, k: int, allowed: Optional[Iterable[str]]) -> List[Dict]:
+        weights = ", ".join(str(w) for w in (0.0, *LEXICAL_WEIGHTS))
+        where, params = "memory_fts MATCH ?", [match]
+        if allowed is not None:
+            where += " AND memory_id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(sorted(allowed)))
+        sql = (f"SELECT memory_id, bm25(memory_fts, {weights}) AS rank, "
+               f"snippet(memory_fts, -1, '[', ']', '…', 12) "
+               f"FROM memory_fts WHERE {where} ORDER BY rank LIMIT ?")
+        rows = self._conn().execute(sql, (*params, k)).fetchall()
+        # bm25() is "lower is better"; flip it so higher scores rank first everywhere
+        return [{"memory_id": mid, "score": -float(rank), "snippet": snip} for mid, rank, snip in rows]
+
+    def search(self, query: str, k: int = 10, allowed: Optional[Iterable[str]] = None,
+               match_all: bool = False) -> List[Dict]:
+        """
+        BM25 search. Memories containing every term come first; when there
+        are fewer than k of those, memories matching any term fill the rest
+        (unless match_all).
+        """
+        match = to_match(query, "AND")
+        if match is None:
+            return []
+        try:
+            hits = self._query(match, k, allowed)
+            if len(hits) < k and not match_all and len(query_terms(query)) > 1:
+                seen = {h["memory_id"] for h in hits}
+                hits += [h for h in self._query(to_match(query, "OR"), k, allowed)
+                         if h["memory_id"] not in seen][:k - len(hits)]
+        except sqlite3.OperationalError as e:
+            print("[lexical] query failed:", e)
+            return []
+        return hits
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM memory_fts").fetchone()[0]
+
+
+lexical_index = LexicalIndex()
@@ -1,26 +1,37 @@
 import os
-import subprocess
 import json
-from face_utils import detect_faces_on_image
+import shutil
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Literal, Optional
 from fastapi import HTTPException, Body
-from face_utils import detect_faces_on_image
-from narrate import synthesize_story
-from embeddings import index_memory, search_memories
-
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body
+import face_index
+from people_index import people_index, people_from_faces
+from catalog import catalog, SORT_KEYS
+import thumbnails
+from face_engine import detect_faces_batch, shutdown as face_engine_shutdown
+from narrate import synthesize_story, soften_text
+import tts
+import story as story_engine
+from embeddings import index_memory, refresh_lexical, search_memories, cache_stats
+from embedding_client import embedding_stats, close_clients as close_embedding_clients
+from ollama_client import get_ollama_client, ollama_stats, close_clients as close_ollama_clients
+from gemini_client import gemini_stats, close_clients as close_gemini_clients
+
+from fastapi import FastAPI, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from providers import (
-    PROVIDER, gemini_caption_images, gemini_transcribe_audio,
-    blip_caption_images_local, whisper_transcribe_local
-)
-from media_utils import extract_keyframes
+from model_registry import registry
+from jobs import JobConflict, queue as job_queue
+from uploads import UploadBudget, receive_multipart
+from blobstore import blobs, derived
+from pipeline import run_pipeline, parse_force
+from preprocess import image_assets, preprocess_stats
+import memory_state
 from PIL import Image
 import io, json
 
@@ -45,6 +56,8 @@ MEDIA_ROOT.mkdir(parents=True, exist_ok=True)
 app.mount("/files", StaticFiles(directory=str(MEDIA_ROOT)), name="files")
 MEDIA_ROOT.mkdir(parents=True, exist_ok=True)
 app.mount("/files", StaticFiles(directory=str(MEDIA_ROOT)), name="files")
+thumbnails.THUMB_ROOT.mkdir(parents=True, exist_ok=True)
+app.mount("/thumbs", StaticFiles(directory=str(thumbnails.THUMB_ROOT)), name="thumbs")
 
 @app.get("/")
 def root():
@@ -54,6 +67,32 @@ def root():
 def health():
     return {"ok": True, "service": "fastapi-backend"}
 
+@app.on_event("startup")
+def warmup_models():
+    # e.g. WARMUP_MODELS=minilm,face_detection,ollama:llava  (loaded in the background)
+    names = [n.strip() for n in os.getenv("WARMUP_MODELS", "").split(",") if n.strip()]
+    local = [n for n in names if not n.startswith("ollama:")]
+    remote = [n.split(":", 1)[1] for n in names if n.startswith("ollama:")]
+
+    def warm():
+        if local:
+            registry.warmup(local)
+        for model in remote:
+            try:
+                get_ollama_client().warm(model)
+            except Exception as e:
+                print(f"[warmup] ollama:{model}: {e}")
+
+    if names:
+        import threading
+        threading.Thread(target=warm, daemon=True).start()
+
+@app.get("/models")
+def models_status():
+    return {"ok": True, "budget_mb": registry.budget_bytes // (1024 * 1024), "models": registry.stats(),
+            "derived_cache": derived.stats(), "embedding_clients": embedding_stats(),
+            "ollama": ollama_stats(), "gemini": gemini_stats()}
+
 class UploadResponse(BaseModel):
     ok: bool
     memory_id: str
@@ -68,13 +107,62 @@ def _safe_name(name: str) -> str:
     # remove dangerous chars
     return "".join(c for c in name if c.isalnum() or c in ("-", "_", ".", " ")).strip()
 
-@app.post("/upload", response_model=UploadResponse)
-async def upload_memory(
-    photos: Optional[List[UploadFile]] = File(default=None, description="Multiple photos"),
-    video: Optional[UploadFile] = File(default=None, description="Single video"),
-    audio: Optional[UploadFile] = File(default=None, description="Single audio"),
-    story: Optional[str] = Form(default=None, description="Optional text story"),
-):
+# documents the form for /docs; the body itself is parsed by receive_multipart
+_UPLOAD_FORM = {"requestBody": {"content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "properties": {
+        "photos": {"type": "array", "items": {"type": "string", "format": "binary"}, "description": "Multiple photos"},
+        "video": {"type": "string", "format": "binary", "description": "Single video"},
+        "audio": {"type": "string", "format": "binary", "description": "Single audio"},
+        "story": {"type": "string", "description": "Optional text story"},
+    },
+}}}, "required": True}}
+
+def _store_upload(mem_id: str, folder: Path, files, fields) -> List[str]:
+    """Blob-store the received files, write story/metadata, catalog the memory."""
+    try:
+        saved_files = []
+        file_info = {}
+        for _, dest, info in files:
+            rel = dest.relative_to(folder).as_posix()
+            # identical content is stored once and hard-linked into the memory
+            info["deduplicated"] = blobs.adopt(dest, info["sha256"])
+            file_info[rel] = info
+            saved_files.append(rel)
+        kinds = {field for field, _, _ in files}
+
+        # Save story (if any)
+        story = fields.get("story")
+        if story and story.strip():
+            memory_state.save_text(folder, "story.txt", story.strip())
+
+        # Metadata (provider groundwork)
+        meta = {
+            "memory_id": mem_id,
+            "created_at": datetime.now().isoformat(),
+            "files": saved_files,
+            "file_info": file_info,  # rel path -> {sha256, size}
+            "has_video": "video" in kinds,
+            "has_audio": "audio" in kinds,
+            "has_photos": "photos" in kinds,
+            "llm_provider": os.getenv("LLM_PROVIDER", "ollama"),
+            "ollama_base_url": os.getenv("OLLAMA_BASE_URL", ""),
+            "gemini_key_present": bool(os.getenv("GEMINI_API_KEY")),
+            "status": "uploaded"  # later: processing -> complete
+        }
+        memory_state.save(folder, "metadata.json", meta)
+    except BaseException:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+
+    catalog.refresh(mem_id)
+    # thumbnails/posters are made off the request path
+    if saved_files:
+        job_queue.enqueue("thumbnails", mem_id)
+    return saved_files
+
+@app.post("/upload", response_model=UploadResponse, openapi_extra=_UPLOAD_FORM)
+async def upload_memory(request: Request):
     """
     Accepts:
       - photos[]   (multi)
@@ -82,64 +170,39 @@ async def upload_memory(
       - audio      (single)
       - story      (text)
     Saves into: backend/data/memories/memory_YYYYMMDD_HHMMSS_<uuid>/
+    The multipart body is parsed as it arrives and each file streamed to
+    disk in chunks (constant memory, written once), hashed on the way, with
+    the size limits enforced before the bytes are stored.
     Also writes metadata.json with chosen LLM provider (ollama/gemini).
     """
+    budget = UploadBudget()
+    budget.check_content_length(request.headers.get("content-length"))
+
     mem_id = f"memory_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
     folder = MEDIA_ROOT / mem_id
     folder.mkdir(parents=True, exist_ok=True)
+    photo_count = [0]
+
+    def file_dest(field: str, filename: str) -> Optional[Path]:
+        if field == "photos":
+            photo_count[0] += 1
+            subname, subdir = f"photo_{photo_count[0]}.jpg", "images"
+        elif field in ("video", "audio"):
+            subname, subdir = f"{field}.bin", ""
+        else:
+            return None
+        safe = _safe_name(filename or subname) or subname
+        return folder / (f"{subdir}/{safe}" if subdir else safe)
 
-    # Save files
-    saved_files = []
-
-    async def save_file(up: UploadFile, subname: str):
-        if up is None:
-            return
-        safe = _safe_name(up.filename or subname)
-        out = folder / safe
-        with open(out, "wb") as f:
-            f.write(await up.read())
-        saved_files.append(str(out.name))
-
-    # Photos
-    # Photos
-    if photos:
-        images_dir = folder / "images"
-        images_dir.mkdir(parents=True, exist_ok=True)
-
-        for i, p in enumerate(photos):
-            safe = _safe_name(p.filename)
-            out = images_dir / safe
-            with open(out, "wb") as f:
-                f.write(await p.read())
-            saved_files.append(f"images/{safe}")
-
-
-    # Video
-    if video:
-        await save_file(video, f"video.bin")
-
-    # Audio
-    if audio:
-        await save_file(audio, f"audio.bin")
-
-    # Save story (if any)
-    if story and story.strip():
-        (folder / "story.txt").write_text(story.strip(), encoding="utf-8")
-
-    # Metadata (provider groundwork)
-    meta = {
-        "memory_id": mem_id,
-        "created_at": datetime.now().isoformat(),
-        "files": saved_files,
-        "has_video": bool(video),
-        "has_audio": bool(audio),
-        "has_photos": bool(photos and len(photos) > 0),
-        "llm_provider": os.getenv("LLM_PROVIDER", "ollama"),
-        "ollama_base_url": os.getenv("OLLAMA_BASE_URL", ""),
-        "gemini_key_present": bool(os.getenv("GEMINI_API_KEY")),
-        "status": "uploaded"  # later: processing -> complete
-    }
-    (folder / "metadata.json").write_text(__import__("json").dumps(meta, indent=2), encoding="utf-8")
+    try:
+        files, fields = await receive_multipart(request, budget, file_dest)
+    except BaseException:
+        # rejected or disconnected: never leave a half-written memory behind
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+    # linking/copying into the blob store, fsynced state writes and the
+    # catalog all block, so none of it runs on the event loop
+    await run_in_threadpool(_store_upload, mem_id, folder, files, fields)
 
     return UploadResponse(
         ok=True,
@@ -148,99 +211,104 @@ async def upload_memory(
         message="Memory uploaded successfully. Processing will begin soon."
     )
 
+def _no_progress(stage: str, state: str = "running", done=None, total=None):
+    pass
+
+def _set_status(folder: Path, status: str, **extra):
+    def apply(meta):
+        meta["status"] = status
+        meta.update(extra)
+    memory_state.update(folder, "metadata.json", apply, default={"memory_id": folder.name})
+    catalog.refresh(folder.name)
+
+def _memory_status(memory_id: str) -> Optional[str]:
+    meta = memory_state.read(MEDIA_ROOT / memory_id, "metadata.json")
+    return meta.get("status") if meta else None
+
+def _enqueue(kind: str, memory_id: str, **args):
+    try:
+        job = job_queue.enqueue(kind, memory_id, **args)
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {
+        "ok": True,
+        "memory_id": memory_id,
+        "job_id": job["id"],
+        "job_status": job["status"],
+        "deduplicated": job["deduplicated"],
+        "status_url": f"/jobs/{job['id']}",
+    }
+
 @app.post("/process/{memory_id}")
-def process_memory(memory_id: str):
+def process_memory(memory_id: str, background: bool = True, force: Optional[str] = None):
+    """
+    Queued as a job by default (poll status_url); background=false runs it
+    inline and returns the result. force: comma-separated stages to rebuild
+    even if unchanged (keyframes, captions, transcript, index) or "all".
+    """
     folder = MEDIA_ROOT / memory_id
     if not folder.exists():
         raise HTTPException(status_code=404, detail="memory not found")
+    try:
+        force_stages = parse_force(force)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if background:
+        return _enqueue("process", memory_id, force=force_stages)
+    return _process_memory(memory_id, force=force_stages)
+
+def _process_memory(memory_id: str, progress=_no_progress, force=()):
+    folder = MEDIA_ROOT / memory_id
+    if not folder.exists():
+        raise HTTPException(status_code=404, detail="memory not found")
+    _set_status(folder, "processing")
+    try:
+        return _process_memory_stages(memory_id, folder, progress, force=force)
+    except Exception as e:
+        _set_status(folder, "failed", error=str(e))
+        raise
 
-    # Collect files
-    image_paths = [str(p) for p in folder.glob("*.jpg")] + [str(p) for p in folder.glob("*.png")] + [str(p) for p in folder.glob("*.jpeg")]
-    video_paths = [str(p) for p in folder.glob("*.mp4")] + [str(p) for p in folder.glob("*.mov")] + [str(p) for p in folder.glob("*.mkv")]
-    audio_paths = [str(p) for p in folder.glob("*.mp3")] + [str(p) for p in folder.glob("*.m4a")] + [str(p) for p in folder.glob("*.wav")]
-
-    captions: list[str] = []
-    transcript: str = ""
-
-    # 1) Video → keyframes → treat as images
-    keyframes_dir = folder / "frames"
-    all_images_for_caption = image_paths.copy()
-    for vp in video_paths:
-        kf = extract_keyframes(vp, str(keyframes_dir), max_frames=5)
-        all_images_for_caption.extend(kf)
-
-    # 2) Caption the images (Gemini or Local)
-    if all_images_for_caption:
-        if PROVIDER.lower() == "gemini":
-            image_bytes = []
-            for p in all_images_for_caption:
-                with open(p, "rb") as f:
-                    image_bytes.append(f.read())
-            captions = gemini_caption_images(image_bytes)
-        else:
-            captions = blip_caption_images_local(all_images_for_caption)
-
-    # 3) Transcribe audio (Gemini or Local)
-    #    If there's video, you can skip or add optional audio extraction later
-    if audio_paths:
-        # take first audio for MVP
-        ap = audio_paths[0]
-        if PROVIDER.lower() == "gemini":
-            mime = "audio/mpeg"
-            if ap.lower().endswith(".wav"): mime = "audio/wav"
-            if ap.lower().endswith(".m4a"): mime = "audio/mp4"  # Gemini accepts mp4/m4a
-            with open(ap, "rb") as f:
-                transcript = gemini_transcribe_audio(f.read(), mime=mime)
-        else:
-            transcript = whisper_transcribe_local(ap)
-
-    # 4) Save outputs
-    (folder / "captions.json").write_text(json.dumps(captions, indent=2), encoding="utf-8")
-    if transcript:
-        (folder / "transcript.txt").write_text(transcript, encoding="utf-8")
+def _process_memory_stages(memory_id: str, folder: Path, progress, force=()):
+    # keyframes -> captions -> transcript -> index; unchanged stages are skipped
+    stages = run_pipeline(folder, force=force, progress=progress)
 
-    # 5) Update metadata (status)
-    meta_path = folder / "metadata.json"
-    if meta_path.exists():
-        meta = json.loads(meta_path.read_text(encoding="utf-8"))
-    else:
-        meta = {"memory_id": memory_id}
-    meta["status"] = "processed"
-    meta["captions_count"] = len(captions)
-    meta["has_transcript"] = bool(transcript)
-    meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    captions_file = folder / "captions.json"
+    captions = json.loads(captions_file.read_text(encoding="utf-8")) if captions_file.exists() else []
+    transcript_file = folder / "transcript.txt"
+    transcript = transcript_file.read_text(encoding="utf-8") if transcript_file.exists() else ""
 
-    # Attempt to index the memory for vector search (non-fatal)
-    try:
-        index_memory(memory_id, MEDIA_ROOT)
-    except Exception as e:
-        # log and continue; processing should not fail because of indexing
-        print("Embedding/index error:", e)
+    # Update metadata (status)
+    _set_status(folder, "processed", captions_count=len(captions), has_transcript=bool(transcript))
 
     return {
         "ok": True,
         "memory_id": memory_id,
         "captions": captions[:5],  # small preview
-        "transcript": transcript[:400] if transcript else ""
+        "transcript": transcript[:400] if transcript else "",
+        "stages": stages,
     }
 from fastapi import HTTPException, Body
 import json
 
 @app.post("/faces/{memory_id}/detect")
-def faces_detect(memory_id: str):
+def faces_detect(memory_id: str, background: bool = True):
+    folder = MEDIA_ROOT / memory_id
+    if not folder.exists():
+        raise HTTPException(status_code=404, detail="memory not found")
+    if background:
+        return _enqueue("faces_detect", memory_id)
+    return _faces_detect(memory_id)
+
+def _faces_detect(memory_id: str, progress=_no_progress):
     folder = MEDIA_ROOT / memory_id
     if not folder.exists():
         raise HTTPException(status_code=404, detail="memory not found")
 
     faces_dir = folder / "faces"
     faces_dir.mkdir(parents=True, exist_ok=True)
-    faces_json = folder / "faces.json"
 
-    # gather candidate images (original uploads may be in top-level or in images/)
-    image_paths = [*folder.glob("*.jpg"), *folder.glob("*.jpeg"), *folder.glob("*.png")]
-    images_dir = folder / "images"
-    if images_dir.exists():
-        image_paths.extend([*images_dir.glob("*.jpg"), *images_dir.glob("*.jpeg"), *images_dir.glob("*.png")])
+    # original uploads may be in top-level or in images/
+    image_paths = image_assets(folder)
 
     frame_paths = []
     if (folder / "frames").exists():
@@ -248,29 +316,67 @@ def faces_detect(memory_id: str):
 
     all_imgs = [str(p) for p in image_paths] + [str(p) for p in frame_paths]
 
-    all_faces = []
-    for imgp in all_imgs:
-        all_faces.extend(detect_faces_on_image(imgp, str(faces_dir), min_conf=0.5))
+    dedupe: dict = {}
+    all_faces = detect_faces_batch(all_imgs, str(faces_dir), min_conf=0.5, progress=progress, report=dedupe)
+    progress("detect", "done")
 
-    # merge with existing labels if any
-    existing = []
-    if faces_json.exists():
-        try:
-            existing = json.loads(faces_json.read_text(encoding="utf-8"))
-        except Exception:
-            existing = []
+    def is_human(f) -> bool:
+        return bool(f and f.get("label")) and f.get("label_source", "human") == "human"
 
-    # keep old labels when the same crop_file re-generated
-    label_map = {f["crop_file"]: f.get("label") for f in existing if "crop_file" in f}
+    # human tags as of now, so the index treats those faces as known people
+    # rather than auto-labelling them; the final labels are decided below
+    tagged = {f["crop_file"]: f["label"] for f in memory_state.read(folder, "faces.json", default=[])
+              if "crop_file" in f and is_human(f)}
     for face in all_faces:
-        if face["crop_file"] in label_map and label_map[face["crop_file"]]:
-            face["label"] = label_map[face["crop_file"]]
-
-    faces_json.write_text(json.dumps(all_faces, indent=2), encoding="utf-8")
+        if face["crop_file"] in tagged:
+            face["label"], face["label_source"] = tagged[face["crop_file"]], "human"
+
+    def keep_labels(existing):
+        # runs against the current faces.json under the state lock: tags
+        # added, changed or cleared while detection ran win over the snapshot
+        current = {f["crop_file"]: f for f in existing if "crop_file" in f}
+        merged = []
+        for face in all_faces:
+            old = current.get(face["crop_file"])
+            f = {k: v for k, v in face.items() if k not in ("label", "label_source")}
+            if is_human(old):
+                f["label"], f["label_source"] = old["label"], "human"
+            elif face.get("label_source") == "auto":
+                f["label"], f["label_source"] = face["label"], "auto"
+            elif old and old.get("label") and old.get("label_source") == "auto":
+                f["label"], f["label_source"] = old["label"], "auto"
+            else:
+                f["label"] = None
+            merged.append(f)
+        return merged
+
+    # embed crops into the global face index and suggest labels (non-fatal)
+    progress("embed")
+    try:
+        all_faces = face_index.index_faces(memory_id, faces_dir, all_faces)
+        face_index.remove_memory_faces(memory_id, [f["crop_file"] for f in all_faces])
+    except Exception as e:
+        print("Face index error:", e)
+    progress("embed", "done")
+
+    all_faces = memory_state.update(folder, "faces.json", keep_labels, default=[])
+    # tags that changed during detection were indexed from the stale snapshot
+    final = {cf: "" for cf in tagged}
+    final.update({f["crop_file"]: f["label"] for f in all_faces if f.get("label_source") == "human"})
+    drift = {cf: label for cf, label in final.items() if tagged.get(cf, "") != label}
+    if drift:
+        try:
+            face_index.set_labels(memory_id, drift)
+        except Exception as e:
+            print("Face index error:", e)
+    people_index.set_people(memory_id, people_from_faces(folder))
+    catalog.refresh(memory_id)
+    # auto labels change the people field too; also bumps the index version
+    refresh_lexical(memory_id, MEDIA_ROOT)
 
     # return public URLs for faces
     face_urls = [f"/files/{memory_id}/faces/{f['crop_file']}" for f in all_faces]
-    return {"ok": True, "memory_id": memory_id, "count": len(all_faces), "faces": [
+    return {"ok": True, "memory_id": memory_id, "count": len(all_faces), "images": len(all_imgs), **dedupe, "faces": [
         {**f, "url": f"/files/{memory_id}/faces/{f['crop_file']}"} for f in all_faces
     ]}
 
@@ -285,79 +391,136 @@ def faces_tag(memory_id: str, tags: List[FaceTag] = Body(...)):
     if not faces_json.exists():
         raise HTTPException(status_code=404, detail="faces.json not found; run detect first")
 
-    data = json.loads(faces_json.read_text(encoding="utf-8"))
     label_map = {t.crop_file: t.label for t in tags}
-
-    for f in data:
-        cf = f.get("crop_file")
-        if cf in label_map:
-            f["label"] = label_map[cf]
-
-    faces_json.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    _apply_face_labels(memory_id, label_map)
     return {"ok": True, "memory_id": memory_id, "updated": len(tags)}
 
+def _apply_face_labels(memory_id: str, label_map: dict) -> int:
+    """Write human tags into faces.json and the face index; returns faces changed."""
+    changed = 0
+
+    def apply(data):
+        nonlocal changed
+        changed = 0
+        for f in data:
+            cf = f.get("crop_file")
+            if cf in label_map:
+                f["label"] = label_map[cf] or None
+                f["label_source"] = "human" if label_map[cf] else None
+                changed += 1
+
+    memory_state.update(MEDIA_ROOT / memory_id, "faces.json", apply, default=[])
+    people_index.set_people(memory_id, people_from_faces(MEDIA_ROOT / memory_id))
+    catalog.refresh(memory_id)
+    # also bumps the index version, so cached person-filtered searches go stale
+    refresh_lexical(memory_id, MEDIA_ROOT)
+    try:
+        face_index.set_labels(memory_id, label_map)
+    except Exception as e:
+        print("Face index error:", e)
+    return changed
+
+@app.get("/face_clusters")
+def face_clusters(threshold: Optional[float] = None, min_size: int = 2):
+    """Untagged faces across all memories grouped by similarity, biggest first."""
+    clusters = face_index.cluster_untagged(threshold or face_index.FACE_CLUSTER_THRESHOLD, min_size)
+    return {"ok": True, "count": len(clusters), "clusters": clusters}
+
+class ClusterTag(BaseModel):
+    face_ids: List[str]  # "<memory_id>:<crop_file>" as returned by /face_clusters
+    label: str
+
+@app.post("/face_clusters/tag")
+def face_clusters_tag(req: ClusterTag):
+    """Tag a whole cluster (or any set of faces across memories) in one call."""
+    by_memory: dict = {}
+    for fid in req.face_ids:
+        memory_id, _, crop_file = fid.partition(":")
+        if not crop_file:
+            raise HTTPException(status_code=400, detail=f"bad face id: {fid}")
+        by_memory.setdefault(memory_id, {})[crop_file] = req.label
+
+    updated = 0
+    for memory_id, label_map in by_memory.items():
+        if not (MEDIA_ROOT / memory_id / "faces.json").exists():
+            continue
+        updated += _apply_face_labels(memory_id, label_map)
+    return {"ok": True, "label": req.label, "memories": len(by_memory), "updated": updated}
+
 @app.post("/generate_story/{memory_id}")
-def generate_story(memory_id: str):
+def generate_story(memory_id: str, background: bool = True, force: bool = False):
     folder = MEDIA_ROOT / memory_id
     if not folder.exists():
         raise HTTPException(status_code=404, detail="memory not found")
+    if background:
+        return _enqueue("generate_story", memory_id, force=force)
+    return _generate_story(memory_id, force=force)
 
-    # Load captions
-    captions_file = folder / "captions.json"
-    captions = json.loads(captions_file.read_text()) if captions_file.exists() else []
-
-    # Load transcript
-    transcript_file = folder / "transcript.txt"
-    transcript = transcript_file.read_text().strip() if transcript_file.exists() else ""
-
-    # Load faces (names)
-    faces_file = folder / "faces.json"
-    if faces_file.exists():
-        faces_data = json.loads(faces_file.read_text())
-        # faces_data is list of {crop_file, label...}
-        faces = [f["label"] for f in faces_data if f.get("label")]
-    else:
-        faces = []
-
-    # Prepare prompt
-    prompt = f"""
-You are a warm companion helping someone with memory loss gently remember.
-Write a short, emotional memory story.
-
-People involved: {", ".join(faces) if faces else "unknown"}
-Captions: {", ".join(captions[:3])}
-Transcript clues: {transcript[:200]}
-
-Write in simple, positive, comforting tone (4-7 lines).
-Do NOT lecture. Just retell the moment like a soft memory.
-"""
-
-    provider = "gemini"
-
-    # =============== OLLAMA MODE (OFFLINE) ==================
-    if provider == "gemini":
-        import google.generativeai as genai
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        story = model.generate_content(prompt).text.strip()
+def _generate_story(memory_id: str, progress=_no_progress, force: bool = False):
+    folder = MEDIA_ROOT / memory_id
+    if not folder.exists():
+        raise HTTPException(status_code=404, detail="memory not found")
+    try:
+        story_engine.story_provider()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    progress("llm")
+    result = story_engine.generate_story(folder, force=force)
+    progress("llm", "done")
+    _story_saved(memory_id)
+    return {"ok": True, "memory_id": memory_id, "story": result["done"], "cached": result["cached"]}
+
+def _story_saved(memory_id: str):
+    catalog.refresh(memory_id)
+    refresh_lexical(memory_id, MEDIA_ROOT)
+
+@app.get("/generate_story/{memory_id}/stream")
+def generate_story_stream(memory_id: str, force: bool = False):
+    """
+    Server-sent events: `token` events carry text as the model produces it,
+    then one `done` event with the full story (already saved to story.txt).
+    """
+    from fastapi.responses import StreamingResponse
+    folder = MEDIA_ROOT / memory_id
+    if not folder.exists():
+        raise HTTPException(status_code=404, detail="memory not found")
+    try:
+        story_engine.story_provider()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    # =============== GEMINI MODE (ONLINE) ==================
-    else:
-        result = subprocess.run(
-            ["ollama", "run", "gpt-oss-20b", prompt],
-            capture_output=True, text=True
-        )
-        story = result.stdout.strip()
-        
-    # Save story
-    (folder / "story.txt").write_text(story, encoding="utf-8")
-
-    return {"ok": True, "memory_id": memory_id, "story": story}
+    def events():
+        try:
+            for ev in story_engine.stream_story(folder, force=force):
+                if "token" in ev:
+                    yield sse("token", {"text": ev["token"]})
+                else:
+                    _story_saved(memory_id)
+                    yield sse("done", {"memory_id": memory_id, "story": ev["done"], "cached": ev["cached"]})
+        except Exception as e:
+            print("Story stream error:", e)
+            yield sse("error", {"error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 from fastapi import HTTPException
 
+NARRATE_RATE = int(os.getenv("NARRATE_RATE", "160"))
+NARRATE_VOLUME = float(os.getenv("NARRATE_VOLUME", "0.95"))
+
 @app.post("/narrate/{memory_id}")
-def narrate(memory_id: str):
+def narrate(memory_id: str, background: bool = True):
+    folder = MEDIA_ROOT / memory_id
+    if not folder.exists():
+        raise HTTPException(status_code=404, detail="memory not found")
+    if background:
+        return _enqueue("narrate", memory_id)
+    return _narrate(memory_id)
+
+def _narrate(memory_id: str, progress=_no_progress):
     folder = MEDIA_ROOT / memory_id
     if not folder.exists():
         raise HTTPException(status_code=404, detail="memory not found")
@@ -368,69 +531,198 @@ def narrate(memory_id: str):
 
     # output folder for audio
     tts_dir = folder / "tts"
-    audio_file = tts_dir / "story.wav"
 
     text = story_file.read_text(encoding="utf-8").strip()
     if not text:
         raise HTTPException(status_code=400, detail="story is empty")
 
-    info = synthesize_story(text, str(audio_file), rate=160, volume=0.95)
+    progress("tts")
+    try:
+        info = synthesize_story(text, tts_dir, rate=NARRATE_RATE, volume=NARRATE_VOLUME)
+    except tts.TTSUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    progress("tts", "done")
+    catalog.refresh(memory_id)
 
     # ensure StaticFiles mount covers MEDIA_ROOT (we already mounted /files to MEDIA_ROOT earlier)
-    rel = audio_file.relative_to(MEDIA_ROOT).as_posix()  # memory_xxx/tts/story.wav
+    rel = Path(info["path"]).relative_to(MEDIA_ROOT).as_posix()  # memory_xxx/tts/story.m4a
     return {
         "ok": True,
         "audio_url": f"/files/{rel}",
         "voice": info["voice"],
+        "backend": info["backend"],
         "rate": info["rate"],
         "volume": info["volume"],
     }
-@app.get("/memories")
-def list_memories():
-    result = []
-    for folder in MEDIA_ROOT.iterdir():
-        if folder.is_dir():
-            images = sorted((folder / "images").glob("*"))
-            thumb = None
-            if images:
-                rel = images[0].relative_to(MEDIA_ROOT).as_posix()
-                thumb = f"/files/{rel}"
-
-            result.append({
-                "id": folder.name,
-                "thumbnail": thumb
-            })
-    return {"memories": result}
-@app.get("/memory/{memory_id}")
-def get_memory(memory_id: str):
+
+@app.get("/narrate/{memory_id}/stream")
+def narrate_stream(memory_id: str):
+    """
+    Ogg/Opus narration streamed sentence by sentence while it is synthesized.
+    Opt-in for clients that can play Opus; POST /narrate gives the portable file.
+    """
+    from fastapi.responses import StreamingResponse
+    folder = MEDIA_ROOT / memory_id
+    story_file = folder / "story.txt"
+    if not story_file.exists():
+        raise HTTPException(status_code=404, detail="story.txt not found; generate story first")
+    text = story_file.read_text(encoding="utf-8").strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="story is empty")
+    if not tts.opus_available():
+        raise HTTPException(status_code=501, detail="Opus encoding unavailable; use POST /narrate")
+    try:
+        tts.get_backend()
+    except tts.TTSUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    def audio():
+        yield from tts.stream_narration(soften_text(text), rate=NARRATE_RATE, volume=NARRATE_VOLUME,
+                                        out_path=folder / "tts" / "story.opus")
+        catalog.refresh(memory_id)
+
+    return StreamingResponse(audio(), media_type="audio/ogg", headers={"Cache-Control": "no-cache"})
+job_queue.register("process", _process_memory)
+job_queue.register("faces_detect", _faces_detect)
+job_queue.register("generate_story", _generate_story)
+job_queue.register("narrate", _narrate)
+
+def _thumbnails_job(memory_id: str, progress=_no_progress):
+    out = thumbnails.build_memory_thumbnails(MEDIA_ROOT / memory_id)
+    catalog.refresh(memory_id)
+    return {"thumbnails": len(out["assets"])}
+
+job_queue.register("thumbnails", _thumbnails_job)
+
+@app.get("/thumb/{memory_id}")
+def memory_thumbnail(memory_id: str, size: int = thumbnails.DEFAULT_THUMB_SIZE, fmt: str = "jpg",
+                     asset: Optional[str] = None):
+    """
+    Lazy thumbnail: generates (once, cached by source hash) and redirects to
+    the static /thumbs URL. asset= picks a file in the memory (default: cover).
+    """
+    from fastapi.responses import RedirectResponse
     folder = MEDIA_ROOT / memory_id
     if not folder.exists():
         raise HTTPException(404, "Memory not found")
+    if fmt not in thumbnails.THUMB_FORMATS:
+        raise HTTPException(400, f"fmt must be one of {', '.join(thumbnails.THUMB_FORMATS)}")
+    if asset:
+        src = (folder / asset).resolve()
+        if folder.resolve() not in src.parents or not src.is_file():
+            raise HTTPException(404, "asset not found")
+    else:
+        src = thumbnails.cover_source(folder)
+        if src is None:
+            raise HTTPException(404, "memory has no images or videos")
+    urls = thumbnails.thumbs_for(src)
+    if not urls:
+        raise HTTPException(404, "could not render a thumbnail")
+    # nearest generated size at or above the request
+    sizes = sorted(int(x) for x in urls)
+    pick = next((x for x in sizes if x >= size), sizes[-1])
+    return RedirectResponse(urls[str(pick)][fmt], status_code=307)
+
+@app.on_event("startup")
+def start_job_workers():
+    job_queue.start()
+
+@app.on_event("shutdown")
+def stop_workers():
+    job_queue.stop()
+    face_engine_shutdown()
+    close_embedding_clients()
+    close_ollama_clients()
+    close_gemini_clients()
+    tts.shutdown()
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(404, "job not found")
+    return {"ok": True, **job, "memory_status": _memory_status(job["memory_id"])}
+
+@app.get("/memory/{memory_id}/jobs")
+def memory_jobs(memory_id: str):
+    return {
+        "ok": True,
+        "memory_id": memory_id,
+        "status": _memory_status(memory_id),
+        "jobs": job_queue.for_memory(memory_id),
+    }
 
-    # Load story
-    story_file = folder / "story.txt"
-    story = story_file.read_text() if story_file.exists() else ""
-
-    # Load audio (if exists)
-    audio_file = folder / "tts" / "story.wav"
-    audio_url = None
-    if audio_file.exists():
-        rel = audio_file.relative_to(MEDIA_ROOT).as_posix()
-        audio_url = f"/files/{rel}"
-
-    # Load images
-    images_dir = folder / "images"
-    images = []
-    if images_dir.exists():
-        for img in images_dir.iterdir():
-            rel = img.relative_to(MEDIA_ROOT).as_posix()
-            images.append(f"/files/{rel}")
+@app.on_event("startup")
+def ensure_catalog():
+    # first run (or deleted db): recover the catalog from the folders on disk
+    if catalog.version() == 0:
+        print(f"[catalog] rebuilt: {catalog.rebuild()} memories")
+    # the person filter reads only the people index; fill it for memories
+    # that predate it (or after its db was deleted)
+    if not people_index.built():
+        print(f"[people] rebuilt: {people_index.rebuild(MEDIA_ROOT)} memories")
+
+def _etag_response(request: Request, payload: dict, etag: str):
+    from fastapi.responses import JSONResponse, Response
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(payload, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
-    return {
-        "story": story,
-        "audio_url": audio_url,
-        "images": images
+@app.get("/memories")
+def list_memories(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: str = "created_at",
+    order: str = "desc",
+    status: Optional[str] = None,
+    person: Optional[str] = None,
+):
+    """
+    Served from the catalog; pass next_cursor back as ?cursor= for the next
+    page. Without limit and cursor every memory is returned, as before paging.
+    """
+    if sort not in SORT_KEYS:
+        raise HTTPException(400, f"sort must be one of {', '.join(SORT_KEYS)}")
+    if limit is not None or cursor:
+        limit = max(1, min(limit or 50, 500))
+    # any catalog write bumps the version, so it doubles as the ETag
+    import hashlib
+    params = json.dumps([limit, cursor, sort, order, status, person])
+    etag = f'W/"{catalog.version()}-{hashlib.sha1(params.encode()).hexdigest()[:10]}"'
+    if request.headers.get("if-none-match") == etag:
+        return _etag_response(request, {}, etag)
+    try:
+        rows, next_cursor = catalog.list(limit=limit, cursor=cursor, sort=sort, order=order,
+                                         status=status, person=person)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return _etag_response(request, {"memories": rows, "next_cursor": next_cursor}, etag)
+
+@app.get("/memory/{memory_id}")
+def get_memory(memory_id: str, request: Request):
+    row = catalog.get(memory_id) or catalog.refresh(memory_id)
+    if not row:
+        raise HTTPException(404, "Memory not found")
+    payload = {
+        "story": row["story"],
+        "audio_url": row["audio_url"],
+        "images": row["images"],
+        "status": row["status"],
+        "people": row["people"],
+        "created_at": row["created_at"],
     }
+    etag = f'W/"{memory_id}-{row["updated_at"]}"'
+    return _etag_response(request, payload, etag)
+
+@app.get("/cache/stats")
+def cache_status():
+    return {"ok": True, **cache_stats(), "derived": derived.stats(), "preprocess": preprocess_stats()}
+
+@app.get("/people")
+def list_people():
+    return {"ok": True, "people": people_index.all_people()}
+
 @app.post("/embed/{memory_id}")
 def force_embed(memory_id: str):
     index_memory(memory_id, MEDIA_ROOT)
@@ -439,7 +731,10 @@ def force_embed(memory_id: str):
 class SearchReq(BaseModel):
     q: str
     person: str | None = None
+    people: List[str] | None = None  # multi-person filter
+    people_mode: Literal["or", "and"] = "or"  # "or" = any of them, "and" = all of them
     k: int = 6
+    mode: Literal["hybrid", "vector", "lexical"] = "hybrid"
 
 @app.post("/search")
 def vector_search(req: SearchReq):
@@ -449,22 +744,20 @@ def vector_search(req: SearchReq):
 
     # Debug/log query to help diagnose why search returns no results
     try:
-        print(f"[SEARCH] q='{req.q}' person='{req.person}' k={req.k}")
-        hits = search_memories(req.q, k=req.k, person=req.person)
+        print(f"[SEARCH] q='{req.q}' person='{req.person}' k={req.k} mode={req.mode}")
+        hits = search_memories(req.q, k=req.k, person=req.person,
+                               people=req.people, people_mode=req.people_mode, mode=req.mode)
     except Exception as e:
         # Return structured error so frontend shows the cause instead of a 500
         print("Search error:", e)
         return {"ok": False, "error": str(e), "results": []}
-    # Map to thumbnails
+    # Map to thumbnails (catalog row; no directory walk per hit)
     out = []
     for h in hits:
-        fold = MEDIA_ROOT / h["memory_id"]
-        img_dir = fold / "images"
-        thumb = None
-        if img_dir.exists():
-            imgs = sorted([p for p in img_dir.iterdir() if p.suffix.lower() in [".jpg",".jpeg",".png"]])
-            if imgs:
-                rel = imgs[0].relative_to(MEDIA_ROOT).as_posix()
-                thumb = f"/files/{rel}"
-        out.append({**h, "thumbnail": thumb})
+        row = catalog.get(h["memory_id"]) or catalog.refresh(h["memory_id"])
+        out.append({
+            **h,
+            "thumbnail": row["thumbnail"] if row else None,
+            "thumbnails": row["thumbnails"] if row else None,
+        })
     return {"ok": True, "results": out}
@@ -1,27 +1,155 @@
-import cv2, os
-from typing import List
+import cv2, os, heapq
+from typing import List, Optional, Tuple
 
-def extract_keyframes(video_path: str, out_dir: str, max_frames: int = 5) -> List[str]:
-    os.makedirs(out_dir, exist_ok=True)
-    cap = cv2.VideoCapture(video_path)
-    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 0
-    if total == 0:
-        return []
+import numpy as np
+
+KEYFRAME_MODE = os.getenv("KEYFRAME_MODE", "uniform")        # uniform | scene
+KEYFRAME_SIZE = int(os.getenv("KEYFRAME_SIZE", "720"))         # longest side of written frames
+JPEG_QUALITY = 90
+
+
+def _downscale(frame, target_size: int):
+    """Shrink so the longest side is at most target_size (never upscales)."""
+    if not target_size:
+        return frame
+    h, w = frame.shape[:2]
+    longest = max(h, w)
+    if longest <= target_size:
+        return frame
+    scale = target_size / longest
+    return cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _frame_count(cap) -> int:
+    # phone MOVs often report 0 (or garbage negatives) here
+    n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    return n if n > 0 else 0
 
-    # sample evenly across the video
+
+def _write_frames(frames: List, out_dir: str) -> List[str]:
+    paths = []
+    for i, frame in enumerate(frames):
+        out_path = os.path.join(out_dir, f"frame_{i+1:02d}.jpg")
+        cv2.imwrite(out_path, frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        paths.append(out_path)
+    return paths
+
+
+def _uniform_known(cap, total: int, max_frames: int, target_size: int) -> List:
+    """Single forward pass: grab() (decode only) everything, retrieve() only the picks."""
     step = max(1, total // max_frames)
+    targets = set(range(0, total, step)[:max_frames])
+    last = max(targets)
     frames = []
-    idx = 0
-    saved = 0
-    while cap.isOpened() and saved < max_frames:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-        ok, frame = cap.read()
-        if not ok:
+    for idx in range(last + 1):
+        if not cap.grab():
             break
-        out_path = os.path.join(out_dir, f"frame_{saved+1:02d}.jpg")
-        cv2.imwrite(out_path, frame)
-        frames.append(out_path)
-        saved += 1
-        idx += step
-    cap.release()
+        if idx in targets:
+            ok, frame = cap.retrieve()
+            if ok:
+                frames.append(_downscale(frame, target_size))
     return frames
+
+
+def _uniform_unknown(cap, max_frames: int, target_size: int) -> List:
+    """
+    Length unknown: keep every `stride`-th frame; whenever more than
+    2*max_frames are held, drop every other one and double the stride.
+    Memory stays bounded and the survivors stay evenly spread.
+    """
+    keep: List[Tuple[int, object]] = []
+    stride = 1
+    idx = 0
+    while cap.grab():
+        if idx % stride == 0:
+            ok, frame = cap.retrieve()
+            if ok:
+                keep.append((idx, _downscale(frame, target_size)))
+                if len(keep) > 2 * max_frames:
+                    keep = keep[::2]
+                    stride *= 2
+        idx += 1
+    if len(keep) <= max_frames:
+        return [f for _, f in keep]
+    picks = np.linspace(0, len(keep) - 1, max_frames).round().astype(int)
+    return [keep[i][1] for i in picks]
+
+
+def _signature(frame):
+    small = cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 8], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+def _scene(cap, max_frames: int, target_size: int, fps: float) -> List:
+    """
+    Scene-change sampling: look at ~2 frames per second, score each by how
+    much its colour histogram differs from the previous sample, and keep the
+    strongest changes (plus the opening shot), spread out in time.
+    """
+    sample_every = max(1, int(round((fps or 25) / 2)))
+    pool = 4 * max_frames
+    heap: List[Tuple[float, int, object]] = []  # min-heap of (score, idx, frame)
+    prev = None
+    idx = 0
+    while cap.grab():
+        if idx % sample_every == 0:
+            ok, frame = cap.retrieve()
+            if ok:
+                sig = _signature(frame)
+                # the opening shot always qualifies
+                score = 1.0 if prev is None else float(cv2.compareHist(prev, sig, cv2.HISTCMP_BHATTACHARYYA))
+                prev = sig
+                if len(heap) < pool or score > heap[0][0]:
+                    item = (score, idx, _downscale(frame, target_size))
+                    if len(heap) < pool:
+                        heapq.heappush(heap, item)
+                    else:
+                        heapq.heapreplace(heap, item)
+        idx += 1
+    if not heap:
+        return []
+
+    # strongest first, but not two picks within the same stretch of video
+    min_gap = max(sample_every, idx // (max_frames * 4))
+    chosen: List[Tuple[int, object]] = []
+    for score, i, frame in sorted(heap, key=lambda t: (-t[0], t[1])):
+        if all(abs(i - j) >= min_gap for j, _ in chosen):
+            chosen.append((i, frame))
+        if len(chosen) == max_frames:
+            break
+    chosen.sort(key=lambda t: t[0])
+    return [f for _, f in chosen]
+
+
+def extract_keyframes(video_path: str, out_dir: str, max_frames: int = 5,
+                      mode: Optional[str] = None, target_size: Optional[int] = None) -> List[str]:
+    """
+    Pick up to max_frames frames from a video in a single forward decode
+    (no per-frame seeking) and write them as JPEGs downscaled to
+    target_size. mode is "uniform" (evenly spaced) or "scene" (largest
+    visual changes). Works when the container does not report a frame count.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    mode = mode or KEYFRAME_MODE
+    target_size = KEYFRAME_SIZE if target_size is None else target_size
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return []
+    try:
+        if mode == "scene":
+            frames = _scene(cap, max_frames, target_size, cap.get(cv2.CAP_PROP_FPS))
+        else:
+            total = _frame_count(cap)
+            if total:
+                frames = _uniform_known(cap, total, max_frames, target_size)
+            else:
+                frames = _uniform_unknown(cap, max_frames, target_size)
+    finally:
+        cap.release()
+    return _write_frames(frames, out_dir)
+
+
+def keyframes_version() -> str:
+    return f"{KEYFRAME_MODE}:{KEYFRAME_SIZE}"
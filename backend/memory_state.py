@@ -0,0 +1,117 @@
+import os
+import copy
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from filelock import FileLock
+
+LOCK_FILE = ".memory.lock"
+# a writer waits this long for another writer on the same memory
+STATE_LOCK_TIMEOUT = float(os.getenv("STATE_LOCK_TIMEOUT", "60"))
+STATE_RETRIES = int(os.getenv("STATE_RETRIES", "5"))
+
+_locks: Dict[str, FileLock] = {}
+_locks_guard = threading.Lock()
+
+
+class ConflictError(RuntimeError):
+    """The file changed since it was read (optimistic version check failed)."""
+
+
+def memory_lock(folder: Path) -> FileLock:
+    """
+    The write lock of one memory folder. A file lock, so job workers,
+    request threads and the reindex CLI exclude each other; readers never
+    take it because writes are atomic renames.
+    """
+    path = str(Path(folder) / LOCK_FILE)
+    with _locks_guard:
+        if path not in _locks:
+            _locks[path] = FileLock(path, timeout=STATE_LOCK_TIMEOUT)
+        return _locks[path]
+
+
+def _version(raw: Optional[bytes]) -> str:
+    return hashlib.sha256(raw).hexdigest()[:16] if raw is not None else ""
+
+
+def _read(path: Path) -> Optional[bytes]:
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def load(folder: Path, name: str, default: Any = None) -> Tuple[Any, str]:
+    """(value, version) of a JSON file in a memory; version is "" when it does not exist."""
+    raw = _read(Path(folder) / name)
+    if raw is None:
+        return copy.deepcopy(default), ""
+    return json.loads(raw.decode("utf-8")), _version(raw)
+
+
+def read(folder: Path, name: str, default: Any = None) -> Any:
+    """The value only; an unreadable file is logged and treated as missing."""
+    try:
+        return load(folder, name, default)[0]
+    except ValueError as e:
+        print(f"[state] unreadable {Path(folder) / name}:", e)
+        return copy.deepcopy(default)
+
+
+def _write(path: Path, data: bytes):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def save(folder: Path, name: str, value: Any, expected: Optional[str] = None) -> str:
+    """
+    Write a JSON file atomically (temp file + rename) under the memory lock.
+    With `expected`, the write only happens if the file is still at that
+    version; otherwise ConflictError. Returns the new version.
+    """
+    path = Path(folder) / name
+    data = json.dumps(value, indent=2).encode("utf-8")
+    with memory_lock(folder):
+        if expected is not None and _version(_read(path)) != expected:
+            raise ConflictError(f"{path} changed since it was read")
+        _write(path, data)
+    return _version(data)
+
+
+def save_text(folder: Path, name: str, text: str):
+    with memory_lock(folder):
+        _write(Path(folder) / name, text.encode("utf-8"))
+
+
+def update(folder: Path, name: str, fn: Callable[[Any], Any], default: Any = None,
+           retries: int = STATE_RETRIES) -> Any:
+    """
+    Optimistic read-modify-write: fn(current value) runs without the lock
+    and its result is saved only if nobody wrote the file meanwhile; on a
+    conflict fn runs again on the fresh value, and after `retries`
+    conflicts once more with the lock held. fn may mutate its argument and
+    return None. Returns what was saved.
+    """
+    def attempt() -> Any:
+        value, version = load(folder, name, default)
+        out = fn(value)
+        value = value if out is None else out
+        save(folder, name, value, expected=version)
+        return value
+
+    for n in range(retries):
+        try:
+            return attempt()
+        except ConflictError:
+            print(f"[state] {Path(folder).name}/{name} changed underneath, retrying ({n + 1})")
+    with memory_lock(folder):
+        return attempt()
+
@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# Soft RAM budget for all resident models (0 = unlimited)
+MODEL_RAM_BUDGET_MB = int(os.getenv("MODEL_RAM_BUDGET_MB", "0") or 0)
+
+
+def _rss_bytes() -> int:
+    """Current resident set size of this process (Linux /proc, 0 if unknown)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        pass
+    try:
+        import resource
+        # ru_maxrss is a high-water mark (KiB on Linux), better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except Exception:
+        return 0
+
+
+def _torch_size_bytes(model: Any) -> int:
+    """Parameter + buffer bytes for torch modules (0 for anything else)."""
+    if isinstance(model, (tuple, list)):
+        return sum(_torch_size_bytes(m) for m in model)
+    try:
+        params = list(model.parameters()) + list(model.buffers())
+    except Exception:
+        return 0
+    return sum(p.numel() * p.element_size() for p in params)
+
+
+class _Entry:
+    def __init__(self, name: str, loader: Callable[[], Any], thread_safe: bool,
+                 unloader: Optional[Callable[[Any], None]]):
+        self.name = name
+        self.loader = loader
+        self.thread_safe = thread_safe
+        self.unloader = unloader
+        self.model: Any = None
+        self.loaded = False
+        self.load_seconds = 0.0
+        self.mem_bytes = 0
+        self.loads = 0
+        self.hits = 0
+        self.last_used = 0.0
+        self.in_use = 0
+        self.load_lock = threading.Lock()   # one loader at a time per model
+        self.use_lock = threading.RLock()   # serialises calls for non thread-safe models
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of heavy models (SentenceTransformer, BLIP, Whisper,
+    MediaPipe...). Models are registered with a loader and loaded lazily on
+    first use, then kept resident. When MODEL_RAM_BUDGET_MB is exceeded the
+    least recently used idle model is evicted.
+    """
+
+    def __init__(self, budget_mb: int = MODEL_RAM_BUDGET_MB):
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def register(self, name: str, loader: Callable[[], Any], thread_safe: bool = True,
+                 unloader: Optional[Callable[[Any], None]] = None):
+        """Register a loader. Re-registering a name keeps an already loaded model."""
+        with self._lock:
+            if name in self._entries:
+                e = self._entries[name]
+                e.loader, e.thread_safe, e.unloader = loader, thread_safe, unloader
+                return
+            self._entries[name] = _Entry(name, loader, thread_safe, unloader)
+
+    def is_registered(self, name: str) -> bool:
+        return name in self._entries
+
+    def _entry(self, name: str) -> _Entry:
+        try:
+            return self._entries[name]
+        except KeyError:
+            raise KeyError(f"model '{name}' is not registered")
+
+    def _load(self, e: _Entry):
+        with e.load_lock:
+            if e.loaded:
+                return
+            rss0 = _rss_bytes()
+            t0 = time.perf_counter()
+            model = e.loader()
+            e.load_seconds = time.perf_counter() - t0
+            e.mem_bytes = _torch_size_bytes(model) or max(0, _rss_bytes() - rss0)
+            e.model = model
+            e.loaded = True
+            e.loads += 1
+            print(f"[models] loaded {e.name} in {e.load_seconds:.2f}s (~{e.mem_bytes / 1e6:.0f} MB)")
+        self._evict(keep=e.name)
+
+    def get(self, name: str) -> Any:
+        """Return the model, loading it if needed. Prefer `use()` for non thread-safe models."""
+        e = self._entry(name)
+        if e.loaded:
+            e.hits += 1
+        while True:
+            if not e.loaded:
+                self._load(e)
+            with self._lock:
+                # unload clears model and loaded together under this lock
+                if e.loaded:
+                    e.last_used = time.monotonic()
+                    self._entries.move_to_end(name)
+                    return e.model
+
+    @contextmanager
+    def use(self, name: str):
+        """
+        Borrow a model. It is pinned against eviction for the duration and,
+        for models registered with thread_safe=False, calls are serialised.
+        """
+        e = self._entry(name)
+        with self._lock:
+            e.in_use += 1
+        try:
+            model = self.get(name)
+            if e.thread_safe:
+                yield model
+            else:
+                with e.use_lock:
+                    yield model
+        finally:
+            with self._lock:
+                e.in_use -= 1
+
+    def unload(self, name: str, idle_only: bool = False) -> bool:
+        """Drop a model. With idle_only (eviction), a model borrowed via use() is left alone."""
+        e = self._entry(name)
+        with e.load_lock:
+            with self._lock:
+                # in_use is re-checked here: it may have been pinned since the victim was picked
+                if not e.loaded or (idle_only and e.in_use > 0):
+                    return False
+                model, e.model, e.loaded = e.model, None, False
+            if e.unloader:
+                try:
+                    e.unloader(model)
+                except Exception as ex:
+                    print(f"[models] unload {name} failed:", ex)
+            print(f"[models] evicted {name}")
+        del model
+        import gc
+        gc.collect()
+        return True
+
+    def _resident_bytes(self) -> int:
+        return sum(e.mem_bytes for e in self._entries.values() if e.loaded)
+
+    def _evict(self, keep: Optional[str] = None):
+        if self.budget_bytes <= 0:
+            return
+        with self._lock:
+            # OrderedDict order == least recently used first
+            victims = [e for e in self._entries.values()
+                       if e.loaded and e.name != keep and e.in_use == 0]
+        for e in victims:
+            if self._resident_bytes() <= self.budget_bytes:
+                break
+            self.unload(e.name, idle_only=True)
+
+    def warmup(self, names: Iterable[str]) -> Dict[str, str]:
+        """Load the given models now (e.g. at startup). Returns name -> ok/error."""
+        status = {}
+        for name in names:
+            name = name.strip()
+            if not name:
+                continue
+            try:
+                self.get(name)
+                status[name] = "ok"
+            except Exception as ex:
+                print(f"[models] warmup {name} failed:", ex)
+                status[name] = f"error: {ex}"
+        return status
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._entries.values())
+        return [{
+            "name": e.name,
+            "loaded": e.loaded,
+            "load_seconds": round(e.load_seconds, 3),
+            "mem_mb": round(e.mem_bytes / (1024 * 1024), 1),
+            "loads": e.loads,
+            "hits": e.hits,
+            "in_use": e.in_use,
+        } for e in entries]
+
+
+registry = ModelRegistry()
@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from blobstore import derived, file_hash
+
+NEAR_DUPES_DB = Path(__file__).parent / "data" / "near_dupes.sqlite3"
+
+# max Hamming distance (of 64 bits) for two images to count as the same shot;
+# both hashes must agree. PHASH_THRESHOLD=0 turns grouping off.
+PHASH_THRESHOLD = int(os.getenv("PHASH_THRESHOLD", "8"))
+DHASH_THRESHOLD = int(os.getenv("DHASH_THRESHOLD", "10"))
+HASH_VERSION = "phash:dct32x8+dhash9x8:1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_hash (
+    sha256 TEXT PRIMARY KEY,
+    phash INTEGER NOT NULL,
+    dhash INTEGER NOT NULL,
+    memory_id TEXT
+);
+"""
+
+
+def _dct_matrix(n: int):
+    import numpy as np
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+def _bits(mask) -> int:
+    out = 0
+    for b in mask.reshape(-1):
+        out = (out << 1) | int(b)
+    return out
+
+
+def compute_hashes(path) -> Tuple[int, int]:
+    """(pHash, dHash) of an image, 64 bits each, from its small preprocessed variant."""
+    import numpy as np
+    from PIL import Image
+    from preprocess import variant
+    with Image.open(variant(path, "caption")) as im:
+        gray = im.convert("L")
+        small = np.asarray(gray.resize((32, 32), Image.LANCZOS), dtype=np.float64)
+        wide = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    d = _dct_matrix(32)
+    low = (d @ small @ d.T)[:8, :8]
+    ph = _bits(low > np.median(low.reshape(-1)[1:]))  # DC term excluded from the median
+    dh = _bits(wide[:, 1:] > wide[:, :-1])
+    return ph, dh
+
+
+def _signed(v: int) -> int:
+    return v - (1 << 64) if v >= (1 << 63) else v
+
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class HashIndex:
+    """Perceptual hashes of every image seen, so near-duplicates are found across memories."""
+
+    def __init__(self, db_path: Path = NEAR_DUPES_DB):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._mem: Dict[str, Tuple[int, int]] = {}
+        self._last_rowid = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _all(self) -> Dict[str, Tuple[int, int]]:
+        """In-memory copy of the table, topped up with rows other processes added since the last call."""
+        with self._lock:
+            rows = self._conn().execute("SELECT rowid, sha256, phash, dhash FROM image_hash WHERE rowid > ?",
+                                        (self._last_rowid,)).fetchall()
+            for rowid, s, p, d in rows:
+                self._mem[s] = (p & (2 ** 64 - 1), d & (2 ** 64 - 1))
+                self._last_rowid = max(self._last_rowid, rowid)
+            return self._mem
+
+    def hashes(self, sha: str, path, memory_id: Optional[str] = None) -> Tuple[int, int]:
+        """Hashes for one image, computed once per content hash."""
+        known = self._all().get(sha)
+        if known is not None:
+            return known
+        cached = derived.get("phash", sha, HASH_VERSION)
+        ph, dh = cached if cached is not None else compute_hashes(path)
+        if cached is None:
+            derived.put("phash", sha, HASH_VERSION, [ph, dh])
+        self._conn().execute("INSERT OR IGNORE INTO image_hash (sha256, phash, dhash, memory_id) VALUES (?, ?, ?, ?)",
+                             (sha, _signed(ph), _signed(dh), memory_id))
+        with self._lock:
+            self._mem[sha] = (ph, dh)
+        return ph, dh
+
+    def near(self, ph: int, dh: int, exclude: str = "") -> List[str]:
+        """Library images within the thresholds, closest first."""
+        if PHASH_THRESHOLD <= 0:
+            return []
+        hits = []
+        for sha, (p, d) in list(self._all().items()):
+            if sha == exclude:
+                continue
+            dp = _hamming(ph, p)
+            if dp <= PHASH_THRESHOLD and _hamming(dh, d) <= DHASH_THRESHOLD:
+                hits.append((dp, sha))
+        return [sha for _, sha in sorted(hits)]
+
+    def count(self) -> int:
+        return len(self._all())
+
+
+hash_index = HashIndex()
+
+
+def index_images(paths: List, memory_id: Optional[str] = None) -> int:
+    """Hash images at ingest; returns how many were hashed."""
+    n = 0
+    for p in paths:
+        try:
+            hash_index.hashes(file_hash(p), p, memory_id)
+            n += 1
+        except Exception as e:
+            print(f"[near_dupes] {Path(p).name}: {e}")
+    return n
+
+
+def plan(todo: Dict[str, str], lookup: Callable[[str], Any],
+         report: Optional[Dict] = None) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """
+    Decide which uncached images really need a model. `todo` maps content
+    hash -> path; `lookup(sha)` returns a stored result or None.
+
+    Returns (sources, found): sources maps every todo hash to the hash whose
+    result it will use (itself for the images that must run), found holds
+    results borrowed from near-duplicates elsewhere in the library. Within
+    `todo`, the first image of each near-duplicate group represents it.
+    """
+    sources = {h: h for h in todo}
+    found: Dict[str, Any] = {}
+    if PHASH_THRESHOLD <= 0 or not todo:
+        return sources, found
+    hashes = {}
+    for h, p in todo.items():
+        try:
+            hashes[h] = hash_index.hashes(h, p)
+        except Exception as e:
+            print(f"[near_dupes] {Path(p).name}: {e}")
+
+    reps: List[str] = []
+    library = batch = 0
+    for h, (ph, dh) in hashes.items():
+        for other in hash_index.near(ph, dh, exclude=h):
+            if other in todo:
+                continue  # not computed yet; handled as part of this batch below
+            value = lookup(other)
+            if value is not None:
+                sources[h], found[other] = other, value
+                library += 1
+                break
+        if sources[h] != h:
+            continue
+        rep = next((r for r in reps if _hamming(ph, hashes[r][0]) <= PHASH_THRESHOLD
+                    and _hamming(dh, hashes[r][1]) <= DHASH_THRESHOLD), None)
+        if rep is None:
+            reps.append(h)
+        else:
+            sources[h] = rep
+            batch += 1
+    if report is not None:
+        report["near_duplicates"] = report.get("near_duplicates", 0) + batch
+        report["library_reuse"] = report.get("library_reuse", 0) + library
+    return sources, found
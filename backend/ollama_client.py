@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import queue
+import base64
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import memory_state
+from http_utils import LatencyStats, RetryableError, call_with_retry
+
+OLLAMA_BASE_URL = "http://127.0.0.1:11434"
+# keep the model loaded between calls (Ollama unloads after 5m by default)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+# per read: a generation may be slow, but a silent server is dead
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "2"))
+
+
+class OllamaClient:
+    """
+    One pooled keep-alive HTTP client for the Ollama API. At most
+    OLLAMA_MAX_CONCURRENCY generations run at once (Ollama queues the rest
+    anyway, but this keeps our threads from piling up behind it).
+    """
+
+    def __init__(self, base_url: str):
+        import httpx
+        self._httpx = httpx
+        self.base_url = base_url.rstrip("/")
+        self.http = httpx.Client(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=OLLAMA_MAX_CONCURRENCY * 2,
+                                max_keepalive_connections=OLLAMA_MAX_CONCURRENCY),
+        )
+        self._slots = threading.BoundedSemaphore(OLLAMA_MAX_CONCURRENCY)
+        self.latency = LatencyStats()
+
+    @contextmanager
+    def _slot(self):
+        with self._slots:
+            t0 = time.perf_counter()
+            ok = False
+            try:
+                yield
+                ok = True
+            finally:
+                self.latency.record(time.perf_counter() - t0, ok=ok)
+
+    def _post(self, path: str, body: Dict) -> Dict:
+        def call():
+            try:
+                r = self.http.post(path, json=body)
+            except self._httpx.ConnectError as e:
+                raise RetryableError(f"ollama unreachable at {self.base_url}: {e}")
+            if r.status_code == 503:
+                raise RetryableError("ollama busy (503)")
+            if r.status_code >= 400:
+                raise RuntimeError(f"ollama {path} HTTP {r.status_code}: {r.text[:200]}")
+            return r.json()
+        with self._slot():
+            return call_with_retry(call, retries=OLLAMA_RETRIES, base=0.5)
+
+    def generate(self, model: str, prompt: str, images: Optional[List[bytes]] = None,
+                 options: Optional[Dict] = None) -> str:
+        body = {"model": model, "prompt": prompt, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE}
+        if images:
+            body["images"] = [base64.b64encode(b).decode("ascii") for b in images]
+        if options:
+            body["options"] = options
+        return self._post("/api/generate", body).get("response", "")
+
+    def stream_generate(self, model: str, prompt: str, options: Optional[Dict] = None) -> Iterator[str]:
+        """
+        Yield response text as Ollama streams it (NDJSON, one object per line).
+        A reader thread drains the response into a queue, so the concurrency
+        slot is held only while Ollama generates, not while a slow consumer
+        (e.g. an SSE client) reads.
+        """
+        body = {"model": model, "prompt": prompt, "stream": True, "keep_alive": OLLAMA_KEEP_ALIVE}
+        if options:
+            body["options"] = options
+        pieces: "queue.Queue" = queue.Queue()
+        abandoned = threading.Event()
+
+        def pump():
+            try:
+                with self._slot():
+                    with self.http.stream("POST", "/api/generate", json=body) as r:
+                        if r.status_code >= 400:
+                            r.read()
+                            raise RuntimeError(f"ollama /api/generate HTTP {r.status_code}: {r.text[:200]}")
+                        for line in r.iter_lines():
+                            if abandoned.is_set():
+                                return
+                            if not line:
+                                continue
+                            msg = json.loads(line)
+                            if msg.get("error"):
+                                raise RuntimeError(f"ollama: {msg['error']}")
+                            if msg.get("response"):
+                                pieces.put(("text", msg["response"]))
+                            if msg.get("done"):
+                                return
+            except self._httpx.ConnectError as e:
+                pieces.put(("error", RuntimeError(f"ollama unreachable at {self.base_url}: {e}")))
+            except Exception as e:
+                pieces.put(("error", e))
+            finally:
+                pieces.put(("end", None))
+
+        threading.Thread(target=pump, daemon=True, name="ollama-stream").start()
+        try:
+            while True:
+                kind, value = pieces.get()
+                if kind == "end":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            abandoned.set()
+
+    def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        body = {"model": model, "input": texts, "keep_alive": OLLAMA_KEEP_ALIVE}
+        return self._post("/api/embed", body)["embeddings"]
+
+    def warm(self, model: str):
+        """Load a model without generating (an empty prompt only loads it)."""
+        self._post("/api/generate", {"model": model, "keep_alive": OLLAMA_KEEP_ALIVE})
+
+    def stats(self) -> Dict:
+        return {"base_url": self.base_url, **self.latency.stats()}
+
+    def close(self):
+        self.http.close()
+
+
+_clients: Dict[str, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def ollama_base_url(folder: Optional[Path] = None) -> str:
+    """The memory's ollama_base_url (metadata.json) when it has one, else OLLAMA_BASE_URL."""
+    if folder is not None:
+        meta = memory_state.read(folder, "metadata.json", default={}) or {}
+        if meta.get("ollama_base_url"):
+            return meta["ollama_base_url"]
+    return os.getenv("OLLAMA_BASE_URL") or OLLAMA_BASE_URL
+
+
+def get_ollama_client(base_url: Optional[str] = None) -> OllamaClient:
+    """
+    Process-wide client per server: `base_url`, else OLLAMA_BASE_URL (read
+    lazily, after load_dotenv).
+    """
+    base = (base_url or ollama_base_url()).rstrip("/")
+    with _clients_lock:
+        if base not in _clients:
+            _clients[base] = OllamaClient(base)
+        return _clients[base]
+
+
+def ollama_stats() -> Dict:
+    return {base: c.stats() for base, c in list(_clients.items())}
+
+
+def close_clients():
+    with _clients_lock:
+        for c in _clients.values():
+            c.close()
+        _clients.clear()
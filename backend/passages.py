@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# target passage length; a passage closes at the first sentence/segment boundary past it
+PASSAGE_CHARS = int(os.getenv("PASSAGE_CHARS", "500"))
+READ_CHUNK = 64 * 1024
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+_SEGMENTS_KEY = re.compile(r'"segments"\s*:\s*\[')
+
+
+def passage_hash(p: Dict, salt: str = "") -> str:
+    """Identity of a passage's content; salt with the embedding version to re-embed on model change."""
+    key = f"{salt}|{p['source']}|{p.get('start')}|{p.get('end')}|{p.get('file')}|{p['text']}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _sentences(path: Path) -> Iterator[str]:
+    """Sentences of a text file, read in chunks rather than all at once."""
+    tail = ""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+            parts = _SENTENCE_END.split(tail + chunk)
+            tail = parts.pop()
+            for s in parts:
+                if s.strip():
+                    yield s.strip()
+    if tail.strip():
+        yield tail.strip()
+
+
+def read_head(path: Path, max_chars: int) -> str:
+    """At most max_chars of a text file; "" when it does not exist."""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.read(max_chars)
+    except FileNotFoundError:
+        return ""
+
+
+def _json_array_items(path: Path) -> Iterator:
+    """
+    Items of the "segments" array of transcript.json (or of a top-level
+    array, the older layout), decoded one at a time from chunked reads so
+    the file never sits in memory whole.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buf = ""
+        pos = None
+        while pos is None:
+            chunk = f.read(READ_CHUNK)
+            buf += chunk
+            head = buf.lstrip()
+            if head.startswith("["):
+                pos = len(buf) - len(head) + 1
+            else:
+                m = _SEGMENTS_KEY.search(buf)
+                if m:
+                    pos = m.end()
+                elif not chunk:
+                    return
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    raise ValueError(f"truncated segments array in {path}")
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield item
+            pos = end
+            if pos > READ_CHUNK:
+                buf, pos = buf[pos:], 0
+
+
+def _windows(units: Iterable[Dict], source: str) -> Iterator[Dict]:
+    """Group {text, start?, end?} units into ~PASSAGE_CHARS passages."""
+    buf: List[Dict] = []
+    size = 0
+    for u in units:
+        if buf and u.get("file") != buf[-1].get("file"):
+            yield _passage(buf, source)
+            buf, size = [], 0
+        buf.append(u)
+        size += len(u["text"]) + 1
+        if size >= PASSAGE_CHARS:
+            yield _passage(buf, source)
+            buf, size = [], 0
+    if buf:
+        yield _passage(buf, source)
+
+
+def _passage(units: List[Dict], source: str) -> Dict:
+    p = {"source": source, "text": " ".join(u["text"] for u in units)}
+    if units[0].get("start") is not None:
+        p["start"] = round(float(units[0]["start"]), 2)
+        p["end"] = round(float(units[-1].get("end", units[-1]["start"])), 2)
+    if units[0].get("file"):
+        p["file"] = units[0]["file"]
+    return p
+
+
+def _transcript_segments(folder: Path) -> Optional[Iterator[Dict]]:
+    """Timestamped segments from transcript.json when transcription produced one."""
+    f = folder / "transcript.json"
+    if not f.exists():
+        return None
+
+    def gen():
+        try:
+            for s in _json_array_items(f):
+                if (s.get("text") or "").strip():
+                    yield {"text": s["text"].strip(), "start": s.get("start"), "end": s.get("end"),
+                           "file": s.get("file")}
+        except ValueError as e:
+            # passages already yielded stand; the rest of the file is unusable
+            print(f"[passages] unreadable {f}:", e)
+
+    return gen()
+
+
+def iter_passages(folder: Path) -> Iterator[Dict]:
+    """
+    Passages of one memory, lazily: one per caption, then transcript and story
+    windows. Transcript passages carry start/end seconds when segments are known.
+    Each passage gets a per-memory sequence number `seq`.
+    """
+    folder = Path(folder)
+
+    def gen():
+        f = folder / "captions.json"
+        if f.exists():
+            try:
+                captions = json.loads(f.read_text(encoding="utf-8"))
+            except Exception as e:
+                print(f"[passages] unreadable {f}:", e)
+                captions = []
+            for c in captions:
+                if str(c).strip():
+                    yield {"source": "caption", "text": str(c).strip()}
+
+        segments = _transcript_segments(folder)
+        if segments is not None:
+            yield from _windows(segments, "transcript")
+        elif (folder / "transcript.txt").exists():
+            yield from _windows(({"text": s} for s in _sentences(folder / "transcript.txt")), "transcript")
+
+        if (folder / "story.txt").exists():
+            yield from _windows(({"text": s} for s in _sentences(folder / "story.txt")), "story")
+
+    for seq, p in enumerate(gen()):
+        p["seq"] = seq
+        yield p
@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
+
+import memory_state
+
+PEOPLE_DB = Path(__file__).parent / "data" / "people.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS person_memory (
+    person_norm TEXT NOT NULL,
+    memory_id   TEXT NOT NULL,
+    person      TEXT NOT NULL,          -- display form as last tagged
+    PRIMARY KEY (person_norm, memory_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS person_memory_by_memory ON person_memory(memory_id);
+CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+PEOPLE_MODES = ("or", "and")
+
+
+def normalize(name: str) -> str:
+    return " ".join((name or "").split()).casefold()
+
+
+def people_from_faces(folder: Path) -> List[str]:
+    """Distinct labels in a memory's faces.json, first-seen order."""
+    # memory_state.read logs an unreadable (e.g. half-written) file and treats it as missing
+    faces = memory_state.read(folder, "faces.json", default=[])
+    if not isinstance(faces, list):
+        print(f"[people] {Path(folder).name}/faces.json is not a list")
+        return []
+    seen, out = set(), []
+    for x in faces:
+        label = (x.get("label") or "").strip() if isinstance(x, dict) else ""
+        if label and normalize(label) not in seen:
+            seen.add(normalize(label))
+            out.append(label)
+    return out
+
+
+class PeopleIndex:
+    """
+    Inverted index person -> memories in SQLite, so a person filter is a
+    primary-key range scan instead of a metadata match inside the ANN query.
+    """
+
+    def __init__(self, db_path: Path = PEOPLE_DB):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def set_people(self, memory_id: str, people: Iterable[str]):
+        """Replace the people recorded for one memory."""
+        rows = {}
+        for p in people:
+            if normalize(p):
+                rows.setdefault(normalize(p), p.strip())
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute("DELETE FROM person_memory WHERE memory_id=?", (memory_id,))
+            c.executemany(
+                "INSERT INTO person_memory (person_norm, memory_id, person) VALUES (?, ?, ?)",
+                [(n, memory_id, disp) for n, disp in rows.items()],
+            )
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def remove_memory(self, memory_id: str):
+        self._conn().execute("DELETE FROM person_memory WHERE memory_id=?", (memory_id,))
+
+    def memories_for(self, people: Iterable[str], mode: str = "or") -> Set[str]:
+        """Memories containing any (mode="or") or all (mode="and") of the people."""
+        if mode not in PEOPLE_MODES:
+            raise ValueError(f"people_mode must be one of {', '.join(PEOPLE_MODES)}")
+        names = sorted({normalize(p) for p in people if normalize(p)})
+        if not names:
+            return set()
+        marks = ",".join("?" * len(names))
+        if mode == "and":
+            sql = (f"SELECT memory_id FROM person_memory WHERE person_norm IN ({marks}) "
+                   f"GROUP BY memory_id HAVING COUNT(*) = ?")
+            rows = self._conn().execute(sql, (*names, len(names))).fetchall()
+        else:
+            sql = f"SELECT DISTINCT memory_id FROM person_memory WHERE person_norm IN ({marks})"
+            rows = self._conn().execute(sql, names).fetchall()
+        return {r[0] for r in rows}
+
+    def people_for(self, memory_id: str) -> List[str]:
+        rows = self._conn().execute(
+            "SELECT person FROM person_memory WHERE memory_id=? ORDER BY person", (memory_id,)
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def all_people(self) -> List[Dict]:
+        rows = self._conn().execute(
+            "SELECT MIN(person), COUNT(*) FROM person_memory GROUP BY person_norm ORDER BY COUNT(*) DESC"
+        ).fetchall()
+        return [{"person": r[0], "memories": r[1]} for r in rows]
+
+    def rebuild(self, media_root: Path) -> int:
+        """Re-read every memory's faces.json and drop memories no longer on disk."""
+        seen = set()
+        media_root = Path(media_root)
+        for mem in sorted(media_root.iterdir()) if media_root.exists() else []:
+            if mem.is_dir():
+                self.set_people(mem.name, people_from_faces(mem))
+                seen.add(mem.name)
+        for (mid,) in self._conn().execute("SELECT DISTINCT memory_id FROM person_memory").fetchall():
+            if mid not in seen:
+                self.remove_memory(mid)
+        self._conn().execute("INSERT OR REPLACE INTO index_meta (key, value) VALUES ('built', '1')")
+        return len(seen)
+
+    def built(self) -> bool:
+        """False until the first full rebuild; an empty table alone can just mean nobody is tagged yet."""
+        row = self._conn().execute("SELECT value FROM index_meta WHERE key='built'").fetchone()
+        return row is not None
+
+
+people_index = PeopleIndex()
+
+
+if __name__ == "__main__":
+    count = people_index.rebuild(Path(__file__).parent / "data" / "memories")
+    print(f"indexed people for {count} memories")
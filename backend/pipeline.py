@@ -0,0 +1,231 @@
+import time
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import memory_state
+from blobstore import file_hash
+from embeddings import index_memory, embedding_version
+from processing import (
+    KEYFRAMES_VERSION, UNAVAILABLE_CAPTIONS, keyframes_cached, caption_images_cached,
+)
+from near_dupes import HASH_VERSION, index_images
+from ollama_client import ollama_base_url
+from preprocess import PREPROCESS_VERSION, image_assets, variants
+from providers import caption_version, transcript_version
+from transcribe import TRANSCRIPT_JSON, TRANSCRIPT_TXT, transcribe_memory
+from thumbnails import THUMB_VERSION, THUMBS_FILE, build_memory_thumbnails, memory_asset_files
+
+PIPELINE_FILE = "pipeline.json"
+
+
+def _glob(folder: Path, *patterns: str) -> List[Path]:
+    out: List[Path] = []
+    for pat in patterns:
+        out.extend(folder.glob(pat))
+    return sorted(out)
+
+
+def image_files(folder: Path) -> List[Path]:
+    return image_assets(folder)
+
+
+def video_files(folder: Path) -> List[Path]:
+    return _glob(folder, "*.mp4", "*.mov", "*.mkv")
+
+
+def audio_files(folder: Path) -> List[Path]:
+    return _glob(folder, "*.mp3", "*.m4a", "*.wav")
+
+
+def frame_files(folder: Path) -> List[Path]:
+    return _glob(folder / "frames", "*.jpg")
+
+
+class Stage:
+    """
+    One step of processing. `inputs` lists the files the stage reads and
+    `version` names the model/prompt it uses; together they make the stage
+    fingerprint. `outputs` are memory-relative paths the stage must leave
+    behind for a skip to be valid.
+    """
+
+    def __init__(self, name: str, inputs: Callable[[Path], Iterable[Path]],
+                 version: Callable[[], str], run: Callable[[Path, Callable], Dict],
+                 outputs: Callable[[Path], List[str]] = lambda folder: [], fatal: bool = True):
+        self.name = name
+        self.inputs = inputs
+        self.version = version
+        self.run = run
+        self.outputs = outputs
+        self.fatal = fatal  # non-fatal stages log and retry on the next run
+
+    def fingerprint(self, folder: Path) -> str:
+        h = hashlib.sha256(self.version().encode("utf-8"))
+        for p in sorted(set(self.inputs(folder))):
+            if p.exists():
+                h.update(p.relative_to(folder).as_posix().encode("utf-8"))
+                h.update(file_hash(p).encode("ascii"))
+        return h.hexdigest()
+
+
+# ----- stage implementations -----
+def _run_keyframes(folder: Path, progress) -> Dict:
+    videos = video_files(folder)
+    frames: List[str] = []
+    for i, vp in enumerate(videos):
+        # one video keeps frame_NN.jpg; several get a per-video prefix
+        prefix = f"{vp.stem}_" if len(videos) > 1 else ""
+        frames.extend(keyframes_cached(str(vp), folder / "frames", prefix=prefix, max_frames=5))
+        progress("keyframes", done=i + 1, total=len(videos))
+    return {"frames": len(frames)}
+
+
+def _caption_inputs(folder: Path) -> List[Path]:
+    return image_files(folder) + frame_files(folder)
+
+
+def _run_preprocess(folder: Path, progress) -> Dict:
+    # decode each photo/frame once; captions and faces read the cached variants,
+    # and the perceptual hashes that group near-duplicates are taken here
+    paths = [str(p) for p in _caption_inputs(folder)]
+    progress("preprocess", total=len(paths))
+    variants(paths, "caption")
+    return {"images": len(paths), "hashed": index_images(paths, folder.name)}
+
+
+def _run_captions(folder: Path, progress) -> Dict:
+    paths = [str(p) for p in _caption_inputs(folder)]
+    progress("captions", total=len(paths))
+    report: Dict = {}
+    captions = caption_images_cached(paths, report, ollama_base_url(folder)) if paths else []
+    memory_state.save(folder, "captions.json", captions)
+    # near_duplicates / library_reuse: captions shared instead of generated
+    info = {"captions": len(captions), **report}
+    missing = sum(c in UNAVAILABLE_CAPTIONS for c in captions)
+    if missing:
+        info["incomplete"] = f"{missing} caption(s) unavailable (local caption model missing?)"
+    return info
+
+
+def _transcript_inputs(folder: Path) -> List[Path]:
+    # videos carry audio tracks too
+    return audio_files(folder) + video_files(folder)
+
+
+def _run_transcript(folder: Path, progress) -> Dict:
+    media = _transcript_inputs(folder)
+    out = folder / TRANSCRIPT_TXT
+    if not media:
+        return {"transcript_chars": len(out.read_text(encoding="utf-8")) if out.exists() else 0}
+    return transcribe_memory(folder, media, progress)
+
+
+def _run_thumbnails(folder: Path, progress) -> Dict:
+    out = build_memory_thumbnails(folder)
+    return {"thumbnails": len(out["assets"])}
+
+
+def _index_inputs(folder: Path) -> List[Path]:
+    return [folder / n for n in ("captions.json", TRANSCRIPT_TXT, TRANSCRIPT_JSON, "faces.json", "story.txt")]
+
+
+def _run_index(folder: Path, progress) -> Dict:
+    index_memory(folder.name, folder.parent)
+    return {}
+
+
+STAGES: List[Stage] = [
+    Stage("thumbnails", memory_asset_files, lambda: THUMB_VERSION, _run_thumbnails,
+          outputs=lambda folder: [THUMBS_FILE]),
+    Stage("keyframes", video_files, lambda: f"{KEYFRAMES_VERSION}:5", _run_keyframes,
+          outputs=lambda folder: ["frames"] if video_files(folder) else []),
+    Stage("preprocess", _caption_inputs, lambda: f"{PREPROCESS_VERSION}:{HASH_VERSION}", _run_preprocess,
+          fatal=False),
+    Stage("captions", _caption_inputs, caption_version, _run_captions,
+          outputs=lambda folder: ["captions.json"]),
+    Stage("transcript", _transcript_inputs, transcript_version, _run_transcript,
+          outputs=lambda folder: [TRANSCRIPT_TXT, TRANSCRIPT_JSON] if _transcript_inputs(folder) else []),
+    # processing should not fail because of indexing
+    Stage("index", _index_inputs, embedding_version, _run_index, fatal=False),
+]
+STAGE_NAMES = [s.name for s in STAGES]
+
+
+def load_state(folder: Path) -> Dict:
+    return memory_state.read(folder, PIPELINE_FILE, default={"stages": {}})
+
+
+def _save_state(folder: Path, state: Dict):
+    memory_state.save(folder, PIPELINE_FILE, state)
+
+
+def parse_force(force: Optional[str]) -> List[str]:
+    """'captions,index' -> ['captions', 'index']; 'all' -> every stage."""
+    if not force:
+        return []
+    names = [n.strip() for n in force.split(",") if n.strip()]
+    if "all" in names:
+        return list(STAGE_NAMES)
+    unknown = [n for n in names if n not in STAGE_NAMES]
+    if unknown:
+        raise ValueError(f"unknown stage(s): {', '.join(unknown)}; expected {', '.join(STAGE_NAMES)}")
+    return names
+
+
+def run_pipeline(folder: Path, force: Iterable[str] = (), progress=None) -> Dict[str, Dict]:
+    """
+    Run the stages in order, skipping any whose fingerprint (input file
+    hashes + model/prompt version) matches the last successful run and whose
+    outputs still exist. Stages named in `force` always run, and so does a
+    stage whose last run reported itself "incomplete". Downstream
+    stages fingerprint the files upstream stages write, so they only rerun
+    when those files actually changed.
+    """
+    progress = progress or (lambda *a, **k: None)
+    force = set(force)
+    state = load_state(folder)
+    report: Dict[str, Dict] = {}
+
+    for stage in STAGES:
+        fp = stage.fingerprint(folder)
+        prev = state["stages"].get(stage.name, {})
+        outputs_ok = all((folder / o).exists() for o in stage.outputs(folder))
+        if stage.name not in force and prev.get("fingerprint") == fp and outputs_ok:
+            progress(stage.name, "skipped")
+            report[stage.name] = {"ran": False}
+            continue
+
+        progress(stage.name, "running")
+        t0 = time.perf_counter()
+        try:
+            info = stage.run(folder, progress) or {}
+        except Exception as e:
+            if stage.fatal:
+                raise
+            print(f"[pipeline] {folder.name}: stage {stage.name} failed:", e)
+            progress(stage.name, "failed")
+            report[stage.name] = {"ran": True, "error": str(e)}
+            continue
+        seconds = round(time.perf_counter() - t0, 3)
+        if info.get("incomplete"):
+            # ran, but with placeholder results: not recorded, so the next run retries it
+            print(f"[pipeline] {folder.name}: stage {stage.name} incomplete:", info["incomplete"])
+            if state["stages"].pop(stage.name, None) is not None:
+                _save_state(folder, state)
+            progress(stage.name, "failed")
+            report[stage.name] = {"ran": True, "seconds": seconds, **info}
+            continue
+        # outputs may have changed what the stage reads (e.g. frames); re-hash
+        state["stages"][stage.name] = {
+            "fingerprint": stage.fingerprint(folder),
+            "finished_at": datetime.now().isoformat(),
+            "seconds": seconds,
+            **info,
+        }
+        _save_state(folder, state)
+        progress(stage.name, "done")
+        report[stage.name] = {"ran": True, "seconds": seconds, **info}
+
+    return report
@@ -0,0 +1,118 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+from blobstore import derived, file_hash
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+# name -> (max pixels, which side it bounds, JPEG quality)
+#   caption: BLIP sees 384x384 anyway; local vision models similar
+#   faces:   what MediaPipe is run on and what crops are cut from
+#   upload:  what goes to hosted caption providers
+VARIANTS = {
+    "caption": (int(os.getenv("PREPROCESS_CAPTION_MAX", "512")), "long", 90),
+    "faces": (int(os.getenv("PREPROCESS_FACES_MAX", "1600")), "width", 95),
+    "upload": (int(os.getenv("PREPROCESS_UPLOAD_MAX", "1024")), "long", 85),
+}
+PREPROCESS_VERSION = "pre:1:" + ",".join(f"{n}{m}{s[0]}q{q}" for n, (m, s, q) in sorted(VARIANTS.items()))
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "4"))
+# renders of one image are serialised by a striped lock: a fixed set, so the
+# table doesn't grow with every image ever seen
+PREPROCESS_LOCK_STRIPES = 64
+
+_locks = [threading.Lock() for _ in range(PREPROCESS_LOCK_STRIPES)]
+_counters_lock = threading.Lock()
+counters = {"prepared": 0, "hits": 0, "failed": 0, "source_bytes": 0, "upload_bytes": 0}
+
+
+def _lock_for(key: str) -> threading.Lock:
+    return _locks[int(key[:8], 16) % len(_locks)]
+
+
+def _count(**inc):
+    with _counters_lock:
+        for k, v in inc.items():
+            counters[k] += v
+
+
+def image_assets(folder: Path) -> List[Path]:
+    """Every photo of a memory: images/ (where uploads go) and the top level."""
+    folder = Path(folder)
+    images_dir = folder / "images"
+    images = sorted(p for p in images_dir.iterdir() if p.suffix.lower() in IMAGE_EXTS) if images_dir.exists() else []
+    images += sorted(p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in IMAGE_EXTS)
+    return images
+
+
+def _target(size, max_px: int, side: str):
+    w, h = size
+    bound = w if side == "width" else max(w, h)
+    if bound <= max_px:
+        return w, h
+    scale = max_px / bound
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def _render(src: Path, out: Dict[str, Path]):
+    """Decode once (EXIF-rotated), then step down through the variants, largest first."""
+    from PIL import Image, ImageOps
+    biggest = max(m for m, _, _ in VARIANTS.values())
+    with Image.open(src) as im:
+        im.draft("RGB", (biggest, biggest))  # cheap JPEG pre-scale, never below the largest variant
+        img = ImageOps.exif_transpose(im).convert("RGB")
+    sizes = {n: _target(img.size, m, s) for n, (m, s, _) in VARIANTS.items()}
+    current = img
+    for name in sorted(VARIANTS, key=lambda n: sizes[n][0] * sizes[n][1], reverse=True):
+        if current.size != sizes[name]:
+            current = current.resize(sizes[name], Image.LANCZOS)
+        tmp = out[name].with_name(f".{out[name].name}.{threading.get_ident()}.tmp")
+        current.save(tmp, "JPEG", quality=VARIANTS[name][2], optimize=True)
+        os.replace(tmp, out[name])
+
+
+def prepare(path) -> Dict[str, str]:
+    """
+    Paths of every variant of one image, rendered once per content hash and
+    cached. An image PIL cannot decode maps every variant to itself.
+    """
+    path = Path(path)
+    h = file_hash(path)
+    art = derived.artefact_dir("preprocess", h, PREPROCESS_VERSION)
+    out = {name: art / f"{name}.jpg" for name in VARIANTS}
+    if all(p.exists() for p in out.values()):
+        _count(hits=1)
+        return {n: str(p) for n, p in out.items()}
+    with _lock_for(h):
+        if not all(p.exists() for p in out.values()):
+            try:
+                _render(path, out)
+            except Exception as e:
+                print(f"[preprocess] {path.name}: {e}")
+                _count(failed=1)
+                return {n: str(path) for n in VARIANTS}
+            _count(prepared=1, source_bytes=path.stat().st_size, upload_bytes=out["upload"].stat().st_size)
+    return {n: str(p) for n, p in out.items()}
+
+
+def variant(path, name: str) -> str:
+    return prepare(path)[name]
+
+
+def variants(paths: List[str], name: str) -> List[str]:
+    """One variant for many images, preparing the missing ones in parallel."""
+    if len(paths) <= 1:
+        return [variant(p, name) for p in paths]
+    with ThreadPoolExecutor(max_workers=max(1, min(PREPROCESS_WORKERS, len(paths)))) as pool:
+        return [v[name] for v in pool.map(prepare, paths)]
+
+
+def max_side(name: str) -> int:
+    return VARIANTS[name][0]
+
+
+def preprocess_stats() -> Dict:
+    with _counters_lock:
+        return dict(counters)
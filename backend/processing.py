@@ -0,0 +1,81 @@
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from blobstore import derived, file_hash, link_file
+from media_utils import extract_keyframes, keyframes_version
+from near_dupes import plan
+from preprocess import variants
+from providers import (
+    caption_provider, gemini_caption_images, ollama_caption_images, blip_caption_images_local,
+    caption_version,
+)
+
+KEYFRAMES_VERSION = keyframes_version()
+# placeholder string returned when the local caption model is missing; never cached
+UNAVAILABLE_CAPTIONS = ("(local caption unavailable)",)
+
+
+def keyframes_cached(video_path: str, frames_dir: Path, prefix: str = "", max_frames: int = 5) -> List[str]:
+    """Extract keyframes once per video content hash and link them into frames_dir."""
+    h = file_hash(video_path)
+    version = f"{KEYFRAMES_VERSION}:{max_frames}"
+    art = derived.artefact_dir("keyframes", h, version)
+    names = derived.get("keyframes", h, version)
+    if names is None:
+        names = [Path(p).name for p in extract_keyframes(video_path, str(art), max_frames=max_frames)]
+        derived.put("keyframes", h, version, names)
+    return [str(link_file(art / n, Path(frames_dir) / f"{prefix}{n}")) for n in names]
+
+
+def _caption_uncached(paths: List[str], ollama_url: Optional[str] = None) -> List[str]:
+    # models get downscaled, EXIF-rotated JPEGs, never the full-size originals
+    provider = caption_provider()
+    if provider == "ollama":
+        return ollama_caption_images(variants(paths, "upload"), ollama_url)
+    if provider == "gemini":
+        return gemini_caption_images(variants(paths, "upload"))
+    return blip_caption_images_local(variants(paths, "caption"))
+
+
+def caption_images_cached(paths: List[str], report: Optional[Dict] = None,
+                          ollama_url: Optional[str] = None) -> List[str]:
+    """
+    Caption images, reusing results for content already captioned with the
+    same model/prompt. Identical files within the batch are captioned once,
+    and near-duplicates (bursts, similar keyframes) share one caption; counts
+    of what was shared go into `report`. `ollama_url` picks the Ollama
+    server when captions come from Ollama.
+    """
+    version = caption_version()
+    hashes = [file_hash(p) for p in paths]
+    known: Dict[str, str] = {}
+    todo: Dict[str, str] = {}  # hash -> first path with that content
+    for p, h in zip(paths, hashes):
+        if h in known or h in todo:
+            continue
+        cap = derived.get("caption", h, version)
+        if cap is None:
+            todo[h] = p
+        else:
+            known[h] = cap
+
+    if todo:
+        sources, found = plan(todo, lambda h: derived.get("caption", h, version), report)
+        known.update(found)
+        run = {h: p for h, p in todo.items() if sources[h] == h}
+        fresh = _caption_uncached(list(run.values()), ollama_url) if run else []
+        for h, cap in zip(run.keys(), fresh):
+            known[h] = cap
+            if cap not in UNAVAILABLE_CAPTIONS:
+                derived.put("caption", h, version, cap)
+        for h in todo:
+            known[h] = known[sources[h]]
+
+    return [known[h] for h in hashes]
+
+
+def _audio_mime(path: str) -> str:
+    mime = "audio/mpeg"
+    if path.lower().endswith(".wav"): mime = "audio/wav"
+    if path.lower().endswith(".m4a"): mime = "audio/mp4"  # Gemini accepts mp4/m4a
+    return mime
@@ -1,60 +1,159 @@
 import os, io, base64, json
+import threading
 from typing import List, Optional
-import google.generativeai as genai
+
+from gemini_client import GEMINI_MODEL, get_gemini_client
+from model_registry import registry
+from preprocess import PREPROCESS_VERSION
+
 PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
 
 # ---------- Gemini ----------
-def gemini_setup():
-    import google.generativeai as genai
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    # 1.5 Flash is fast/cost effective; Pro is better quality but slower
-    return genai.GenerativeModel("gemini-2.5-flash")
-
-def gemini_caption_images(image_bytes_list: List[bytes]) -> List[str]:
-    model = gemini_setup()
-    captions = []
-    for b in image_bytes_list:
-        # send as inline image
-        part = {"mime_type": "image/jpeg", "data": b}
-        prompt = "Write a short, warm caption for this image in one sentence."
-        resp = model.generate_content([prompt, part])
-        captions.append(resp.text.strip())
-    return captions
-
-def gemini_transcribe_audio(audio_bytes: bytes, mime="audio/mpeg") -> str:
-    model = gemini_setup()
-    part = {"mime_type": mime, "data": audio_bytes}
-    prompt = "Transcribe the speech in this audio. Return only the transcript."
-    resp = model.generate_content([prompt, part])
-    return resp.text.strip()
+CAPTION_PROMPT = "Write a short, warm caption for this image in one sentence."
+TRANSCRIBE_PROMPT = "Transcribe the speech in this audio. Return only the transcript."
+
+def gemini_caption_images(paths: List[str]) -> List[str]:
+    # concurrent, rate-limited; mime type comes from the image bytes
+    return get_gemini_client().caption_images(CAPTION_PROMPT, paths)
+
+def gemini_transcribe_audio(audio, mime="audio/mpeg") -> str:
+    # bytes or a path; large files are streamed to the File API instead of sent inline
+    return get_gemini_client().generate(TRANSCRIBE_PROMPT, audio, mime)
+
+# ---------- Ollama (local vision model over HTTP) ----------
+OLLAMA_CAPTION_MODEL = os.getenv("OLLAMA_CAPTION_MODEL", "llava")
+
+def caption_provider() -> str:
+    """CAPTION_PROVIDER overrides LLM_PROVIDER for captions only (gemini | ollama | blip)."""
+    return (os.getenv("CAPTION_PROVIDER") or PROVIDER).lower()
+
+def ollama_caption_images(paths: List[str], base_url: Optional[str] = None) -> List[str]:
+    from concurrent.futures import ThreadPoolExecutor
+    from ollama_client import OLLAMA_MAX_CONCURRENCY, get_ollama_client
+    client = get_ollama_client(base_url)
+
+    def one(p: str) -> str:
+        with open(p, "rb") as f:
+            return client.generate(OLLAMA_CAPTION_MODEL, CAPTION_PROMPT, images=[f.read()]).strip()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(OLLAMA_MAX_CONCURRENCY, len(paths)))) as pool:
+        return list(pool.map(one, paths))
 
 # ---------- Local (fallback) ----------
-def blip_caption_images_local(image_paths: List[str]) -> List[str]:
+BLIP_MODEL = "Salesforce/blip-image-captioning-base"
+
+def _load_blip():
+    from transformers import BlipProcessor, BlipForConditionalGeneration
+    processor = BlipProcessor.from_pretrained(BLIP_MODEL)
+    model = BlipForConditionalGeneration.from_pretrained(BLIP_MODEL)
+    model.eval()
+    return processor, model
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")  # or "small" if you have time/bandwidth
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", "1"))
+# files transcribed concurrently; each gets its own CTranslate2 worker
+TRANSCRIBE_PARALLEL = int(os.getenv("TRANSCRIBE_PARALLEL", "2"))
+# audio is decoded and transcribed this many seconds at a time; consecutive
+# chunks overlap so speech cut at a boundary is heard whole by the next one
+TRANSCRIBE_CHUNK_SECONDS = int(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "300"))
+TRANSCRIBE_OVERLAP_SECONDS = int(os.getenv("TRANSCRIBE_OVERLAP_SECONDS", "10"))
+
+def _load_whisper():
+    from faster_whisper import WhisperModel
+    threads = int(os.getenv("WHISPER_CPU_THREADS", "0")) or max(1, (os.cpu_count() or 1) // TRANSCRIBE_PARALLEL)
+    return WhisperModel(WHISPER_MODEL, device="cpu", compute_type=WHISPER_COMPUTE_TYPE,
+                        cpu_threads=threads, num_workers=TRANSCRIBE_PARALLEL)
+
+# generate() on a shared torch module is not re-entrant-safe across threads
+registry.register("blip", _load_blip, thread_safe=False)
+registry.register("whisper", _load_whisper)
+
+BLIP_BATCH_SIZE = int(os.getenv("BLIP_BATCH_SIZE", "8"))
+BLIP_MAX_NEW_TOKENS = 30
+
+def _physical_cores() -> int:
+    """Physical cores (SMT siblings counted once); logical CPUs when that can't be told."""
+    try:
+        import psutil
+        n = psutil.cpu_count(logical=False)
+        if n:
+            return n
+    except ImportError:
+        pass
+    try:
+        cores, phys = set(), ""
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    phys = value.strip()
+                elif key == "core id":
+                    cores.add((phys, value.strip()))
+        if cores:
+            return len(cores)
+    except OSError:
+        pass
+    return os.cpu_count() or 1
+
+_torch_threads_lock = threading.Lock()
+_torch_threads_set = False
+
+def _torch_threads(torch):
+    # default: physical cores; intra-op threads beyond them just contend.
+    # Set once per process: set_num_threads rebuilds torch's thread pool.
+    global _torch_threads_set
+    with _torch_threads_lock:
+        if _torch_threads_set:
+            return
+        n = int(os.getenv("TORCH_NUM_THREADS", "0") or 0) or _physical_cores()
+        if torch.get_num_threads() != n:
+            torch.set_num_threads(n)
+        _torch_threads_set = True
+
+def blip_caption_images_local(image_paths: List[str], batch_size: Optional[int] = None) -> List[str]:
+    """
+    Caption images with BLIP in batches. Images are preprocessed together,
+    generated under inference mode and returned in input order.
+    """
     # Optional: only if transformers+torch installed
     try:
-        from transformers import BlipProcessor, BlipForConditionalGeneration
+        import transformers  # noqa: F401
         from PIL import Image
         import torch
     except Exception:
         return ["(local caption unavailable)"] * len(image_paths)
 
-    processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-    model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+    batch_size = max(1, batch_size or BLIP_BATCH_SIZE)
+    _torch_threads(torch)
 
-    caps = []
-    for p in image_paths:
-        image = Image.open(p).convert("RGB")
-        inputs = processor(image, return_tensors="pt")
-        out = model.generate(**inputs, max_new_tokens=30)
-        text = processor.decode(out[0], skip_special_tokens=True)
-        caps.append(text)
+    caps: List[str] = []
+    with registry.use("blip") as (processor, model), torch.inference_mode():
+        for i in range(0, len(image_paths), batch_size):
+            chunk = image_paths[i:i + batch_size]
+            images = []
+            for p in chunk:
+                with Image.open(p) as im:
+                    images.append(im.convert("RGB"))
+            inputs = processor(images=images, return_tensors="pt")
+            out = model.generate(**inputs, max_new_tokens=BLIP_MAX_NEW_TOKENS)
+            caps.extend(t.strip() for t in processor.batch_decode(out, skip_special_tokens=True))
     return caps
 
-def whisper_transcribe_local(audio_path: str) -> str:
-    try:
-        from faster_whisper import WhisperModel
-    except Exception:
-        return "(local transcript unavailable)"
-    model = WhisperModel("base")  # or "small" if you have time/bandwidth
-    segments, _ = model.transcribe(audio_path)
-    return " ".join([s.text.strip() for s in segments if s.text])
+# Version strings key the derived-result cache: change the model, prompt or
+# the preprocessed image a model sees and previously cached
+# captions/transcripts are no longer reused.
+def caption_version(provider: Optional[str] = None) -> str:
+    provider = (provider or caption_provider()).lower()
+    if provider == "gemini":
+        return f"gemini:{GEMINI_MODEL}:{CAPTION_PROMPT}:{PREPROCESS_VERSION}"
+    if provider == "ollama":
+        return f"ollama:{OLLAMA_CAPTION_MODEL}:{CAPTION_PROMPT}:{PREPROCESS_VERSION}"
+    return f"blip:{BLIP_MODEL}:{BLIP_MAX_NEW_TOKENS}:{PREPROCESS_VERSION}"
+
+def transcript_version(provider: str = PROVIDER) -> str:
+    if provider.lower() == "gemini":
+        return f"gemini:{GEMINI_MODEL}:{TRANSCRIBE_PROMPT}"
+    return (f"faster-whisper:{WHISPER_MODEL}:{WHISPER_COMPUTE_TYPE}:beam{WHISPER_BEAM_SIZE}:vad"
+            f":chunk{TRANSCRIBE_CHUNK_SECONDS}+{TRANSCRIBE_OVERLAP_SECONDS}")
@@ -1,17 +1,185 @@
 # reindex.py
+"""
+Bulk (re)index of every memory into the embeddings collection.
+
+    python reindex.py                      # incremental: only changed docs
+    python reindex.py --force              # re-embed everything in place
+    python reindex.py --new-collection     # build memories_<ts>, then swap it in
+    python reindex.py --resume             # continue an interrupted run
+
+Docs are built in parallel, embedded EMBED_BATCH at a time and upserted in
+batches. A memory is skipped when its doc hash (text + embedding model)
+matches the one stored with its vector; its passages (passages.py) are
+re-embedded only where their own hashes changed. Progress is checkpointed after every
+batch, so an interrupted run can pick up where it stopped.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from main import index_memory, MEDIA_ROOT
-
-def run():
-    for mem in MEDIA_ROOT.iterdir():
-        if mem.is_dir():
-            mid = mem.name
-            try:
-                print(f"[Indexing] {mid}")
-                index_memory(mid, MEDIA_ROOT)
-            except Exception as e:
-                print(f"[SKIP] {mid}: {e}")
+from typing import Dict, List, Optional
+
+from embeddings import (
+    COLLECTION_NAME, active_collection_name, build_memory_doc, doc_hash, doc_metadata, embed_texts,
+    embedding_version, index_passages, open_collection, passages_collection_name,
+    set_active_collection, bump_index_version, client,
+)
+from lexical_index import lexical_index
+from people_index import people_index
+
+MEDIA_ROOT = Path(__file__).parent / "data" / "memories"
+CHECKPOINT_FILE = Path(__file__).parent / "data" / "reindex.checkpoint.json"
+
+EMBED_BATCH = int(os.getenv("REINDEX_EMBED_BATCH", "64"))
+UPSERT_BATCH = int(os.getenv("REINDEX_UPSERT_BATCH", "256"))
+DOC_WORKERS = int(os.getenv("REINDEX_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+
+def _write_json(path: Path, data: Dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def load_checkpoint() -> Optional[Dict]:
+    if not CHECKPOINT_FILE.exists():
+        return None
+    try:
+        return json.loads(CHECKPOINT_FILE.read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"[reindex] ignoring unreadable checkpoint: {e}")
+        return None
+
+
+def _stored_hashes(collection, ids: List[str]) -> Dict[str, str]:
+    out = {}
+    for i in range(0, len(ids), 500):
+        got = collection.get(ids=ids[i:i + 500], include=["metadatas"])
+        for mid, meta in zip(got["ids"], got["metadatas"]):
+            out[mid] = (meta or {}).get("doc_hash")
+    return out
+
+
+def _build(folder: Path):
+    try:
+        return folder.name, build_memory_doc(folder), None
+    except Exception as e:
+        return folder.name, None, e
+
+
+def _flush(collection, pending: List, stats: Dict):
+    """Embed and upsert the pending (memory_id, doc) pairs."""
+    for i in range(0, len(pending), UPSERT_BATCH):
+        chunk = pending[i:i + UPSERT_BATCH]
+        embs = []
+        for j in range(0, len(chunk), EMBED_BATCH):
+            embs.extend(embed_texts([doc["text"] for _, doc in chunk[j:j + EMBED_BATCH]]))
+        collection.upsert(
+            ids=[mid for mid, _ in chunk],
+            embeddings=embs,
+            documents=[doc["text"] for _, doc in chunk],
+            metadatas=[doc_metadata(mid, doc) for mid, doc in chunk],
+        )
+        for mid, doc in chunk:
+            people_index.set_people(mid, doc["people"])
+        stats["indexed"] += len(chunk)
+
+
+def _index_passages(folder: Path, passages, force: bool) -> int:
+    try:
+        return index_passages(folder.name, folder, passages, force=force)["embedded"]
+    except Exception as e:
+        print(f"[SKIP] passages {folder.name}: {e}")
+        return 0
+
+
+def run(force: bool = False, new_collection: bool = False, resume: bool = False,
+        drop_old: bool = False, media_root: Path = MEDIA_ROOT) -> Dict:
+    folders = sorted(p for p in media_root.iterdir() if p.is_dir())
+    ckpt = load_checkpoint() if resume else None
+    if ckpt and ckpt.get("embedding_version") != embedding_version():
+        print("[reindex] checkpoint is for another embedding model; starting over")
+        ckpt = None
+
+    if ckpt:
+        target, new_collection = ckpt["collection"], ckpt["swap"]
+        done = set(ckpt["done"])
+        print(f"[reindex] resuming into {target} ({len(done)} done)")
+    else:
+        target = f"{COLLECTION_NAME}_{time.strftime('%Y%m%d_%H%M%S')}" if new_collection else active_collection_name()
+        done = set()
+    collection = open_collection(target)
+    passages = open_collection(passages_collection_name(target))
+    checkpoint = {"collection": target, "swap": new_collection,
+                  "embedding_version": embedding_version(), "done": sorted(done)}
+
+    todo = [f for f in folders if f.name not in done]
+    stored = {} if force else _stored_hashes(collection, [f.name for f in todo])
+    stats = {"total": len(folders), "indexed": 0, "unchanged": 0, "failed": 0, "resumed": len(done),
+             "passages_embedded": 0}
+    t0 = time.perf_counter()
+
+    batch = UPSERT_BATCH
+    with ThreadPoolExecutor(max_workers=DOC_WORKERS) as pool:
+        for start in range(0, len(todo), batch):
+            pending, built = [], []
+            for mid, doc, err in pool.map(_build, todo[start:start + batch]):
+                if err is not None:
+                    print(f"[SKIP] {mid}: {err}")
+                    stats["failed"] += 1
+                    continue
+                lexical_index.set_document(mid, doc["fields"])
+                built.append(media_root / mid)
+                if not force and stored.get(mid) == doc_hash(doc):
+                    stats["unchanged"] += 1
+                    continue
+                pending.append((mid, doc))
+            if pending:
+                _flush(collection, pending, stats)
+            # passages cover the full text, so they're checked even when the doc is unchanged;
+            # index_passages only embeds passages whose hash moved
+            for res in pool.map(lambda f: _index_passages(f, passages, force), built):
+                stats["passages_embedded"] += res
+            done.update(f.name for f in built)
+            checkpoint["done"] = sorted(done)
+            _write_json(CHECKPOINT_FILE, checkpoint)
+            print(f"[reindex] {min(start + batch, len(todo))}/{len(todo)} "
+                  f"indexed={stats['indexed']} unchanged={stats['unchanged']} failed={stats['failed']}")
+
+    if new_collection:
+        previous = active_collection_name()
+        set_active_collection(target)
+        print(f"[reindex] active collection: {previous} -> {target}")
+        if drop_old and previous != target:
+            for name in (previous, passages_collection_name(previous)):
+                try:
+                    client.delete_collection(name)
+                except Exception as e:
+                    print(f"[reindex] could not drop {name}: {e}")
+    else:
+        bump_index_version()
+
+    CHECKPOINT_FILE.unlink(missing_ok=True)
+    stats["collection"] = target
+    stats["seconds"] = round(time.perf_counter() - t0, 2)
+    return stats
+
 
 if __name__ == "__main__":
-    run()
-    print("\n✅ Reindex complete. Restart backend and try search.")
+    ap = argparse.ArgumentParser(description="Rebuild the memory embeddings index.")
+    ap.add_argument("--force", action="store_true", help="re-embed even if the doc hash is unchanged")
+    ap.add_argument("--new-collection", action="store_true",
+                    help="build into a fresh collection and swap it in when complete")
+    ap.add_argument("--drop-old", action="store_true", help="delete the previous collection after a swap")
+    ap.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    args = ap.parse_args()
+    if not MEDIA_ROOT.exists():
+        sys.exit(f"no memories at {MEDIA_ROOT}")
+    result = run(force=args.force, new_collection=args.new_collection,
+                 resume=args.resume, drop_old=args.drop_old)
+    print(json.dumps(result, indent=2))
+    print("\n✅ Reindex complete.")
@@ -0,0 +1,126 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+import memory_state
+from blobstore import derived
+from gemini_client import get_gemini_client
+from ollama_client import get_ollama_client, ollama_base_url
+
+STORY_GEMINI_MODEL = os.getenv("STORY_GEMINI_MODEL", "gemini-2.5-flash")
+STORY_OLLAMA_MODEL = os.getenv("STORY_OLLAMA_MODEL", "gpt-oss-20b")
+STORY_PROVIDERS = ("gemini", "ollama")
+
+STORY_TEMPLATE = """
+You are a warm companion helping someone with memory loss gently remember.
+Write a short, emotional memory story.
+
+People involved: {people}
+Captions: {captions}
+Transcript clues: {transcript}
+
+Write in simple, positive, comforting tone (4-7 lines).
+Do NOT lecture. Just retell the moment like a soft memory.
+"""
+
+
+def build_prompt(folder: Path) -> str:
+    captions_file = folder / "captions.json"
+    captions = json.loads(captions_file.read_text(encoding="utf-8")) if captions_file.exists() else []
+
+    transcript_file = folder / "transcript.txt"
+    transcript = transcript_file.read_text(encoding="utf-8").strip() if transcript_file.exists() else ""
+
+    faces_file = folder / "faces.json"
+    faces = []
+    if faces_file.exists():
+        # list of {crop_file, label...}
+        faces = [f["label"] for f in json.loads(faces_file.read_text(encoding="utf-8")) if f.get("label")]
+
+    return STORY_TEMPLATE.format(
+        people=", ".join(faces) if faces else "unknown",
+        captions=", ".join(str(c) for c in captions[:3]),
+        transcript=transcript[:200],
+    )
+
+
+def story_provider() -> Tuple[str, str]:
+    """
+    (provider, model) from STORY_PROVIDER, else LLM_PROVIDER. An explicit
+    STORY_PROVIDER is used as given (RuntimeError if it can't be); only the
+    LLM_PROVIDER default falls back to the local Ollama model when there is
+    no Gemini API key.
+    """
+    explicit = (os.getenv("STORY_PROVIDER") or "").lower()
+    if explicit and explicit not in STORY_PROVIDERS:
+        raise RuntimeError(f"STORY_PROVIDER must be one of {', '.join(STORY_PROVIDERS)}")
+    provider = explicit or os.getenv("LLM_PROVIDER", "gemini").lower()
+    if provider == "gemini":
+        if os.getenv("GEMINI_API_KEY"):
+            return "gemini", STORY_GEMINI_MODEL
+        if explicit:
+            raise RuntimeError("STORY_PROVIDER=gemini but GEMINI_API_KEY is not set")
+    return "ollama", STORY_OLLAMA_MODEL
+
+
+def prompt_key(provider: str, model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{provider}\n{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+# ----- providers (each yields text pieces as they arrive) -----
+def _stream_gemini(folder: Path, model: str, prompt: str) -> Iterator[str]:
+    # shares the Gemini client's rate limit, retries and latency stats
+    return get_gemini_client().stream_generate(prompt, model)
+
+
+def _stream_ollama(folder: Path, model: str, prompt: str) -> Iterator[str]:
+    # the server the memory was uploaded against, if metadata.json names one
+    return get_ollama_client(ollama_base_url(folder)).stream_generate(model, prompt)
+
+
+_STREAMERS = {"gemini": _stream_gemini, "ollama": _stream_ollama}
+
+
+# ----- generation -----
+def stream_story(folder: Path, force: bool = False) -> Iterator[Dict]:
+    """
+    Events for one story: {"token": text} while the model streams, then
+    {"done": story, "cached": bool}. A story for an identical
+    (provider, model, prompt) is served from the derived cache.
+    story.txt is written only once the stream completed.
+    """
+    prompt = build_prompt(folder)
+    provider, model = story_provider()
+    key = prompt_key(provider, model, prompt)
+    cached = None if force else derived.get("story", key, f"{provider}:{model}")
+    if cached is not None:
+        yield {"token": cached}
+        save_story(folder, cached)
+        yield {"done": cached, "cached": True, "provider": provider, "model": model}
+        return
+
+    pieces = []
+    for piece in _STREAMERS[provider](folder, model, prompt):
+        pieces.append(piece)
+        yield {"token": piece}
+    story = "".join(pieces).strip()
+    if not story:
+        raise RuntimeError(f"{provider} returned an empty story")
+    derived.put("story", key, f"{provider}:{model}", story)
+    save_story(folder, story)
+    yield {"done": story, "cached": False, "provider": provider, "model": model}
+
+
+def generate_story(folder: Path, force: bool = False) -> Dict:
+    """Blocking variant: drains the stream and returns the final event."""
+    final = {}
+    for event in stream_story(folder, force):
+        if "done" in event:
+            final = event
+    return final
+
+
+def save_story(folder: Path, story: str):
+    memory_state.save_text(folder, "story.txt", story)
@@ -0,0 +1,58 @@
+import sys
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture(scope="session")
+def fake_api():
+    """dev_fakes.py served on a free local port; yields its base URL."""
+    import uvicorn
+    import dev_fakes
+    dev_fakes.FAKE_LATENCY_MS = 0
+    dev_fakes.FAKE_TOKEN_MS = 1
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(dev_fakes.app, host="127.0.0.1", port=port, log_level="warning"))
+    t = threading.Thread(target=server.run, daemon=True)
+    t.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("dev_fakes did not start")
+        time.sleep(0.02)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    t.join(5)
+
+
+@pytest.fixture
+def media(tmp_path, monkeypatch):
+    """
+    main with its media root, catalog, people and lexical indexes, index
+    version, blob store and derived cache pointed at tmp_path; yields the
+    media root.
+    """
+    import main
+    import embeddings
+    from blobstore import blobs, derived
+    from catalog import Catalog
+    from lexical_index import LexicalIndex
+    from people_index import PeopleIndex
+    root = tmp_path / "memories"
+    root.mkdir()
+    monkeypatch.setattr(main, "MEDIA_ROOT", root)
+    monkeypatch.setattr(main, "catalog", Catalog(tmp_path / "catalog.sqlite3", root))
+    monkeypatch.setattr(main, "people_index", PeopleIndex(tmp_path / "people.sqlite3"))
+    monkeypatch.setattr(embeddings, "lexical_index", LexicalIndex(tmp_path / "lexical.sqlite3"))
+    monkeypatch.setattr(embeddings, "INDEX_VERSION_DB", tmp_path / "index_version.sqlite3")
+    monkeypatch.setattr(embeddings, "_version_local", threading.local())
+    monkeypatch.setattr(derived, "root", tmp_path / "derived")
+    monkeypatch.setattr(blobs, "root", tmp_path / "blobs")
+    return root
@@ -0,0 +1,59 @@
+import threading
+
+import blobstore
+from blobstore import BlobStore, DerivedCache, file_hash, sha256_file
+from cache import TTLCache
+
+
+def _run(n, fn):
+    errors = []
+
+    def wrap(i):
+        try:
+            fn(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=wrap, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def test_hash_memo_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(blobstore, "_hash_memo", TTLCache(maxsize=3))
+    files = []
+    for i in range(5):
+        f = tmp_path / f"{i}.bin"
+        f.write_bytes(bytes([i]) * 10)
+        files.append(f)
+        assert file_hash(f) == sha256_file(f)
+    assert blobstore._hash_memo.stats()["size"] == 3
+    assert file_hash(files[-1]) == sha256_file(files[-1])
+
+
+def test_threads_linking_one_destination(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    src = tmp_path / "upload.bin"
+    src.write_bytes(b"content" * 1000)
+    sha = sha256_file(src)
+    store.adopt(src, sha)
+    dest = tmp_path / "memory" / "copy.bin"
+    assert _run(16, lambda i: store.link_into(sha, dest)) == []
+    assert dest.read_bytes() == src.read_bytes()
+    assert [p.name for p in dest.parent.iterdir()] == ["copy.bin"]
+
+
+def test_derived_counters_under_threads(tmp_path):
+    cache = DerivedCache(tmp_path / "derived")
+    cache.put("caption", "ab" * 32, "v1", "a cat")
+
+    def lookups(i):
+        for _ in range(200):
+            cache.get("caption", "ab" * 32, "v1")
+            cache.get("caption", "cd" * 32, "v1")
+
+    assert _run(8, lookups) == []
+    assert cache.stats() == {"hits": 1600, "misses": 1600}
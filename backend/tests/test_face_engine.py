@@ -0,0 +1,42 @@
+from PIL import Image
+
+import face_engine
+import face_utils
+import near_dupes
+from blobstore import derived, file_hash
+from face_utils import face_cache_version
+
+
+def _images(tmp_path):
+    paths = []
+    for name, colour in (("bad.jpg", (10, 20, 30)), ("good.jpg", (200, 180, 160))):
+        p = tmp_path / name
+        Image.new("RGB", (64, 64), colour).save(p)
+        paths.append(str(p))
+    return paths
+
+
+def test_failing_image_loses_only_its_faces(media, tmp_path, monkeypatch):
+    monkeypatch.setattr(near_dupes, "PHASH_THRESHOLD", 0)
+    bad, good = _images(tmp_path)
+    face = {"bbox": {"x": 1, "y": 1, "w": 8, "h": 8}, "score": 0.9, "crop_file": "000.jpg"}
+
+    def flaky(img_path, art_dir, **kwargs):
+        if img_path == bad:
+            raise RuntimeError("detector crashed")
+        with open(f"{art_dir}/000.jpg", "wb") as f:
+            f.write(b"crop")
+        return [face]
+
+    monkeypatch.setattr(face_utils, "detect_faces_on_image", flaky)
+    faces = face_engine.detect_faces_batch([bad, good], str(tmp_path / "faces"), workers=1)
+    assert [f["source_image"] for f in faces] == ["good.jpg"]
+    version = face_cache_version(0.5)
+    assert derived.get("faces", file_hash(good), version) == [face]
+    assert derived.get("faces", file_hash(bad), version) is None  # not cached, so retried next run
+
+
+def test_pool_task_catches_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_engine, "_detector", object())  # has no process(): detection raises
+    _, good = _images(tmp_path)
+    assert face_engine._detect_task((good, str(tmp_path), 0.5)) is None
@@ -0,0 +1,44 @@
+import memory_state
+
+
+def _face(crop_file):
+    return {"source_image": "a.jpg", "crop_file": crop_file, "bbox": {"x": 0, "y": 0, "w": 10, "h": 10},
+            "score": 0.9, "keypoints": None, "label": None}
+
+
+def test_tags_changed_during_detection_win(media, monkeypatch):
+    import main
+    folder = media / "memory_faces"
+    folder.mkdir()
+    memory_state.save(folder, "faces.json", [
+        {**_face("face_a.jpg"), "label": "Ravi", "label_source": "human"},
+        {**_face("face_b.jpg"), "label": "Mom", "label_source": "human"},
+    ])
+    monkeypatch.setattr(main, "detect_faces_batch",
+                        lambda *a, **k: [_face("face_a.jpg"), _face("face_b.jpg"), _face("face_c.jpg")])
+
+    def index_faces(memory_id, faces_dir, faces):
+        # a person edits tags while the crops are being embedded
+        def edit(data):
+            for f in data:
+                if f["crop_file"] == "face_a.jpg":
+                    f["label"], f["label_source"] = None, None
+                if f["crop_file"] == "face_b.jpg":
+                    f["label"] = "Mum"
+        memory_state.update(folder, "faces.json", edit)
+        faces[2]["label"], faces[2]["label_source"] = "Ravi", "auto"
+        return faces
+
+    monkeypatch.setattr(main.face_index, "index_faces", index_faces)
+    monkeypatch.setattr(main.face_index, "remove_memory_faces", lambda *a: None)
+    synced = {}
+    monkeypatch.setattr(main.face_index, "set_labels", lambda mid, labels: synced.update(labels))
+
+    main._faces_detect("memory_faces")
+
+    labels = {f["crop_file"]: (f.get("label"), f.get("label_source"))
+              for f in memory_state.read(folder, "faces.json")}
+    assert labels["face_a.jpg"][0] is None  # cleared by a human: not restored
+    assert labels["face_b.jpg"] == ("Mum", "human")
+    assert labels["face_c.jpg"] == ("Ravi", "auto")
+    assert synced == {"face_a.jpg": "", "face_b.jpg": "Mum"}
@@ -0,0 +1,69 @@
+import hashlib
+import tempfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import dev_fakes
+import gemini_client
+from gemini_client import GeminiClient
+
+
+@pytest.fixture
+def client(fake_api):
+    c = GeminiClient("fake", fake_api)
+    yield c
+    c.close()
+
+
+def _short(path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()[:6]
+
+
+def test_caption_images_reads_paths_in_order(client, tmp_path):
+    paths = []
+    for i, fmt in enumerate(["PNG", "JPEG", "PNG"]):
+        p = tmp_path / f"img{i}.{fmt.lower()}"
+        Image.new("RGB", (16, 16), (40 * i, 80, 120)).save(p, fmt)
+        paths.append(p)
+    captions = client.caption_images("caption", [str(p) for p in paths])
+    assert captions == [
+        f"A warm png moment shared together ({_short(paths[0])}).",
+        f"A warm jpeg moment shared together ({_short(paths[1])}).",
+        f"A warm png moment shared together ({_short(paths[2])}).",
+    ]
+
+
+def test_large_file_is_streamed_to_the_file_api(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(gemini_client, "GEMINI_INLINE_MAX_BYTES", 1024)
+    monkeypatch.setattr(gemini_client, "GEMINI_FILE_POLL_SECONDS", 0.01)
+    audio = tmp_path / "talk.wav"
+    audio.write_bytes(b"RIFF" + bytes(range(256)) * 40)
+    uploaded = dev_fakes.counters["uploaded"]
+    text = client.generate("transcribe", audio, "audio/wav")
+    assert text == f"Hello, it's so good to see you again ({_short(audio)})."
+    assert dev_fakes.counters["uploaded"] == uploaded + 1
+    assert client.uploaded == 1
+
+
+def test_video_audio_goes_through_a_temp_wav(fake_api, tmp_path, monkeypatch):
+    import av
+    import transcribe
+    monkeypatch.setenv("GEMINI_API_KEY", "fake")
+    monkeypatch.setenv("GEMINI_BASE_URL", fake_api)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    (tmp_path / "tmp").mkdir()
+    clip = tmp_path / "clip.mp4"
+    with av.open(str(clip), "w") as out:
+        stream = out.add_stream("aac", rate=16000, layout="mono")
+        tone = (np.sin(np.arange(16000) / 16000 * 2 * np.pi * 440) * 0.3).astype(np.float32)
+        frame = av.AudioFrame.from_ndarray(tone[None, :], format="flt", layout="mono")
+        frame.sample_rate = 16000
+        for packet in stream.encode(frame):
+            out.mux(packet)
+        for packet in stream.encode(None):
+            out.mux(packet)
+    segments = transcribe._gemini_segments(clip)
+    assert len(segments) == 1 and segments[0]["text"].startswith("Hello, it's so good to see you again")
+    assert list((tmp_path / "tmp").iterdir()) == []
@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobConflict, JobQueue
+
+
+def _queue(tmp_path, **handlers) -> JobQueue:
+    q = JobQueue(tmp_path / "jobs.sqlite3", workers=1)
+    for kind, fn in handlers.items():
+        q.register(kind, fn)
+    return q
+
+
+def _wait(q, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = q.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} still {q.get(job_id)['status']}")
+
+
+def _noop(memory_id, progress, **args):
+    return args
+
+
+def test_same_request_is_deduplicated(tmp_path):
+    q = _queue(tmp_path, process=_noop)
+    a = q.enqueue("process", "m1", force=[])
+    b = q.enqueue("process", "m1", force=[])
+    assert (a["deduplicated"], b["deduplicated"]) == (False, True)
+    assert b["id"] == a["id"]
+    assert q.enqueue("process", "m2", force=[])["id"] != a["id"]
+
+
+def test_force_is_merged_into_a_queued_job(tmp_path):
+    q = _queue(tmp_path, process=_noop)
+    a = q.enqueue("process", "m1", force=[])
+    b = q.enqueue("process", "m1", force=["captions"])
+    c = q.enqueue("process", "m1", force=["index", "captions"])
+    assert b["id"] == c["id"] == a["id"]
+    assert q.get(a["id"])["args"] == {"force": ["captions", "index"]}
+    q.start()
+    try:
+        assert _wait(q, a["id"])["result"] == {"force": ["captions", "index"]}
+    finally:
+        q.stop()
+
+
+def test_running_job_rejects_wider_args(tmp_path):
+    q = _queue(tmp_path, process=_noop)
+    a = q.enqueue("process", "m1", force=["captions"])
+    q._claim()
+    assert q.enqueue("process", "m1", force=[])["id"] == a["id"]  # already covered
+    with pytest.raises(JobConflict):
+        q.enqueue("process", "m1", force=["index"])
+    assert q.get(a["id"])["args"] == {"force": ["captions"]}
+
+
+def test_restart_requeues_jobs_of_a_dead_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0.2)
+    ran = []
+    dead = _queue(tmp_path, process=_noop)
+    job = dead.enqueue("process", "m1", force=[])
+    dead._claim()  # the old process took the job and then died
+    time.sleep(0.3)
+
+    fresh = _queue(tmp_path, process=lambda mid, progress, **a: ran.append(mid) or "ok")
+    fresh.start()
+    try:
+        done = _wait(fresh, job["id"])
+    finally:
+        fresh.stop()
+    assert done["status"] == "done" and done["attempts"] == 2
+    assert done["owner"] == fresh.owner
+    assert ran == ["m1"]
+
+
+def test_heartbeat_keeps_a_live_owner_s_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0.5)
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.05)
+    release = threading.Event()
+    busy = _queue(tmp_path, process=lambda mid, progress, **a: release.wait(10) and "ok")
+    job = busy.enqueue("process", "m1")
+    busy.start()
+    try:
+        other = _queue(tmp_path, process=_noop)
+        time.sleep(1.0)  # well past JOB_STALE_SECONDS, but heartbeats kept coming
+        assert other.requeue_stale() == 0
+        running = busy.get(job["id"])
+        assert running["status"] == "running" and running["owner"] == busy.owner
+        assert running["heartbeat"] > time.time() - 0.5
+        release.set()
+        assert _wait(busy, job["id"])["attempts"] == 1
+    finally:
+        release.set()
+        busy.stop()
+
+
+def test_job_abandoned_too_often_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0)
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    job = _queue(tmp_path, process=_noop).enqueue("process", "m1")
+    for attempt in range(2):
+        crashed = _queue(tmp_path, process=_noop)
+        crashed._claim()
+        time.sleep(0.01)
+        assert _queue(tmp_path, process=_noop).requeue_stale() == 1
+    failed = crashed.get(job["id"])
+    assert failed["status"] == "failed" and "abandoned" in failed["error"]
+
+
+def test_endpoints_queue_by_default(media, tmp_path, monkeypatch):
+    import main
+    from fastapi.testclient import TestClient
+    q = _queue(tmp_path, **main.job_queue.handlers)
+    monkeypatch.setattr(main, "job_queue", q)
+    (media / "memory_x").mkdir()
+    client = TestClient(main.app)
+
+    first = client.post("/process/memory_x").json()
+    assert first["job_status"] == "queued" and first["deduplicated"] is False
+    again = client.post("/process/memory_x?force=captions").json()
+    assert again["job_id"] == first["job_id"] and again["deduplicated"] is True
+    assert q.get(first["job_id"])["args"] == {"force": ["captions"]}
+
+    q._claim()
+    r = client.post("/process/memory_x?force=index")
+    assert r.status_code == 409
+    assert client.post("/narrate/memory_x").json()["status_url"].startswith("/jobs/")
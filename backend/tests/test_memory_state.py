@@ -0,0 +1,93 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import memory_state
+from memory_state import ConflictError
+
+
+def _bump(value):
+    value["n"] += 1
+
+
+def _bump_many(folder, times):
+    for _ in range(times):
+        memory_state.update(folder, "state.json", _bump, default={"n": 0})
+
+
+def test_save_rejects_a_stale_version(tmp_path):
+    _, version = memory_state.load(tmp_path, "state.json", default={})
+    memory_state.save(tmp_path, "state.json", {"a": 1}, expected=version)
+    with pytest.raises(ConflictError):
+        memory_state.save(tmp_path, "state.json", {"a": 2}, expected=version)
+    assert memory_state.read(tmp_path, "state.json") == {"a": 1}
+
+
+def test_update_reruns_fn_on_a_conflict(tmp_path):
+    memory_state.save(tmp_path, "state.json", {"tags": []})
+    calls = []
+
+    def add(value):
+        calls.append(list(value["tags"]))
+        if len(calls) == 1:
+            # another writer gets in between our read and our write
+            memory_state.save(tmp_path, "state.json", {"tags": ["theirs"]})
+        value["tags"].append("ours")
+
+    saved = memory_state.update(tmp_path, "state.json", add)
+    assert calls == [[], ["theirs"]]
+    assert saved == {"tags": ["theirs", "ours"]}
+    assert memory_state.read(tmp_path, "state.json") == saved
+
+
+def test_update_falls_back_to_the_lock_after_retries(tmp_path):
+    memory_state.save(tmp_path, "state.json", {"n": 0})
+    calls = [0]
+
+    def always_raced(value):
+        calls[0] += 1
+        if calls[0] <= 2:
+            memory_state.save(tmp_path, "state.json", {"n": 100 + calls[0]})
+        value["n"] += 1
+
+    assert memory_state.update(tmp_path, "state.json", always_raced, retries=2) == {"n": 103}
+    assert calls[0] == 3
+
+
+def test_writer_waits_for_the_file_lock(tmp_path):
+    done = threading.Event()
+
+    def write():
+        memory_state.save(tmp_path, "state.json", {"from": "thread"})
+        done.set()
+
+    with memory_state.memory_lock(tmp_path):
+        t = threading.Thread(target=write)
+        t.start()
+        time.sleep(0.3)
+        assert not done.is_set()
+    t.join(5)
+    assert done.is_set()
+    assert memory_state.read(tmp_path, "state.json") == {"from": "thread"}
+
+
+def test_concurrent_updates_from_threads(tmp_path):
+    threads = [threading.Thread(target=_bump_many, args=(tmp_path, 25)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert memory_state.read(tmp_path, "state.json") == {"n": 200}
+
+
+def test_concurrent_updates_from_processes(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_bump_many, args=(tmp_path, 25)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    assert memory_state.read(tmp_path, "state.json") == {"n": 100}
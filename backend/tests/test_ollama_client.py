@@ -0,0 +1,46 @@
+import json
+import threading
+
+import pytest
+
+import story
+from ollama_client import OllamaClient, get_ollama_client, ollama_base_url
+
+
+@pytest.fixture
+def client(fake_api):
+    c = OllamaClient(fake_api)
+    c._slots = threading.BoundedSemaphore(1)
+    yield c
+    c.close()
+
+
+def test_slow_reader_does_not_hold_the_slot(client):
+    stream = client.stream_generate("gpt-oss-20b", "People involved: Ravi")
+    first = next(stream)
+    # the consumer is paused mid-stream, yet the single slot frees up
+    assert client._slots.acquire(timeout=5)
+    client._slots.release()
+    story_text = first + "".join(stream)
+    assert "Ravi" in story_text
+
+
+def test_abandoned_stream_frees_the_slot(client):
+    stream = client.stream_generate("gpt-oss-20b", "People involved: Ravi")
+    next(stream)
+    stream.close()
+    assert client._slots.acquire(timeout=5)
+
+
+def test_memory_metadata_picks_the_server(media, fake_api, monkeypatch):
+    monkeypatch.setenv("OLLAMA_BASE_URL", "http://127.0.0.1:9")  # nothing listens here
+    monkeypatch.setenv("STORY_PROVIDER", "ollama")
+    folder = media / "memory_local"
+    folder.mkdir()
+    (folder / "metadata.json").write_text(json.dumps({"ollama_base_url": fake_api}), encoding="utf-8")
+    (folder / "faces.json").write_text(json.dumps([{"crop_file": "f.jpg", "label": "Mom"}]), encoding="utf-8")
+    assert ollama_base_url(folder) == fake_api
+    assert ollama_base_url(media) == "http://127.0.0.1:9"
+    final = story.generate_story(folder)
+    assert final["provider"] == "ollama" and "Mom" in final["done"]
+    assert get_ollama_client(fake_api + "/") is get_ollama_client(fake_api)
@@ -0,0 +1,41 @@
+import json
+
+import passages
+from passages import iter_passages, read_head
+
+
+def _segments(n):
+    return [{"file": "audio.m4a", "start": i * 2.0, "end": i * 2.0 + 1.5,
+             "text": f"Line {i} says \"segments\": [ and {{braces}}."} for i in range(n)]
+
+
+def test_transcript_segments_are_read_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(passages, "READ_CHUNK", 50)
+    segs = _segments(40)
+    (tmp_path / "transcript.json").write_text(json.dumps(
+        {"version": "v", "complete": True, "files": {"segments": "done"}, "segments": segs}, indent=2),
+        encoding="utf-8")
+    got = list(passages._transcript_segments(tmp_path))
+    assert [(s["text"], s["start"]) for s in got] == [(s["text"], s["start"]) for s in segs]
+
+
+def test_transcript_as_a_bare_list(tmp_path, monkeypatch):
+    monkeypatch.setattr(passages, "READ_CHUNK", 32)
+    segs = _segments(5) + [{"text": "   "}]
+    (tmp_path / "transcript.json").write_text(json.dumps(segs), encoding="utf-8")
+    assert len(list(passages._transcript_segments(tmp_path))) == 5
+    assert {p["source"] for p in iter_passages(tmp_path)} == {"transcript"}
+
+
+def test_truncated_transcript_keeps_what_was_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(passages, "READ_CHUNK", 64)
+    raw = json.dumps({"segments": _segments(10)})
+    (tmp_path / "transcript.json").write_text(raw[: len(raw) // 2], encoding="utf-8")
+    got = list(passages._transcript_segments(tmp_path))
+    assert 0 < len(got) < 10
+
+
+def test_read_head(tmp_path):
+    (tmp_path / "t.txt").write_text("abcdef", encoding="utf-8")
+    assert read_head(tmp_path / "t.txt", 4) == "abcd"
+    assert read_head(tmp_path / "missing.txt", 4) == ""
@@ -0,0 +1,23 @@
+import json
+
+from people_index import people_from_faces
+
+
+def test_labels_in_first_seen_order(tmp_path):
+    (tmp_path / "faces.json").write_text(json.dumps([
+        {"label": "Mom"}, {"label": None}, {"label": " mom "}, {"label": "Ravi"}, "junk",
+    ]), encoding="utf-8")
+    assert people_from_faces(tmp_path) == ["Mom", "Ravi"]
+
+
+def test_unreadable_faces_json_is_treated_as_empty(tmp_path):
+    assert people_from_faces(tmp_path) == []
+    (tmp_path / "faces.json").write_text('[{"label": "Mo', encoding="utf-8")  # half-written
+    assert people_from_faces(tmp_path) == []
+    (tmp_path / "faces.json").write_text('{"label": "Mom"}', encoding="utf-8")
+    assert people_from_faces(tmp_path) == []
+
+
+def test_undecodable_faces_json_is_treated_as_empty(tmp_path):
+    (tmp_path / "faces.json").write_bytes(b"\xff\xfe not utf-8")
+    assert people_from_faces(tmp_path) == []
@@ -0,0 +1,20 @@
+import pipeline
+from pipeline import load_state, run_pipeline
+
+
+def test_placeholder_captions_are_retried(media, monkeypatch):
+    folder = media / "memory_p"
+    (folder / "images").mkdir(parents=True)
+    (folder / "images" / "a.jpg").write_bytes(b"\xff\xd8\xff photo")
+    monkeypatch.setattr(pipeline, "STAGES", [s for s in pipeline.STAGES if s.name == "captions"])
+    monkeypatch.setattr(pipeline, "caption_images_cached",
+                        lambda paths, report, url=None: ["(local caption unavailable)"] * len(paths))
+
+    first = run_pipeline(folder)["captions"]
+    assert first["ran"] and "incomplete" in first
+    assert "captions" not in load_state(folder)["stages"]
+    assert run_pipeline(folder)["captions"]["ran"]  # not skipped: the model may be back
+
+    monkeypatch.setattr(pipeline, "caption_images_cached", lambda paths, report, url=None: ["a photo"] * len(paths))
+    assert "incomplete" not in run_pipeline(folder)["captions"]
+    assert run_pipeline(folder)["captions"] == {"ran": False}
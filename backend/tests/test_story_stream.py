@@ -0,0 +1,63 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(media, fake_api, monkeypatch):
+    import main
+    monkeypatch.setenv("GEMINI_BASE_URL", fake_api)
+    monkeypatch.setenv("GEMINI_API_KEY", "fake")
+    monkeypatch.setenv("STORY_PROVIDER", "gemini")
+    folder = media / "memory_story"
+    folder.mkdir()
+    (folder / "captions.json").write_text(json.dumps(["a birthday cake on the table"]), encoding="utf-8")
+    (folder / "faces.json").write_text(json.dumps([{"crop_file": "face_01.jpg", "label": "Ravi"}]),
+                                       encoding="utf-8")
+    return TestClient(main.app)
+
+
+def _events(client, url):
+    events = []
+    with client.stream("GET", url) as r:
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("text/event-stream")
+        event = None
+        for line in r.iter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[6:])))
+    return events
+
+
+def test_stream_tokens_then_done(client, media):
+    events = _events(client, "/generate_story/memory_story/stream")
+    tokens = [d["text"] for e, d in events if e == "token"]
+    assert len(tokens) > 1  # streamed word by word, not in one piece
+    kind, done = events[-1]
+    assert kind == "done"
+    assert done["cached"] is False
+    assert done["story"] == "".join(tokens).strip()
+    assert "Ravi" in done["story"]
+    assert (media / "memory_story" / "story.txt").read_text(encoding="utf-8") == done["story"]
+
+
+def test_stream_serves_cached_story(client):
+    first = _events(client, "/generate_story/memory_story/stream")[-1][1]
+    events = _events(client, "/generate_story/memory_story/stream")
+    assert [e for e, _ in events] == ["token", "done"]
+    assert events[-1][1]["cached"] is True
+    assert events[-1][1]["story"] == first["story"]
+
+
+def test_explicit_gemini_without_key_is_an_error(client, monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY")
+    r = client.get("/generate_story/memory_story/stream")
+    assert r.status_code == 503
+    assert "GEMINI_API_KEY" in r.json()["detail"]
+
+
+def test_unknown_memory_is_404(client):
+    assert client.get("/generate_story/memory_missing/stream").status_code == 404
@@ -0,0 +1,44 @@
+import json
+import threading
+
+import transcribe
+
+
+def test_transcribe_memory_writes_state_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcribe, "TRANSCRIPT_FLUSH_SECONDS", 0)
+    media = [tmp_path / "a.m4a", tmp_path / "b.mp4"]
+
+    def fake(path, on_segment):
+        for i in range(3):
+            on_segment({"start": float(i), "end": i + 0.5, "text": f"{path.stem}{i}"})
+
+    monkeypatch.setattr(transcribe, "transcribe_file", fake)
+    out = transcribe.transcribe_memory(tmp_path, media)
+    data = json.loads((tmp_path / "transcript.json").read_text(encoding="utf-8"))
+    assert data["complete"] and data["files"] == {"a.m4a": "done", "b.mp4": "done"}
+    assert [s["text"] for s in data["segments"]] == ["a0", "a1", "a2", "b0", "b1", "b2"]
+    assert (tmp_path / "transcript.txt").read_text(encoding="utf-8") == "a0 a1 a2\nb0 b1 b2"
+    assert out["segments"] == 6
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+
+def test_concurrent_writers_share_the_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcribe, "TRANSCRIPT_FLUSH_SECONDS", 0)
+    errors = []
+
+    def writer(tag):
+        try:
+            w = transcribe.TranscriptWriter(tmp_path, ["a.m4a"])
+            for i in range(50):
+                w.add("a.m4a", {"start": i, "end": i, "text": f"{tag}{i}"})
+            w.set_status("a.m4a", "done")
+        except Exception as e:  # a clobbered temp file surfaces as FileNotFoundError
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(t,)) for t in "xyz"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(json.loads((tmp_path / "transcript.json").read_text(encoding="utf-8"))["segments"]) == 50
@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import memory_state
+
+
+@pytest.fixture
+def client(media, monkeypatch):
+    import main
+    enqueued = []
+    monkeypatch.setattr(main.job_queue, "enqueue", lambda kind, mid, *a, **k: enqueued.append((kind, mid)))
+    c = TestClient(main.app)
+    c.enqueued = enqueued
+    return c
+
+
+def _off_loop(fn):
+    def wrapper(*args, **kwargs):
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()  # only an event-loop thread has one
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def test_upload_stores_files_off_the_event_loop(client, media, monkeypatch):
+    import main
+    monkeypatch.setattr(main.blobs, "adopt", _off_loop(main.blobs.adopt))
+    monkeypatch.setattr(memory_state, "save", _off_loop(memory_state.save))
+    r = client.post("/upload", files=[
+        ("photos", ("a.jpg", b"\xff\xd8\xff same bytes", "image/jpeg")),
+        ("photos", ("b.jpg", b"\xff\xd8\xff same bytes", "image/jpeg")),
+    ], data={"story": "  A day at the beach.  "})
+    assert r.status_code == 200, r.text
+    mem_id = r.json()["memory_id"]
+    folder = media / mem_id
+    meta = json.loads((folder / "metadata.json").read_text(encoding="utf-8"))
+    assert meta["files"] == ["images/a.jpg", "images/b.jpg"]
+    assert [meta["file_info"][f]["deduplicated"] for f in meta["files"]] == [False, True]
+    assert (folder / "story.txt").read_text(encoding="utf-8") == "A day at the beach."
+    assert client.enqueued == [("thumbnails", mem_id)]
+    assert [m["id"] for m in client.get("/memories").json()["memories"]] == [mem_id]
+
+
+def test_failed_store_removes_the_memory(client, media, monkeypatch):
+    import main
+
+    def broken(*a, **k):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(main.blobs, "adopt", broken)
+    with pytest.raises(OSError):
+        client.post("/upload", files=[("photos", ("a.jpg", b"\xff\xd8\xff", "image/jpeg"))])
+    assert list(media.iterdir()) == []
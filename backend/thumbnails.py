@@ -0,0 +1,162 @@
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import memory_state
+from blobstore import DATA_ROOT, derived, file_hash
+from preprocess import image_assets, max_side, variant
+
+THUMB_ROOT = DATA_ROOT / "thumbs"
+THUMB_SIZES = tuple(int(x) for x in os.getenv("THUMB_SIZES", "160,320,640").split(","))
+THUMB_FORMATS = ("webp", "jpg")
+# what list views use: the configured size closest to 320 (the larger on a tie)
+DEFAULT_THUMB_SIZE = min(THUMB_SIZES, key=lambda s: (abs(s - 320), -s))
+THUMBS_FILE = "thumbnails.json"
+THUMB_VERSION = f"thumbs:{','.join(map(str, THUMB_SIZES))}:{','.join(THUMB_FORMATS)}"
+
+VIDEO_EXTS = {".mp4", ".mov", ".mkv"}
+
+# thumbnails of one source are rendered once at a time, under a fixed set of striped locks
+THUMB_LOCK_STRIPES = 64
+
+_locks = [threading.Lock() for _ in range(THUMB_LOCK_STRIPES)]
+
+
+def _lock_for(key: str) -> threading.Lock:
+    return _locks[int(key[:8], 16) % len(_locks)]
+
+
+def _dir(sha256: str) -> Path:
+    return THUMB_ROOT / sha256[:2] / sha256
+
+
+def _url(sha256: str, size: int, fmt: str) -> str:
+    return f"/thumbs/{sha256[:2]}/{sha256}/{size}.{fmt}"
+
+
+def urls_for(sha256: str) -> Dict[str, Dict[str, str]]:
+    return {str(s): {fmt: _url(sha256, s, fmt) for fmt in THUMB_FORMATS} for s in THUMB_SIZES}
+
+
+def _render(src: Path, out_dir: Path):
+    """Decode once (EXIF-rotated), then step down from the largest size to the smallest."""
+    from PIL import Image, ImageOps
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if max(THUMB_SIZES) <= max_side("upload"):
+        src = variant(src, "upload")  # already decoded and rotated once by preprocess
+    with Image.open(src) as im:
+        im.draft("RGB", (max(THUMB_SIZES) * 2, max(THUMB_SIZES) * 2))  # cheap JPEG pre-scale
+        img = ImageOps.exif_transpose(im).convert("RGB")
+    for size in sorted(THUMB_SIZES, reverse=True):
+        img.thumbnail((size, size), Image.LANCZOS)
+        for fmt in THUMB_FORMATS:
+            tmp = out_dir / f".{size}.{fmt}.tmp"
+            if fmt == "webp":
+                img.save(tmp, "WEBP", quality=80, method=4)
+            else:
+                img.save(tmp, "JPEG", quality=82, optimize=True, progressive=True)
+            os.replace(tmp, out_dir / f"{size}.{fmt}")
+
+
+def _complete(out_dir: Path) -> bool:
+    return all((out_dir / f"{s}.{f}").exists() for s in THUMB_SIZES for f in THUMB_FORMATS)
+
+
+def ensure_image_thumbs(src) -> Dict[str, Dict[str, str]]:
+    """Thumbnails for an image, generated on first request and cached by content hash."""
+    h = file_hash(src)
+    out_dir = _dir(h)
+    if not _complete(out_dir):
+        with _lock_for(h):
+            if not _complete(out_dir):
+                _render(Path(src), out_dir)
+    return urls_for(h)
+
+
+def poster_frame(video_path) -> Optional[Path]:
+    """A representative still for a video, cached by the video's content hash."""
+    h = file_hash(video_path)
+    art = derived.artefact_dir("poster", h, THUMB_VERSION)
+    poster = art / "poster.jpg"
+    if poster.exists():
+        return poster
+    import cv2
+    cap = cv2.VideoCapture(str(video_path))
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25
+        frame = None
+        # ~1s in skips black lead-in frames; fall back to whatever decodes
+        for i in range(int(fps) + 1):
+            ok, f = cap.read()
+            if not ok:
+                break
+            frame = f
+    finally:
+        cap.release()
+    if frame is None:
+        return None
+    tmp = art / ".poster.jpg.tmp"
+    cv2.imwrite(str(tmp), frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    os.replace(tmp, poster)
+    return poster
+
+
+def ensure_video_thumbs(video_path) -> Optional[Dict[str, Dict[str, str]]]:
+    poster = poster_frame(video_path)
+    return ensure_image_thumbs(poster) if poster else None
+
+
+def _assets(folder: Path):
+    images = image_assets(folder)
+    videos = sorted(p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in VIDEO_EXTS)
+    return images, videos
+
+
+def cover_source(folder: Path) -> Optional[Path]:
+    images, videos = _assets(folder)
+    if images:
+        return images[0]
+    return videos[0] if videos else None
+
+
+def thumbs_for(path: Path) -> Optional[Dict[str, Dict[str, str]]]:
+    if path.suffix.lower() in VIDEO_EXTS:
+        return ensure_video_thumbs(path)
+    return ensure_image_thumbs(path)
+
+
+def build_memory_thumbnails(folder: Path) -> Dict:
+    """Thumbnails for every image and a poster for every video; writes thumbnails.json."""
+    images, videos = _assets(folder)
+    out = {"version": THUMB_VERSION, "assets": {}, "cover": None}
+    for p in images + videos:
+        try:
+            t = thumbs_for(p)
+        except Exception as e:
+            print(f"[thumbs] {p}: {e}")
+            continue
+        if t:
+            out["assets"][p.relative_to(folder).as_posix()] = t
+    cover = cover_source(folder)
+    if cover is not None:
+        out["cover"] = out["assets"].get(cover.relative_to(folder).as_posix())
+    memory_state.save(folder, THUMBS_FILE, out)
+    return out
+
+
+def load_memory_thumbnails(folder: Path) -> Optional[Dict]:
+    f = folder / THUMBS_FILE
+    if not f.exists():
+        return None
+    try:
+        data = json.loads(f.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    return data if data.get("version") == THUMB_VERSION else None
+
+
+def memory_asset_files(folder: Path) -> List[Path]:
+    images, videos = _assets(folder)
+    return images + videos
@@ -0,0 +1,243 @@
+import os
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Tuple
+
+import memory_state
+from blobstore import derived, file_hash
+from model_registry import registry
+from providers import (
+    PROVIDER, TRANSCRIBE_CHUNK_SECONDS, TRANSCRIBE_OVERLAP_SECONDS, TRANSCRIBE_PARALLEL, WHISPER_BEAM_SIZE,
+    gemini_transcribe_audio, transcript_version,
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+
+SAMPLE_RATE = 16000
+# transcript.json is rewritten at most this often while segments arrive
+TRANSCRIPT_FLUSH_SECONDS = float(os.getenv("TRANSCRIPT_FLUSH_SECONDS", "2"))
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "500"))
+
+TRANSCRIPT_JSON = "transcript.json"
+TRANSCRIPT_TXT = "transcript.txt"
+
+
+def decode_audio_chunks(path, chunk_seconds: int = TRANSCRIBE_CHUNK_SECONDS,
+                        overlap_seconds: int = TRANSCRIBE_OVERLAP_SECONDS
+                        ) -> Iterator[Tuple[float, "np.ndarray", bool]]:
+    """
+    (offset_seconds, float32 mono 16 kHz samples, is_last) chunks of the
+    first audio stream in an audio file or video container. Chunks start
+    chunk_seconds apart and each runs overlap_seconds into the next. Nothing
+    is yielded when the container has no audio.
+    """
+    import av
+    import numpy as np
+
+    step = chunk_seconds * SAMPLE_RATE
+    chunk_samples = step + overlap_seconds * SAMPLE_RATE
+    with av.open(str(path)) as container:
+        stream = next((s for s in container.streams if s.type == "audio"), None)
+        if stream is None:
+            return
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+        buf: List["np.ndarray"] = []
+        buffered = 0
+        emitted = 0
+
+        def frames():
+            for frame in container.decode(stream):
+                yield from resampler.resample(frame)
+            yield from resampler.resample(None)  # flush
+
+        for f in frames():
+            a = f.to_ndarray().reshape(-1)
+            buf.append(a)
+            buffered += a.shape[0]
+            # a chunk goes out once its overlap has arrived too, so the last one is known
+            if buffered > chunk_samples:
+                data = np.concatenate(buf)
+                yield emitted / SAMPLE_RATE, data[:chunk_samples].astype(np.float32) / 32768.0, False
+                emitted += step
+                buf, buffered = [data[step:]], data.shape[0] - step
+        if buffered:
+            yield emitted / SAMPLE_RATE, np.concatenate(buf).astype(np.float32) / 32768.0, True
+
+
+def _segment(s, offset: float) -> Dict:
+    return {"start": round(offset + s.start, 2), "end": round(offset + s.end, 2), "text": s.text.strip()}
+
+
+def whisper_segments(path, on_segment: Callable[[Dict], None] = lambda s: None) -> List[Dict]:
+    """
+    Transcribe one file chunk by chunk with faster-whisper (int8, VAD). The
+    detected language and the previous chunk's last sentence carry over, so
+    chunks read as one transcript. on_segment sees each segment as decoded.
+
+    Chunks overlap: a segment starting in a chunk's overlap tail is left to
+    the next chunk, which hears it whole, and the next chunk skips what the
+    previous one already covered (segments centred before its last end).
+    """
+    segments: List[Dict] = []
+    language = None
+    covered = 0.0
+    with registry.use("whisper") as model:
+        for offset, audio, last in decode_audio_chunks(path):
+            handoff = offset + TRANSCRIBE_CHUNK_SECONDS
+            prompt = segments[-1]["text"] if segments else None
+            seg_iter, info = model.transcribe(
+                audio, language=language, beam_size=WHISPER_BEAM_SIZE, initial_prompt=prompt,
+                vad_filter=True, vad_parameters={"min_silence_duration_ms": VAD_MIN_SILENCE_MS},
+            )
+            language = language or info.language
+            for s in seg_iter:
+                if not (s.text and s.text.strip()):
+                    continue
+                seg = _segment(s, offset)
+                if not last and seg["start"] >= handoff:
+                    break  # the next chunk starts here
+                if (seg["start"] + seg["end"]) / 2 < covered:
+                    continue
+                segments.append(seg)
+                on_segment(seg)
+            if segments:
+                covered = segments[-1]["end"]
+    return segments
+
+
+def _write_wav(path, dest: str) -> bool:
+    """
+    Audio track as 16 kHz mono WAV, written chunk by chunk to `dest`, for
+    providers that take a single upload. False when there is no audio.
+    """
+    import wave
+    import numpy as np
+    n = 0
+    with wave.open(dest, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        for _, audio, _ in decode_audio_chunks(path, overlap_seconds=0):
+            w.writeframes((audio * 32767).astype(np.int16).tobytes())
+            n += audio.shape[0]
+    return n > 0
+
+
+def _gemini_segments(path) -> List[Dict]:
+    from processing import _audio_mime
+    suffix = Path(path).suffix.lower()
+    if suffix in (".mp3", ".m4a", ".wav"):
+        text = gemini_transcribe_audio(Path(path), mime=_audio_mime(str(path)))
+    else:
+        fd, tmp = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            text = gemini_transcribe_audio(Path(tmp), mime="audio/wav") if _write_wav(path, tmp) else ""
+        finally:
+            os.unlink(tmp)
+    return [{"text": text}] if text else []
+
+
+def transcribe_file(path, on_segment: Callable[[Dict], None] = lambda s: None) -> List[Dict]:
+    """Segments for one file, cached by content hash and transcription version."""
+    h = file_hash(path)
+    version = transcript_version()
+    cached = derived.get("transcript_segments", h, version)
+    if cached is not None:
+        for seg in cached:
+            on_segment(seg)
+        return cached
+    if PROVIDER.lower() == "gemini":
+        segments = _gemini_segments(path)
+        for seg in segments:
+            on_segment(seg)
+    else:
+        segments = whisper_segments(path, on_segment)
+    derived.put("transcript_segments", h, version, segments)
+    return segments
+
+
+class TranscriptWriter:
+    """
+    Accumulates segments from concurrent transcriptions and keeps
+    transcript.json current (atomic replace, throttled), so readers can
+    follow a long transcription while it runs.
+    """
+
+    def __init__(self, folder: Path, files: List[str]):
+        self.folder = Path(folder)
+        self.files = files
+        self.segments: Dict[str, List[Dict]] = {f: [] for f in files}
+        self.status: Dict[str, str] = {f: "pending" for f in files}
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def add(self, file: str, seg: Dict):
+        with self._lock:
+            self.segments[file].append({"file": file, **seg})
+            if time.monotonic() - self._last_write >= TRANSCRIPT_FLUSH_SECONDS:
+                self._write()
+
+    def set_status(self, file: str, status: str):
+        with self._lock:
+            self.status[file] = status
+            self._write()
+
+    def _write(self):
+        data = {
+            "version": transcript_version(),
+            "complete": all(s in ("done", "failed") for s in self.status.values()),
+            "files": self.status,
+            "segments": [seg for f in self.files for seg in self.segments[f]],
+        }
+        # under the memory lock, with a writer-unique temp file
+        memory_state.save(self.folder, TRANSCRIPT_JSON, data)
+        self._last_write = time.monotonic()
+
+    def text(self) -> str:
+        with self._lock:
+            return "\n".join(" ".join(s["text"] for s in self.segments[f]) for f in self.files
+                             if self.segments[f])
+
+
+def transcribe_memory(folder: Path, media: List[Path], progress=None) -> Dict:
+    """
+    Transcribe every audio file and video audio track of a memory,
+    TRANSCRIBE_PARALLEL files at a time. Writes transcript.json (segments
+    with file/start/end) incrementally and transcript.txt at the end.
+    """
+    progress = progress or (lambda *a, **k: None)
+    folder = Path(folder)
+    names = [p.relative_to(folder).as_posix() for p in media]
+    writer = TranscriptWriter(folder, names)
+    finished = [0]
+    count_lock = threading.Lock()
+
+    def run(path: Path, name: str):
+        writer.set_status(name, "running")
+        try:
+            transcribe_file(path, lambda seg: writer.add(name, seg))
+            writer.set_status(name, "done")
+        except Exception as e:
+            print(f"[transcribe] {name}: {e}")
+            writer.set_status(name, "failed")
+        with count_lock:
+            finished[0] += 1
+            progress("transcript", done=finished[0], total=len(media))
+
+    progress("transcript", total=len(media))
+    with ThreadPoolExecutor(max_workers=max(1, min(TRANSCRIBE_PARALLEL, len(media)))) as pool:
+        list(pool.map(run, media, names))
+
+    text = writer.text()
+    memory_state.save_text(folder, TRANSCRIPT_TXT, text)
+    failed = [n for n, s in writer.status.items() if s == "failed"]
+    if failed and len(failed) == len(names):
+        raise RuntimeError(f"transcription failed for {', '.join(failed)}")
+    return {"transcript_chars": len(text),
+            "segments": sum(len(v) for v in writer.segments.values()),
+            "failed": failed}
@@ -0,0 +1,379 @@
+import io
+import os
+import re
+import sys
+import wave
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from blobstore import derived, link_file
+
+# auto | sapi5 | pyttsx3 | espeak | null  (null = silence; only when asked for)
+TTS_BACKEND = os.getenv("TTS_BACKEND", "auto").lower()
+# narration file format: m4a (AAC; plays everywhere incl. iOS) | wav | opus (smallest, no iOS)
+TTS_FORMAT = os.getenv("TTS_FORMAT", "m4a").lower()
+TTS_AAC_BITRATE = int(os.getenv("TTS_AAC_BITRATE", "48000"))
+TTS_VOICE = os.getenv("TTS_VOICE", "")
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "2"))
+TTS_OPUS_BITRATE = int(os.getenv("TTS_OPUS_BITRATE", "32000"))
+TTS_VERSION = "tts:1"
+
+NARRATION_FORMATS = ("m4a", "wav", "opus")
+
+
+class TTSUnavailable(RuntimeError):
+    """No usable speech engine on this host."""
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_END.split(text or "") if s.strip()]
+
+
+def _read_wav(data: bytes) -> Tuple[bytes, int]:
+    """(mono int16 PCM, sample rate) from WAV bytes."""
+    import numpy as np
+    with wave.open(io.BytesIO(data)) as w:
+        rate, channels, width = w.getframerate(), w.getnchannels(), w.getsampwidth()
+        frames = w.readframes(w.getnframes())
+    if width != 2:
+        raise ValueError(f"expected 16-bit WAV, got {8 * width}-bit")
+    if channels > 1:
+        pcm = np.frombuffer(frames, dtype=np.int16).reshape(-1, channels).mean(axis=1).astype(np.int16)
+        frames = pcm.tobytes()
+    return frames, rate
+
+
+def _wav_bytes(pcm: bytes, rate: int) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm)
+    return out.getvalue()
+
+
+# ----- backends -----
+class TTSBackend:
+    """Renders one piece of text to mono 16-bit PCM."""
+
+    name = "base"
+    workers = TTS_WORKERS  # how many renders may run at once
+
+    def synthesize(self, text: str, voice: str, rate: int, volume: float) -> Tuple[bytes, int]:
+        raise NotImplementedError
+
+    def voice_name(self, voice: str) -> str:
+        return voice or "default"
+
+
+class Pyttsx3Backend(TTSBackend):
+    """pyttsx3 (SAPI5 on Windows, NSSpeech on macOS). One engine, one thread."""
+
+    workers = 1
+    PREFERRED_VOICE_KEYWORDS = ["Heera", "Zira", "Hazel", "Sona"]
+
+    def __init__(self, driver: Optional[str] = None):
+        self.driver = driver
+        self.name = f"pyttsx3:{driver or 'default'}"
+        self._engine = None
+        self._voice_name = None
+
+    def _init(self, voice: str):
+        import pyttsx3
+        if self._engine is None:
+            self._engine = pyttsx3.init(driverName=self.driver)
+        voices = self._engine.getProperty("voices")
+        keywords = [voice] if voice else self.PREFERRED_VOICE_KEYWORDS + ["female"]
+        for kw in keywords:
+            for v in voices:
+                if kw.lower() in (v.name or "").lower():
+                    self._engine.setProperty("voice", v.id)
+                    self._voice_name = v.name
+                    return
+        self._voice_name = voices[0].name if voices else "default"
+
+    def voice_name(self, voice: str) -> str:
+        return self._voice_name or voice or "default"
+
+    def synthesize(self, text, voice, rate, volume):
+        self._init(voice)
+        self._engine.setProperty("rate", rate)
+        self._engine.setProperty("volume", volume)
+        fd, tmp = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            self._engine.save_to_file(text, tmp)
+            self._engine.runAndWait()
+            return _read_wav(Path(tmp).read_bytes())
+        finally:
+            os.unlink(tmp)
+
+
+class EspeakBackend(TTSBackend):
+    """espeak-ng / espeak CLI: offline, Linux-friendly, safe to run in parallel."""
+
+    def __init__(self, binary: str):
+        self.binary = binary
+        self.name = f"espeak:{Path(binary).name}"
+
+    def voice_name(self, voice: str) -> str:
+        return voice or "en+f3"
+
+    def synthesize(self, text, voice, rate, volume):
+        cmd = [self.binary, "--stdout", "-v", self.voice_name(voice), "-s", str(rate),
+               "-a", str(max(0, min(200, int(volume * 100)))), text]
+        out = subprocess.run(cmd, capture_output=True, timeout=60, check=True).stdout
+        return _read_wav(out)
+
+
+class NullBackend(TTSBackend):
+    """Silence sized to the text; for tests and machines without a voice."""
+
+    name = "null"
+    RATE = 16000
+
+    def synthesize(self, text, voice, rate, volume):
+        seconds = max(0.3, len(text.split()) * 60.0 / max(rate, 1))
+        return b"\x00\x00" * int(seconds * self.RATE), self.RATE
+
+
+def _pick_backend(name: str = TTS_BACKEND) -> TTSBackend:
+    espeak = shutil.which("espeak-ng") or shutil.which("espeak")
+    if name == "auto":
+        if sys.platform == "win32":
+            name = "sapi5"
+        elif espeak:
+            name = "espeak"
+        else:
+            # never fall back to silence: it would be cached and served as the narration
+            raise TTSUnavailable("no speech engine found; install espeak-ng or set TTS_BACKEND")
+    if name == "sapi5":
+        return Pyttsx3Backend("sapi5")
+    if name == "pyttsx3":
+        return Pyttsx3Backend()
+    if name == "espeak":
+        if not espeak:
+            raise TTSUnavailable("TTS_BACKEND=espeak but neither espeak-ng nor espeak is installed")
+        return EspeakBackend(espeak)
+    if name == "null":
+        return NullBackend()
+    raise ValueError(f"unknown TTS_BACKEND '{name}'")
+
+
+_backend: Dict[str, TTSBackend] = {}
+_pool: Dict[str, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+def get_backend() -> TTSBackend:
+    with _lock:
+        if "b" not in _backend:
+            _backend["b"] = _pick_backend()
+            _pool["p"] = ThreadPoolExecutor(max_workers=max(1, _backend["b"].workers), thread_name_prefix="tts")
+        return _backend["b"]
+
+
+def _executor() -> ThreadPoolExecutor:
+    get_backend()
+    return _pool["p"]
+
+
+def shutdown():
+    with _lock:
+        if "p" in _pool:
+            _pool.pop("p").shutdown(wait=False)
+        _backend.clear()
+
+
+# ----- synthesis with caching -----
+def _key(*parts) -> str:
+    return hashlib.sha256("\n".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def _sentence_pcm(backend: TTSBackend, text: str, voice: str, rate: int, volume: float) -> Tuple[bytes, int]:
+    """PCM for one sentence, cached by (backend, voice, rate, volume, text)."""
+    key = _key(backend.name, voice, rate, volume, text)
+    art = derived.artefact_dir("tts_sentence", key, TTS_VERSION)
+    f = art / "sentence.wav"
+    if f.exists():
+        return _read_wav(f.read_bytes())
+    pcm, sr = backend.synthesize(text, voice, rate, volume)
+    tmp = art / f".sentence.wav.{threading.get_ident()}.tmp"
+    tmp.write_bytes(_wav_bytes(pcm, sr))
+    os.replace(tmp, f)
+    return pcm, sr
+
+
+class _Sink(io.RawIOBase):
+    """Write target for the muxer; hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        out, self._chunks = b"".join(self._chunks), []
+        return out
+
+
+def _encode(pcm_chunks: Iterator[Tuple[bytes, int]], target, container: str, codec: str,
+            rate: int, bit_rate: int) -> Iterator[bytes]:
+    """
+    Encode PCM chunks into one audio file. `target` is a path, or a _Sink
+    whose bytes are yielded as each chunk's packets are muxed.
+    """
+    import av
+    import numpy as np
+    out = av.open(target, "w", format=container)
+    stream = out.add_stream(codec, rate=rate, layout="mono")
+    stream.bit_rate = bit_rate
+    sink = target if isinstance(target, _Sink) else None
+    for pcm, sr in pcm_chunks:
+        frame = av.AudioFrame.from_ndarray(np.frombuffer(pcm, dtype=np.int16).reshape(1, -1),
+                                           format="s16", layout="mono")
+        frame.sample_rate = sr
+        for packet in stream.encode(frame):
+            out.mux(packet)
+        data = sink.drain() if sink else b""
+        if data:
+            yield data
+    for packet in stream.encode(None):
+        out.mux(packet)
+    out.close()
+    data = sink.drain() if sink else b""
+    if data:
+        yield data
+
+
+def _opus_stream(pcm_chunks: Iterator[Tuple[bytes, int]]) -> Iterator[bytes]:
+    """Encode PCM chunks into one Ogg/Opus stream, yielding bytes as pages complete."""
+    return _encode(pcm_chunks, _Sink(), "ogg", "libopus", 48000, TTS_OPUS_BITRATE)
+
+
+def opus_available() -> bool:
+    try:
+        import av
+        return "libopus" in av.codecs_available
+    except Exception:
+        return False
+
+
+def narration_key(text: str, voice: str, rate: int, volume: float) -> str:
+    return _key(get_backend().name, voice, rate, volume, text)
+
+
+def stream_narration(text: str, voice: str = TTS_VOICE, rate: int = 160, volume: float = 0.95,
+                     out_path: Optional[Path] = None) -> Iterator[bytes]:
+    """
+    Ogg/Opus bytes, produced sentence by sentence: sentences render in the
+    TTS worker pool (ahead of the encoder), and each one's audio is yielded
+    as soon as it's encoded. The complete file is cached by
+    (backend, text, voice, rate, volume) and, with out_path, linked there.
+    """
+    backend = get_backend()
+    key = narration_key(text, voice, rate, volume)
+    art = derived.artefact_dir("tts", key, TTS_VERSION)
+    cached = art / "narration.opus"
+    if cached.exists():
+        if out_path is not None:
+            _publish(cached, out_path)
+        with open(cached, "rb") as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    return
+                yield chunk
+
+    pool = _executor()
+    futures = [pool.submit(_sentence_pcm, backend, s, voice, rate, volume) for s in split_sentences(text)]
+    tmp = art / f".narration.opus.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in _opus_stream(fut.result() for fut in futures):
+                f.write(chunk)
+                yield chunk
+    except BaseException:
+        for fut in futures:
+            fut.cancel()
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, cached)
+    if out_path is not None:
+        _publish(cached, out_path)
+
+
+def _publish(src: Path, dest: Path):
+    link_file(src, dest)
+
+
+def aac_available() -> bool:
+    try:
+        import av
+        return "aac" in av.codecs_available
+    except Exception:
+        return False
+
+
+def narration_format(fmt: Optional[str] = None) -> str:
+    """The requested format (TTS_FORMAT by default), stepping down to what this host can encode."""
+    fmt = (fmt or TTS_FORMAT).lower()
+    if fmt not in NARRATION_FORMATS:
+        raise ValueError(f"TTS format must be one of {', '.join(NARRATION_FORMATS)}")
+    if fmt == "opus" and not opus_available():
+        fmt = "m4a"
+    if fmt == "m4a" and not aac_available():
+        fmt = "wav"
+    return fmt
+
+
+def narration_files(tts_dir: Path) -> List[Path]:
+    """Candidate narration files in serving order; Opus only when it was asked for."""
+    order = [TTS_FORMAT] + [f for f in ("m4a", "wav") if f != TTS_FORMAT]
+    return [Path(tts_dir) / f"story.{f}" for f in order if f in NARRATION_FORMATS]
+
+
+def synthesize_to_file(text: str, out_dir: Path, voice: str = TTS_VOICE, rate: int = 160,
+                       volume: float = 0.95, fmt: Optional[str] = None) -> Dict:
+    """
+    Render the whole narration into out_dir as story.<fmt> (see
+    narration_format). The file is cached like the streamed narration.
+    """
+    backend = get_backend()
+    fmt = narration_format(fmt)
+    path = Path(out_dir) / f"story.{fmt}"
+    if fmt == "opus":
+        for _ in stream_narration(text, voice, rate, volume, out_path=path):
+            pass
+    else:
+        art = derived.artefact_dir("tts", narration_key(text, voice, rate, volume), TTS_VERSION)
+        cached = art / f"narration.{fmt}"
+        if not cached.exists():
+            pool = _executor()
+            parts = list(pool.map(lambda s: _sentence_pcm(backend, s, voice, rate, volume), split_sentences(text)))
+            sr = parts[0][1] if parts else NullBackend.RATE
+            tmp = art / f".narration.{fmt}.{threading.get_ident()}.tmp"
+            if fmt == "wav":
+                tmp.write_bytes(_wav_bytes(b"".join(p for p, _ in parts), sr))
+            else:
+                for _ in _encode(iter(parts), str(tmp), "ipod", "aac", sr, TTS_AAC_BITRATE):
+                    pass
+            os.replace(tmp, cached)
+        _publish(cached, path)
+    return {"voice": backend.voice_name(voice), "backend": backend.name, "rate": rate,
+            "volume": volume, "format": fmt, "path": str(path)}
@@ -0,0 +1,170 @@
+import os
+import uuid
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_MB", "4096")) * 1024 * 1024
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_MB", "8192")) * 1024 * 1024
+# plain (non-file) form fields are held in memory
+MAX_FORM_FIELD_BYTES = int(os.getenv("MAX_FORM_FIELD_KB", "1024")) * 1024
+
+
+class UploadBudget:
+    """Tracks bytes received across all files of one request."""
+
+    def __init__(self, max_request_bytes: int = MAX_UPLOAD_REQUEST_BYTES,
+                 max_file_bytes: int = MAX_UPLOAD_FILE_BYTES):
+        self.max_request_bytes = max_request_bytes
+        self.max_file_bytes = max_file_bytes
+        self.received = 0
+
+    def check_content_length(self, content_length):
+        # cheap early reject before reading a byte of the body
+        if not content_length:
+            return
+        try:
+            n = int(content_length)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="malformed Content-Length")
+        if n > self.max_request_bytes:
+            raise HTTPException(status_code=413, detail="upload exceeds request size limit")
+
+    def consume(self, n: int):
+        # raw body bytes, so a client that omits Content-Length is still capped
+        self.received += n
+        if self.received > self.max_request_bytes:
+            raise HTTPException(status_code=413, detail="upload exceeds request size limit")
+
+    def check_file(self, file_size: int):
+        if file_size > self.max_file_bytes:
+            raise HTTPException(status_code=413, detail="file exceeds per-file size limit")
+
+
+class _FileSink:
+    """One file part being written: temp file, running hash, atomic rename at the end."""
+
+    def __init__(self, dest: Path):
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        self.dest = dest
+        self.tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex[:8]}.part")
+        self.f = open(self.tmp, "wb")
+        self.h = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.h.update(chunk)
+        self.f.write(chunk)
+
+    def finish(self) -> Dict:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.tmp, self.dest)
+        return {"sha256": self.h.hexdigest(), "size": self.size}
+
+    def discard(self):
+        try:
+            self.f.close()
+        finally:
+            self.tmp.unlink(missing_ok=True)
+
+
+async def receive_multipart(request: Request, budget: UploadBudget,
+                            file_dest: Callable[[str, str], Optional[Path]]
+                            ) -> Tuple[List[Tuple[str, Path, Dict]], Dict[str, str]]:
+    """
+    Parse a multipart/form-data body straight off the socket. File parts are
+    streamed to `file_dest(field, filename)` (None skips the part) while the
+    request and per-file budgets are enforced on the bytes as they arrive,
+    so nothing is spooled first. File I/O runs in the threadpool.
+    Returns ([(field, dest, {"sha256", "size"})], {field: text}).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="expected multipart/form-data with a boundary")
+
+    # parser callbacks only record events; they are acted on between chunks
+    events: List[Tuple[str, bytes]] = []
+    header_field, header_value = bytearray(), bytearray()
+
+    def on_header_field(data, start, end):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        events.append(("header", bytes(header_field).lower() + b"\0" + bytes(header_value)))
+        header_field.clear()
+        header_value.clear()
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": lambda: events.append(("begin", b"")),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers_done", b"")),
+        "on_part_data": lambda data, start, end: events.append(("data", bytes(data[start:end]))),
+        "on_part_end": lambda: events.append(("end", b"")),
+    })
+
+    files: List[Tuple[str, Path, Dict]] = []
+    fields: Dict[str, str] = {}
+    headers: Dict[bytes, bytes] = {}
+    sink: Optional[_FileSink] = None
+    field_name, field_buf, skip = "", bytearray(), False
+    try:
+        async for chunk in request.stream():
+            budget.consume(len(chunk))
+            try:
+                parser.write(chunk)
+            except MultipartParseError as e:
+                raise HTTPException(status_code=400, detail=f"malformed multipart body: {e}")
+            for kind, data in events:
+                if kind == "begin":
+                    headers, field_buf, skip = {}, bytearray(), False
+                elif kind == "header":
+                    k, _, v = data.partition(b"\0")
+                    headers[k] = v
+                elif kind == "headers_done":
+                    _, disp = parse_options_header(headers.get(b"content-disposition", b""))
+                    field_name = disp.get(b"name", b"").decode("utf-8", "replace")
+                    if b"filename" in disp:
+                        dest = file_dest(field_name, disp[b"filename"].decode("utf-8", "replace"))
+                        skip = dest is None
+                        if dest is not None:
+                            sink = await run_in_threadpool(_FileSink, dest)
+                elif kind == "data":
+                    if sink is not None:
+                        sink.size += len(data)
+                        budget.check_file(sink.size)
+                        await run_in_threadpool(sink.write, data)
+                    elif not skip:
+                        field_buf.extend(data)
+                        if len(field_buf) > MAX_FORM_FIELD_BYTES:
+                            raise HTTPException(status_code=413, detail=f"form field '{field_name}' too large")
+                elif kind == "end":
+                    if sink is not None:
+                        files.append((field_name, sink.dest, await run_in_threadpool(sink.finish)))
+                        sink = None
+                    elif not skip:
+                        fields[field_name] = field_buf.decode("utf-8", "replace")
+            events.clear()
+        parser.finalize()
+        if sink is not None:
+            raise HTTPException(status_code=400, detail="multipart body ended inside a file")
+    except BaseException:
+        if sink is not None:
+            await run_in_threadpool(sink.discard)
+        raise
+    return files, fields
@@ -18,12 +18,26 @@ export const uploadMemory = async (formData) => {
   });
 };
 
+// processing, face detection, story and narration run as server-side jobs;
+// wait for the job and resolve with its result, like the old inline responses
+const JOB_POLL_MS = 1000;
+
+const runJob = async (url) => {
+  const { data: queued } = await api.post(url);
+  for (;;) {
+    const { data: job } = await api.get(queued.status_url);
+    if (job.status === 'done') return { data: job.result };
+    if (job.status === 'failed') throw new Error(job.error || 'job failed');
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_MS));
+  }
+};
+
 export const processMemory = async (memoryId) => {
-  return api.post(`/process/${memoryId}`);
+  return runJob(`/process/${memoryId}`);
 };
 
 export const detectFaces = async (memoryId) => {
-  return api.post(`/faces/${memoryId}/detect`);
+  return runJob(`/faces/${memoryId}/detect`);
 };
 
 export const tagFaces = async (memoryId, tags) => {
@@ -31,11 +45,11 @@ export const tagFaces = async (memoryId, tags) => {
 };
 
 export const generateStory = async (memoryId) => {
-  return api.post(`/generate_story/${memoryId}`);
+  return runJob(`/generate_story/${memoryId}`);
 };
 
 export const narrateStory = async (memoryId) => {
-  return api.post(`/narrate/${memoryId}`);
+  return runJob(`/narrate/${memoryId}`);
 };
 
 export const getMemories = async () => {